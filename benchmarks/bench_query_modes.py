@@ -0,0 +1,168 @@
+"""
+Compares free-text and structured query modes against a local mock Nominatim
+
+The mock knows the addresses of the workbook rows, with some streets missing from its
+"map" and some postal codes differing from the spreadsheet, so both modes have to fall back.
+Reports the number of queries sent per row and how far the queries had to be relaxed.
+
+    python -m benchmarks.bench_query_modes --xls demo_data/DPSiPOC.xlsx
+"""
+
+import argparse
+import json
+import random
+from collections import Counter, defaultdict
+from functools import partial
+from openpyxl import load_workbook
+from requests import Session
+from requests.adapters import HTTPAdapter
+from xl_geocoder import build_address, build_structured_query, resolve, fallback_ladder, sanitize_value
+from tools.cache import LadderCache
+from tools.mock_nominatim import MockNominatim
+from tools.pipeline import IterableSource, AddressStage, ResolveStage, Pipeline
+from tools.ratelimit import TokenBucket
+from tools.street import get_parser
+from tools.structured import parse_query_text, structured_ladder
+
+
+COL_INDXS = {'st_name_num': 4, 'secondary_place_name': 5, 'postal_code': 6,
+             'primary_place_name': 7, 'county': 8, 'province': 9}
+
+
+class World:
+    """Addresses known to the mock server, built from the spreadsheet rows
+
+    Args:
+        rows            - spreadsheet rows
+        missing_streets - (float) - share of streets missing from the map
+        wrong_postcodes - (float) - share of addresses whose postal code differs from the spreadsheet
+    """
+
+    def __init__(self, rows, missing_streets=0.15, wrong_postcodes=0.1, seed=0):
+        rng = random.Random(seed)
+        parse_street = get_parser(building_number_first=True)
+        self.records = []
+        self.index = defaultdict(set)
+        places = set()
+
+        for row in rows:
+            value = {key: sanitize_value(row[i]).lower() for key, i in COL_INDXS.items()}
+            if value['secondary_place_name'] and value['st_name_num']:
+                city, street = value['secondary_place_name'], parse_street(value['st_name_num'])
+            elif value['secondary_place_name']:  # '<village> <building number>'
+                city, street = value['secondary_place_name'], parse_street(value['secondary_place_name'])
+                if ', ' in street:
+                    street, city = street.split(', ', 1)
+            elif value['primary_place_name'] and value['st_name_num']:
+                city, street = value['primary_place_name'], parse_street(value['st_name_num'])
+            else:
+                continue
+            # '12, ul. hynka' -> number and street name, '12' -> village building number
+            number, _, street = street.partition(', ')
+            if not number[:1].isdigit():
+                number, street = '', number
+
+            postcode = value['postal_code']
+            if postcode[-1:].isdigit() and rng.random() < wrong_postcodes:
+                postcode = postcode[:-1] + str((int(postcode[-1]) + 1) % 10)
+            common = dict(city=city, county=value['county'], state=value['province'], postcode=postcode)
+
+            if (city, postcode) not in places:
+                places.add((city, postcode))
+                self.add(**common)
+                self.add(county=value['county'], state=value['province'])
+
+            if rng.random() >= missing_streets:
+                self.add(number=number, street=street, **common)
+                if street:
+                    self.add(street=street, **common)
+
+    def add(self, **record):
+        record = {key: value for key, value in record.items() if value}
+        i = len(self.records)
+        self.records.append(record)
+        for field, value in record.items():
+            self.index[field, value].add(i)
+            self.index[None, value].add(i)
+
+    def _match(self, constraints):
+        candidates = None
+        for key in constraints:
+            ids = self.index.get(key, set())
+            candidates = ids if candidates is None else candidates & ids
+        return bool(candidates)
+
+    def known(self, query):
+        if '=' in query:
+            params = parse_query_text(query)
+            constraints = [(field, params[param]) for param, field in
+                           [('city', 'city'), ('county', 'county'), ('state', 'state'), ('postalcode', 'postcode')]
+                           if param in params]
+            if 'street' in params:
+                number, _, street = params['street'].partition(' ')
+                if number[:1].isdigit():
+                    constraints += [('number', number)] + ([('street', street)] if street else [])
+                else:
+                    constraints.append(('street', params['street']))
+            return self._match(constraints)
+        return self._match([(None, part) for part in query.split(', ')])
+
+
+def run(rows, world, structured, concurrency):
+    build = build_structured_query if structured else build_address
+
+    with MockNominatim(known=world.known) as server, Session() as session:
+        session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+        resolve_address = partial(resolve, session=session, limiter=TokenBucket(1000), url=server.url,
+                                  ladder_cache=LadderCache(), structured=structured)
+        stages = [AddressStage(partial(build, col_indxs=COL_INDXS)), ResolveStage(resolve_address, concurrency)]
+        items = list(Pipeline(IterableSource(rows), stages))
+
+    relaxed = Counter()
+    found = 0
+    for item in items:
+        address, gc, query = item.address, item.gc, item.query
+        if not address:
+            relaxed['no address'] += 1
+            continue
+        ladder = structured_ladder(parse_query_text(address)) if structured else fallback_ladder(address)
+        if gc.ok:
+            found += 1
+            relaxed[ladder.index(query) if query in ladder else 'skipped'] += 1
+        else:
+            relaxed['not found'] += 1
+
+    return {
+        'mode': 'structured' if structured else 'free_text',
+        'rows': len(items),
+        'unique_queries': len({item.address for item in items}),
+        'requests': len(server.requests),
+        'requests_per_row': round(len(server.requests) / len(items), 3),
+        'found': found,
+        'relaxed_steps': {str(key): value for key, value in sorted(relaxed.items(), key=str)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--xls', default='demo_data/DPSiPOC.xlsx')
+    parser.add_argument('--missing-streets', type=float, default=0.15)
+    parser.add_argument('--wrong-postcodes', type=float, default=0.1)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--output', help='save the report as JSON')
+    args = parser.parse_args()
+
+    ws = load_workbook(args.xls, read_only=True).active
+    rows = list(ws.iter_rows(min_row=2, values_only=True))
+    world = World(rows, args.missing_streets, args.wrong_postcodes)
+
+    report = [run(rows, world, structured, args.concurrency) for structured in (False, True)]
+
+    print(f'{"mode":<12}{"rows":>7}{"unique":>8}{"requests":>10}{"req/row":>9}{"found":>7}  relaxed steps')
+    for r in report:
+        print(f'{r["mode"]:<12}{r["rows"]:>7}{r["unique_queries"]:>8}{r["requests"]:>10}'
+              f'{r["requests_per_row"]:>9}{r["found"]:>7}  {r["relaxed_steps"]}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as writer:
+            json.dump(report, writer, indent=2, ensure_ascii=False)
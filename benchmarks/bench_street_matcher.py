@@ -0,0 +1,82 @@
+"""
+Measures StreetMatcher lookup time on a synthetic street dictionary
+
+Streets are spread over places like in Poland - a few large cities with thousands of streets
+and many small places. Queries are dictionary names with a random typo.
+
+    python -m benchmarks.bench_street_matcher -n 300000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from tools.street_matcher import StreetMatcher
+
+
+ONSETS = ['b', 'c', 'ch', 'cz', 'd', 'dz', 'f', 'g', 'h', 'j', 'k', 'l', 'ł', 'm', 'n', 'p', 'r', 'rz', 's', 'sz',
+          't', 'w', 'z', 'ż', 'ś', 'br', 'kr', 'pr', 'st', 'gr', 'tr', 'sk', 'dr', 'wr']
+SYLLABLES = [onset + vowel for onset in ONSETS for vowel in 'aeiouyąęó']
+ENDINGS = ['', '', 'ska', 'skiego', 'owa', 'na', 'wa', 'ego', 'ka', 'cka']
+PATRONS = ['świętego', 'generała', 'księdza', 'marszałka', 'profesora', '']
+
+
+def street_name(rng):
+    words = [(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))) + rng.choice(ENDINGS)).capitalize()
+             for _ in range(rng.randint(1, 2))]
+    patron = rng.choice(PATRONS)
+    return ' '.join([patron] + words if patron else words)
+
+
+def typo(name, rng):
+    i = rng.randrange(1, len(name) - 1)
+    kind = rng.choice(['swap', 'drop', 'replace'])
+    if kind == 'swap':
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    if kind == 'drop':
+        return name[:i] + name[i + 1:]
+    return name[:i] + rng.choice('aeiouyklmnprstwz') + name[i + 1:]
+
+
+def build(n, rng):
+    """Returns StreetMatcher and list of (place, street) of the dictionary"""
+    matcher = StreetMatcher(cache_size=0)
+    places = [(f'miasto {i}', 5000) for i in range(10)] + [(f'wieś {i}', 100) for i in range(n)]
+    streets = []
+    for place, size in places:
+        for _ in range(size):
+            if len(streets) == n:
+                return matcher, streets
+            street = street_name(rng)
+            matcher.add(place, street)
+            streets.append((place, street))
+    return matcher, streets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=300000, help='number of streets in the dictionary')
+    parser.add_argument('-q', '--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    matcher, streets = build(args.n, rng)
+    print(f'{len(matcher):,} streets indexed in {time.perf_counter() - start:.1f} s\n')
+
+    queries = [(place, 'ul. ' + typo(street, rng)) for place, street in rng.sample(streets, args.queries)]
+    timings = {'large places (5000 streets)': [], 'small places (100 streets)': []}
+    corrected = 0
+    for place, street in queries:
+        start = time.perf_counter()
+        result = matcher.correct(place, street)
+        elapsed = time.perf_counter() - start
+        timings['large places (5000 streets)' if place.startswith('miasto') else 'small places (100 streets)'].append(elapsed)
+        corrected += result != street
+
+    for label, values in timings.items():
+        if values:
+            values.sort()
+            print(f'{label:<30} {len(values):>7} queries  mean {statistics.mean(values) * 1e6:7.0f} µs'
+                  f'  p99 {values[int(len(values) * 0.99)] * 1e6:7.0f} µs')
+    print(f'\ncorrected: {corrected / len(queries):.1%}')
@@ -0,0 +1,60 @@
+"""
+Compares parse_street_name with StreetNameParser on a synthetic list of street names
+
+    python -m benchmarks.bench_street_parser -n 1000000
+"""
+
+import argparse
+import random
+import time
+from tools.street import parse_street_name, StreetNameParser
+
+
+STREETS = ['ul. Hynka', 'ul. Fromborska', 'ul. św. Jerzego', 'al. gen. Hallera', '3 Maja', '11-go listopada',
+           'ul. Leśna', 'ul. Długa', 'pl. Wolności', 'ul. ks. Popiełuszki', 'Lubkowo', 'ul. Gdańska']
+NUMBERS = ['12', '24', '7a', '2 B', '17/1243', '2-6', r'17\23', '5/a']
+
+CONFIG = {
+    'name_filter': ['dz.', 'ew.', 'działki', 'nr', 'obręb'],
+    'expand_abbrev': {'św.': 'świętego', 'gen.': 'generała', 'ks.': 'księdza', 'al.': 'aleja', 'pl.': 'plac'},
+    'remove_abbrev': False,
+    'building_number_first': True,
+}
+
+
+def street_names(n, unique, seed=0):
+    """Returns n names drawn from `unique` distinct ones"""
+    rng = random.Random(seed)
+    pool = [f'{rng.choice(STREETS)} {rng.randint(1, 300)}{rng.choice(["", "a", "/2"])}'
+            if i % 2 else f'{rng.choice(STREETS)} {rng.choice(NUMBERS)}' for i in range(unique)]
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def measure(label, function, names, baseline=None):
+    start = time.perf_counter()
+    results = function(names)
+    elapsed = time.perf_counter() - start
+    speedup = f', x{baseline / elapsed:.1f}' if baseline else ''
+    print(f'{label:<36} {elapsed:8.2f} s  {len(names) / elapsed:12,.0f} names/s{speedup}')
+    return results, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=1000000, help='number of names')
+    parser.add_argument('-u', '--unique', type=int, default=50000, help='number of distinct names')
+    args = parser.parse_args()
+
+    names = street_names(args.n, args.unique)
+    print(f'{args.n:,} names, {args.unique:,} distinct\n')
+
+    expected, baseline = measure('parse_street_name',
+                                 lambda names: [parse_street_name(name, **CONFIG) for name in names], names)
+
+    compiled = StreetNameParser(cache_size=0, **CONFIG)
+    results, _ = measure('StreetNameParser (no memoization)', compiled.parse_many, names, baseline)
+    assert results == expected
+
+    memoized = StreetNameParser(cache_size=None, **CONFIG)
+    results, _ = measure('StreetNameParser.parse_many', memoized.parse_many, names, baseline)
+    assert results == expected
@@ -0,0 +1,168 @@
+"""
+Measures the whole script on a synthetic workbook against a local mock Nominatim
+
+A workbook of benchmarks.workbook is geocoded by `python xl_geocoder.py` (in a separate process,
+in a temporary directory with its own config.yaml and cache). The mock answers after `latency`
+seconds, doesn't find `miss_rate` of the queries (the fallback ladder shortens them) and answers
+`too_many_requests` of the requests with HTTP 429 (the script slows down and retries them).
+
+Reports rows per second, peak memory of the script and time of every stage, taken from the
+run's report.json. The results are saved as JSON and compared with an earlier result:
+
+    python -m benchmarks.bench_xl_geocoder -n 20000 --output before.json
+    python -m benchmarks.bench_xl_geocoder -n 20000 --compare before.json
+
+With --compare the exit code is 1 if rows per second dropped by more than --tolerance.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from benchmarks.workbook import save_workbook
+from tools.mock_nominatim import MockNominatim
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+RESULT_VERSION = 1
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'xl_geocoder.py')
+
+
+def bench_config(xls_path, col_indxs, url, rate_limit, concurrency, retry_delay):
+    """Returns config.yaml contents of the benchmark run"""
+    return {
+        'xls': {'path': xls_path, 'has_header': True, 'min_row': 2, 'max_row': None, 'max_column': None,
+                'profile_rows': None},
+        'address': {'col_indxs': col_indxs, 'illegal_street_names': ['dz.', 'ew.', 'działki', 'nr', 'obręb'],
+                    'abbrev_expansions': {'św.': 'świętego', 'gen.': 'generała'}, 'remove_abbrev': False},
+        'strict_search': False,
+        'geocoder': {'url': url, 'rate_limit': rate_limit, 'concurrency': concurrency, 'query_mode': 'free_text',
+                     'max_retries': 3, 'retry_delay': retry_delay},
+        'cache': {'path': 'geocode_cache.sqlite', 'ttl_days': None, 'max_entries': None},
+        'gazetteer': None,
+        'street_dictionary': None,
+        'output': {'epsg': 2180},
+    }
+
+
+def peak_rss_mb():
+    """Returns peak resident memory of the finished child processes in MB, None if it's unknown"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)  # bytes on macOS, KB elsewhere
+
+
+def run(args):
+    """Geocodes a synthetic workbook with the script, returns the result dict"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        xls_path = os.path.join(work_dir, 'synthetic.xlsx')
+        col_indxs = save_workbook(xls_path, args.n, args.duplicates, args.seed)
+
+        with MockNominatim(latency=args.latency, miss_rate=args.miss_rate,
+                           too_many_requests=args.too_many_requests, seed=args.seed) as server:
+            config = bench_config(xls_path, col_indxs, server.url, args.rate_limit, args.concurrency,
+                                  args.retry_delay)
+            with open(os.path.join(work_dir, 'config.yaml'), 'w', encoding='utf-8') as writer:
+                yaml.safe_dump(config, writer)
+
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, SCRIPT, '--log-level', 'WARNING'], cwd=work_dir,
+                                     capture_output=True, text=True)
+            seconds = time.perf_counter() - start
+            if process.returncode:
+                raise RuntimeError(f'xl_geocoder.py failed:\n{process.stderr}')
+            requests = len(server.requests)
+
+        with open(glob.glob(os.path.join(work_dir, 'output_*', 'report.json'))[0], encoding='utf-8') as reader:
+            report = json.load(reader)
+
+    summary = report['summary']
+    metrics = report['metrics']
+    return {
+        'version': RESULT_VERSION,
+        'params': {key: getattr(args, key) for key in ('n', 'duplicates', 'latency', 'miss_rate',
+                                                       'too_many_requests', 'rate_limit', 'concurrency',
+                                                       'retry_delay', 'seed')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'seconds': round(seconds, 3),  # including interpreter start and imports
+        'rows_per_second': round(summary['rows'] / seconds, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'requests': requests,
+        'summary': summary,
+        'stages': {name: timer['seconds'] for name, timer in metrics['timers'].items()},
+        'geocoder_latency': {key: metrics['histograms'].get('geocoder_latency', {}).get(key)
+                             for key in ('p50', 'p90', 'p99')},
+        'status_codes': metrics['counters'].get('status_code', {}),
+    }
+
+
+def change(new, old):
+    if not old or new is None:
+        return ''
+    return f'{(new - old) / old:+.1%}'
+
+
+def print_result(result, baseline=None):
+    baseline = baseline or {}
+    rows = [('rows/s', result['rows_per_second'], baseline.get('rows_per_second')),
+            ('seconds', result['seconds'], baseline.get('seconds')),
+            ('peak RSS (MB)', result['peak_rss_mb'], baseline.get('peak_rss_mb')),
+            ('requests', result['requests'], baseline.get('requests'))]
+    rows += [(name, seconds, (baseline.get('stages') or {}).get(name)) for name, seconds in result['stages'].items()]
+    print(f'{"":<24}{"result":>14}' + (f'{"baseline":>14}{"change":>10}' if baseline else ''))
+    for label, value, old in rows:
+        line = f'{label:<24}{value if value is not None else "-":>14}'
+        if baseline:
+            line += f'{old if old is not None else "-":>14}{change(value, old):>10}'
+        print(line)
+    print(f'\n{result["summary"]["found"]} of {result["summary"]["rows"]} rows found, '
+          f'status codes: {result["status_codes"]}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=5000, help='number of rows')
+    parser.add_argument('--duplicates', type=float, default=0.2, help='share of rows with a repeated address')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds of every mock answer')
+    parser.add_argument('--miss-rate', type=float, default=0.1, help='share of queries that are not found')
+    parser.add_argument('--too-many-requests', type=float, default=0.0,
+                        help='share of requests answered with HTTP 429')
+    parser.add_argument('--rate-limit', type=float, default=500, help='requests per second')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--retry-delay', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the result as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='result saved earlier with --output')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed drop of rows per second compared with the baseline, default 0.2 (20%%)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as reader:
+            baseline = json.load(reader)
+        if baseline['params'] != {key: getattr(args, key) for key in baseline['params']}:
+            print(f'Warning: baseline parameters differ - {baseline["params"]}\n')
+
+    result = run(args)
+    print_result(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as writer:
+            json.dump(result, writer, indent=2, ensure_ascii=False)
+
+    if baseline and result['rows_per_second'] < baseline['rows_per_second'] * (1 - args.tolerance):
+        print(f'\nRegression: rows/s dropped by more than {args.tolerance:.0%}')
+        raise SystemExit(1)
@@ -0,0 +1,108 @@
+"""
+Generates a synthetic workbook of Polish addresses for benchmarks
+
+Rows are spread like in the real registers: most of them in towns and cities (street and
+building number, own postal code), the rest in villages with named streets and in small
+villages whose buildings have numbers only. A share of the rows repeats the address of an
+earlier row (`duplicates`), e.g. several institutions in one building.
+
+    python -m benchmarks.workbook synthetic.xlsx -n 100000 --duplicates 0.2
+
+The columns follow COL_INDXS - copy the printed `col_indxs` to config.yaml.
+"""
+
+import argparse
+import random
+from openpyxl import Workbook
+from benchmarks.bench_street_matcher import SYLLABLES, street_name
+
+
+HEADER = ['LP', 'ULICA', 'MIEJSC1', 'KOD', 'MIEJSC2', 'POWIAT', 'WOJEWÓDZTWO']
+COL_INDXS = {'st_name_num': 1, 'secondary_place_name': 2, 'postal_code': 3,
+             'primary_place_name': 4, 'county': 5, 'province': 6}
+
+# city, county, province, first digits of its postal codes
+CITIES = [
+    ('Warszawa', 'Warszawa', 'Mazowieckie', '0'), ('Kraków', 'Kraków', 'Małopolskie', '3'),
+    ('Łódź', 'Łódź', 'Łódzkie', '9'), ('Wrocław', 'Wrocław', 'Dolnośląskie', '5'),
+    ('Poznań', 'Poznań', 'Wielkopolskie', '6'), ('Gdańsk', 'Gdańsk', 'Pomorskie', '8'),
+    ('Szczecin', 'Szczecin', 'Zachodniopomorskie', '7'), ('Bydgoszcz', 'Bydgoszcz', 'Kujawsko-Pomorskie', '8'),
+    ('Lublin', 'Lublin', 'Lubelskie', '2'), ('Białystok', 'Białystok', 'Podlaskie', '1'),
+    ('Chojnice', 'Chojnicki', 'Pomorskie', '8'), ('Pelplin', 'Tczewski', 'Pomorskie', '8'),
+    ('Nowy Targ', 'Nowotarski', 'Małopolskie', '3'), ('Ełk', 'Ełcki', 'Warmińsko-Mazurskie', '1'),
+    ('Kłodzko', 'Kłodzki', 'Dolnośląskie', '5'), ('Sanok', 'Sanocki', 'Podkarpackie', '3'),
+]
+STREET_PREFIXES = ['ul. '] * 8 + ['al. ', 'pl. ', 'os. ', '']
+VILLAGE_SUFFIXES = ['owo', 'ice', 'ów', 'ino', 'no', 'ki', 'ka', 'y']
+
+
+def postal_code(prefix, rng):
+    return f'{prefix}{rng.randint(0, 9)}-{rng.randint(0, 999):03d}'
+
+
+def building_number(rng):
+    number = str(rng.choices([rng.randint(1, 30), rng.randint(1, 250)], [3, 1])[0])
+    return number + rng.choice(['', '', '', '', 'a', 'b', f'/{rng.randint(1, 40)}'])
+
+
+def village_name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 2))).capitalize() + rng.choice(VILLAGE_SUFFIXES)
+
+
+def address(rng, streets):
+    """Returns address columns (street, village, postal code, town, county, province) of a new row"""
+    city, county, province, prefix = rng.choice(CITIES)
+    kind = rng.random()
+    if kind < 0.7:  # town or city
+        street = rng.choice(streets[city])
+        return street + ' ' + building_number(rng), None, postal_code(prefix, rng), city, county, province
+    village = village_name(rng)
+    if kind < 0.9:  # village with named streets, postal code of the nearby town
+        street = rng.choice(STREET_PREFIXES) + street_name(rng)
+        return street + ' ' + building_number(rng), village, postal_code(prefix, rng), city, county, province
+    return None, village + ' ' + building_number(rng), postal_code(prefix, rng), city, county, province
+
+
+def generate_rows(n, duplicates=0.2, seed=0):
+    """Yields n rows, the first column is the row's ordinal number
+
+    Args:
+        n          - (int) - number of rows
+        duplicates - (float) - share of the rows repeating the address of an earlier row
+        seed       - (int) - the same seed gives the same rows
+    """
+    rng = random.Random(seed)
+    streets = {city: [rng.choice(STREET_PREFIXES) + street_name(rng) for _ in range(500)] for city, *_ in CITIES}
+    addresses = []
+    for i in range(1, n + 1):
+        if addresses and rng.random() < duplicates:
+            columns = rng.choice(addresses)
+        else:
+            columns = address(rng, streets)
+            addresses.append(columns)
+        yield (i,) + columns
+
+
+def save_workbook(path, n, duplicates=0.2, seed=0):
+    """Saves the rows of generate_rows with HEADER in the first row, returns COL_INDXS"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Dane')
+    ws.append(HEADER)
+    for row in generate_rows(n, duplicates, seed):
+        ws.append(row)
+    wb.save(path)
+    return COL_INDXS
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='workbook to create')
+    parser.add_argument('-n', type=int, default=10000, help='number of rows')
+    parser.add_argument('--duplicates', type=float, default=0.2, help='share of rows with a repeated address')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    col_indxs = save_workbook(args.path, args.n, args.duplicates, args.seed)
+    print(f'{args.n:,} rows saved to {args.path}\n\naddress:\n  col_indxs:')
+    for key, i in col_indxs.items():
+        print(f'    {key}: {i}')
@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+import shapefile
+from openpyxl import Workbook
+from xl_geocoder import batch_jobs, geocode_batch, output_name
+from tools.mock_nominatim import MockNominatim
+from tools.ratelimit import SharedTokenBucket
+
+
+COL_INDXS = {'st_name_num': 0, 'secondary_place_name': 1, 'postal_code': 2,
+             'primary_place_name': 3, 'county': 4, 'province': 5}
+
+_limiter = None
+
+
+def _set_limiter(limiter):
+    global _limiter
+    _limiter = limiter
+
+
+def _acquire(n):
+    for _ in range(n):
+        _limiter.acquire()
+    return time.monotonic()
+
+
+def _slow_down():
+    _limiter.slow_down()
+
+
+def save_workbook(path, sheets):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        ws.append(['adres', 'dzielnica', 'kod', 'miasto', 'powiat', 'wojewodztwo'])
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+class test_shared_token_bucket(unittest.TestCase):
+
+    def test_rate_across_processes(self):
+        limiter = SharedTokenBucket(20)
+        start = time.monotonic()
+        with ProcessPoolExecutor(2, initializer=_set_limiter, initargs=(limiter,)) as executor:
+            finished = list(executor.map(_acquire, [10, 10]))
+        # 20 tokens at 20 per second, the first one is free
+        self.assertGreaterEqual(max(finished) - start, 0.9)
+        self.assertGreater(limiter.waited, 0)
+
+    def test_adaptation_is_shared(self):
+        limiter = SharedTokenBucket(8)
+        with ProcessPoolExecutor(1, initializer=_set_limiter, initargs=(limiter,)) as executor:
+            executor.submit(_slow_down).result()
+        self.assertEqual((limiter.rate, limiter.slowdowns), (4, 1))
+
+
+class test_batch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.dir.name, 'in')
+        os.makedirs(self.input_dir)
+        gdansk = [(f'{i} ul. Długa', None, None, 'Gdańsk', None, None) for i in range(1, 6)]
+        sopot = [(f'{i} ul. Morska', None, None, 'Sopot', None, None) for i in range(1, 4)]
+        save_workbook(os.path.join(self.input_dir, 'a.xlsx'), {'Dane 1': gdansk, 'Dane 2': sopot, 'Notes': []})
+        save_workbook(os.path.join(self.input_dir, 'b.xlsx'), {'Dane': gdansk[:2]})
+        save_workbook(os.path.join(self.input_dir, '~$a.xlsx'), {'Dane': []})
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def config(self, url):
+        return {
+            'xls': {'path': None, 'has_header': True, 'min_row': 2, 'max_row': None, 'max_column': None},
+            'address': {'col_indxs': COL_INDXS, 'illegal_street_names': None, 'abbrev_expansions': None,
+                        'remove_abbrev': False},
+            'strict_search': True,
+            'geocoder': {'url': url, 'rate_limit': 20, 'concurrency': 2},
+            'cache': {'path': os.path.join(self.dir.name, 'cache.sqlite')},
+        }
+
+    def test_jobs(self):
+        a, b = os.path.join(self.input_dir, 'a.xlsx'), os.path.join(self.input_dir, 'b.xlsx')
+        self.assertEqual(batch_jobs(self.input_dir), [(a, None), (b, None)])
+        self.assertEqual(batch_jobs(self.input_dir, ['Dane*']), [(a, 'Dane 1'), (a, 'Dane 2'), (b, 'Dane')])
+        self.assertEqual(batch_jobs(os.path.join(self.input_dir, 'b*.xlsx'), ['*']), [(b, 'Dane')])
+        self.assertEqual(output_name(a, 'Dane 1'), 'a_Dane_1')
+
+    def test_batch(self):
+        output_dir = os.path.join(self.dir.name, 'out')
+        jobs = batch_jobs(self.input_dir, ['Dane*'])
+        with MockNominatim() as server:
+            results = dict(geocode_batch(self.config(server.url), jobs, output_dir, workers=2))
+            first_run = len(server.requests)
+            again = dict(geocode_batch(self.config(server.url), jobs, os.path.join(self.dir.name, 'again'), workers=2))
+
+        self.assertEqual({job: summary['found'] for job, summary in results.items()},
+                         {jobs[0]: 5, jobs[1]: 3, jobs[2]: 2})
+        self.assertLessEqual(first_run, 5 + 3 + 2)
+        self.assertGreaterEqual(first_run, 5 + 3)
+        self.assertEqual(len(server.requests), first_run)  # everything came from the shared cache
+        self.assertEqual(sum(summary['cache_hits'] for summary in again.values()), 10)
+
+        with shapefile.Reader(os.path.join(output_dir, 'a_Dane_2', 'a_Dane_2')) as shp:
+            queries = [record['QUERY'] for record in shp.records()]
+        self.assertEqual(len(queries), 3)
+        for i, query in enumerate(queries, 1):
+            self.assertTrue(query.startswith(f'{i} ul. Morska, Sopot'))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'b_Dane', 'journal.jsonl')))
+        with open(os.path.join(output_dir, 'b_Dane', 'log.txt'), encoding='utf-8') as reader:
+            log = reader.read()
+        self.assertIn('2 rows (2 found)', log)
+        self.assertNotIn('Requested', log)  # the geocoder package's line per request is DEBUG only
+        with open(os.path.join(output_dir, 'b_Dane', 'report.json'), encoding='utf-8') as reader:
+            report = json.load(reader)
+        self.assertEqual(report['summary']['rows'], 2)
+        self.assertIn('stage.resolve', report['metrics']['timers'])
+
+        # all workers together keep the rate limit
+        times = sorted(t for t, _ in server.requests)
+        for i, t in enumerate(times):
+            self.assertLessEqual(len([u for u in times[i:] if u - t < 1]), 20 + 1)
+
+    def test_failed_job(self):
+        jobs = [(os.path.join(self.input_dir, 'a.xlsx'), 'Missing sheet')]
+        results = list(geocode_batch(self.config('http://127.0.0.1:9/search'), jobs, self.dir.name, workers=1))
+        self.assertIsInstance(results[0][1], KeyError)
+        with open(os.path.join(self.dir.name, 'a_Missing_sheet', 'log.txt'), encoding='utf-8') as reader:
+            log = reader.read()
+        self.assertIn('Geocoding of a_Missing_sheet failed', log)
+        self.assertIn('Traceback', log)
+
+
+if __name__ == '__main__':
+    unittest.main()
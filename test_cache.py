@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+from requests import Session
+from xl_geocoder import FakeGC, resolve, fallback_ladder
+from tools.cache import GeocodeCache, LadderCache, CachedGC, normalize_query
+from tools.mock_nominatim import MockNominatim
+
+
+class test_geocode_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = GeocodeCache(':memory:')
+        self.found = CachedGC(True, 'OK', 200, 5.0, {'x': 18.6, 'y': 54.4}, 54.4, 18.6, 9)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query(' 12,  ul. Hynka ,Gdańsk '), '12, ul. hynka, gdańsk')
+        self.assertEqual(normalize_query('12, UL. HYNKA, Gdańsk'), '12, ul. hynka, gdańsk')
+
+    def test_positive_result(self):
+        self.assertIsNone(self.cache.get('12, ul. Hynka, Gdańsk'))
+        self.assertTrue(self.cache.set('12, ul. Hynka, Gdańsk', self.found))
+
+        gc = self.cache.get('12,ul. Hynka,Gdańsk')
+        self.assertTrue(gc.ok)
+        self.assertEqual((gc.lat, gc.lng, gc.confidence), (54.4, 18.6, 9))
+        self.assertEqual(gc.osm, {'x': 18.6, 'y': 54.4})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_negative_result(self):
+        self.assertTrue(self.cache.set('Nowhere', FakeGC(False, 'ERROR - No results found', 200)))
+        gc = self.cache.get('Nowhere')
+        self.assertFalse(gc.ok)
+        self.assertIn('No results', gc.status)
+
+    def test_errors_are_not_cached(self):
+        self.assertFalse(self.cache.set('Gdańsk', FakeGC(False, 'ERROR - 429 Too Many Requests', 429)))
+        self.assertFalse(self.cache.set('Gdańsk', FakeGC(False, 'ERROR - INCORRECT ADDRESS')))
+        self.assertIsNone(self.cache.get('Gdańsk'))
+
+    def test_ttl(self):
+        cache = GeocodeCache(':memory:', ttl=60)
+        with mock.patch('tools.cache.time.time', return_value=1000):
+            cache.set('Gdańsk', self.found)
+        with mock.patch('tools.cache.time.time', return_value=1030):
+            self.assertIsNotNone(cache.get('Gdańsk'))
+        with mock.patch('tools.cache.time.time', return_value=1061):
+            self.assertIsNone(cache.get('Gdańsk'))
+        cache.close()
+
+    def test_max_entries(self):
+        cache = GeocodeCache(':memory:', max_entries=2)
+        for t, query in enumerate(['a', 'b', 'c']):
+            with mock.patch('tools.cache.time.time', return_value=t):
+                if query == 'c':
+                    cache.get('a')  # 'b' becomes the least recently used entry
+                cache.set(query, self.found)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        cache.close()
+
+    def test_eviction_in_batches(self):
+        cache = GeocodeCache(':memory:', max_entries=100)
+        with mock.patch.object(GeocodeCache, '__len__', wraps=cache.__len__) as count:
+            for query in range(150):
+                cache.set(str(query), self.found)
+        self.assertEqual(count.call_count, 5)  # trimmed to 90 entries at the 101st, 112th, ... 145th insert
+        self.assertEqual(len(cache), 95)
+        self.assertIsNone(cache.get('0'))
+        cache.close()
+
+
+class test_ladder_cache(unittest.TestCase):
+
+    def test_fallback_ladder(self):
+        self.assertEqual(fallback_ladder('12, ul. Hynka, Gdańsk'), ['12, ul. Hynka, Gdańsk', 'ul. Hynka, Gdańsk', 'Gdańsk'])
+        self.assertEqual(fallback_ladder('Gdańsk'), ['Gdańsk'])
+
+    def test_known_misses_are_skipped(self):
+        addresses = ['1, ul. Nieznana, Gdańsk', '2, ul. Nieznana, Gdańsk', '3, ul. Nieznana, Gdańsk']
+        ladder_cache = LadderCache()
+
+        with MockNominatim(known=lambda query: 'nieznana' not in query) as server, Session() as session:
+            results = [resolve(address, session, url=server.url, ladder_cache=ladder_cache) for address in addresses]
+
+        self.assertEqual([query for _, query in results], ['Gdańsk'] * 3)
+        self.assertTrue(all(gc.ok for gc, _ in results))
+        # the full addresses are always sent, the street known to miss and the town's result are not
+        self.assertEqual([query for _, query in server.requests],
+                         ['1, ul. Nieznana, Gdańsk', 'ul. Nieznana, Gdańsk', 'Gdańsk',
+                          '2, ul. Nieznana, Gdańsk', '3, ul. Nieznana, Gdańsk'])
+        self.assertEqual(ladder_cache.skipped, 2)
+
+    def test_missing_county_doesnt_stop_other_rows(self):
+        ladder_cache = LadderCache()
+
+        with MockNominatim(known=lambda query: 'nieznana' not in query and query != 'pucki') as server, \
+                Session() as session:
+            gc, query = resolve('1, ul. Nieznana, Pucki', session, url=server.url, ladder_cache=ladder_cache)
+            self.assertEqual((gc.ok, query), (False, 'Pucki'))
+            gc, query = resolve('12, ul. Długa, Puck, Pucki', session, url=server.url, ladder_cache=ladder_cache)
+
+        self.assertTrue(gc.ok)
+        self.assertEqual(query, '12, ul. Długa, Puck, Pucki')
+        self.assertEqual(server.requests[-1][1], '12, ul. Długa, Puck, Pucki')
+
+    def test_bounded(self):
+        ladder_cache = LadderCache(max_entries=2)
+        for query in ['a', 'b', 'c']:
+            ladder_cache.add(query, FakeGC(False, 'ERROR - No results found', 200))
+        ladder_cache.add('d', FakeGC(False, 'ERROR - Connection timed out'))  # not cacheable
+        self.assertEqual(len(ladder_cache), 2)
+        self.assertIsNone(ladder_cache.get('a'))
+        self.assertIsInstance(ladder_cache.get('b'), CachedGC)
+
+    def test_misses_from_previous_runs(self):
+        cache = GeocodeCache(':memory:')
+        cache.set('ul. Nieznana, Gdańsk', FakeGC(False, 'ERROR - No results found', 200))
+        ladder_cache = LadderCache(cache)
+
+        self.assertEqual([ladder_cache.skip(query) for query in fallback_ladder('1, ul. Nieznana, Gdańsk')],
+                         [False, True, False])
+        self.assertEqual(ladder_cache.skipped, 1)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+import shapefile
+import numpy as np
+from tools.crs import get_crs, find_crs
+from tools.shp import create_prj_file, PointBatch
+
+
+class test_crs(unittest.TestCase):
+
+    def test_wkt(self):
+        self.assertEqual(get_crs(4326).wkt, 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,'
+                                            '298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+        wkt = get_crs(2180).wkt
+        self.assertTrue(wkt.startswith('PROJCS["ETRS_1989_Poland_CS92",GEOGCS["GCS_ETRS_1989"'))
+        self.assertIn('PARAMETER["False_Northing",-5300000.0]', wkt)
+        self.assertIn('PARAMETER["Scale_Factor",0.9993]', wkt)
+        self.assertIn('PARAMETER["Central_Meridian",15.0]', get_crs(32633).wkt)
+
+    def test_unknown_code(self):
+        with self.assertRaises(ValueError):
+            get_crs(9999)
+
+    def test_transform(self):
+        x, y = get_crs(2180).transform([19.0, 21.006, 18.6466], [52.0, 52.2318, 54.3486])
+        self.assertAlmostEqual(x[0], 500000.0, places=3)
+        self.assertAlmostEqual(y[0], 459309.209, places=2)
+        self.assertAlmostEqual(x[1], 636952.481, places=2)
+        self.assertAlmostEqual(y[1], 486978.944, places=2)
+        self.assertAlmostEqual(x[2], 477035.704, places=2)
+        self.assertAlmostEqual(y[2], 720558.329, places=2)
+
+        x, y = get_crs(3857).transform([18.6466], [54.3486])
+        self.assertAlmostEqual(x[0], 2075730.017, places=2)
+
+        x, y = get_crs(4326).transform([18.6466], [54.3486])
+        self.assertEqual((x[0], y[0]), (18.6466, 54.3486))
+
+    def test_inverse(self):
+        lng, lat = np.meshgrid(np.linspace(14.0, 24.2, 50), np.linspace(49.0, 55.0, 50))
+        for epsg in (2180, 2177, 3857, 32634):
+            crs = get_crs(epsg)
+            lng2, lat2 = crs.inverse(*crs.transform(lng, lat))
+            self.assertLess(np.abs(lng2 - lng).max(), 1e-8, epsg)  # ~1 mm
+            self.assertLess(np.abs(lat2 - lat).max(), 1e-8, epsg)
+
+    def test_find_crs(self):
+        for epsg in (4326, 2180, 2178, 32633, 3857):
+            self.assertEqual(find_crs(get_crs(epsg).wkt + '\n'), epsg)
+        self.assertEqual(find_crs('PROJCS["ETRS_1989_Poland_CS92",GEOGCS["GCS_ETRS_1989",DATUM["D_ETRS_1989"]]]'), 2180)
+        with self.assertRaises(ValueError):
+            find_crs('PROJCS["Unknown",GEOGCS["GCS_WGS_1984"]]')
+
+
+class test_point_batch(unittest.TestCase):
+
+    def test_reprojected_points(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'points')
+            with shapefile.Writer(path, 1) as shp, PointBatch(shp, 2180, batch_size=2) as points:
+                shp.field('NAME', 'C', 10)
+                for name in ['a', 'b', 'c']:
+                    points.add(19.0, 52.0, [name])
+                self.assertEqual(points.count, 2)
+            create_prj_file(path + '.prj', 2180)
+
+            with shapefile.Reader(path) as shp:
+                self.assertEqual([record[0] for record in shp.records()], ['a', 'b', 'c'])
+                x, y = shp.shape(2).points[0]
+                self.assertAlmostEqual(x, 500000.0, places=3)
+                self.assertAlmostEqual(y, 459309.209, places=2)
+            with open(path + '.prj') as reader:
+                self.assertIn('ETRS_1989_Poland_CS92', reader.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
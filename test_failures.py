@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from openpyxl import load_workbook
+from tools.failures import FailureSink
+
+
+class test_failure_sink(unittest.TestCase):
+
+    header = ['LP', 'ULICA', 'query', 'gc_status', 'gc_status_code', 'gc_timeout']
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'NO_RESULTS_test.xlsx')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_xlsx_saved_on_close(self):
+        with FailureSink(self.path, self.header) as sink:
+            sink.append((1, 'Hynka 12', None, 'ERROR - INCORRECT ADDRESS', -999, -999))
+            sink.append((2, datetime(2018, 2, 20), 'Gdańsk', 'ERROR - No results found', 200, 5.0))
+
+        self.assertFalse(os.path.exists(sink.csv_path))
+        rows = list(load_workbook(self.path, read_only=True).active.values)
+        self.assertEqual(rows[0], tuple(self.header))
+        self.assertEqual(rows[2], (2, datetime(2018, 2, 20), 'Gdańsk', 'ERROR - No results found', 200, 5))
+
+    def test_partial_output(self):
+        sink = FailureSink(self.path, self.header, flush_every=2)
+        sink.append((1, 'Hynka 12', None, 'ERROR - INCORRECT ADDRESS', -999, -999))
+        sink.append((2, 'Leśna 12', 'Chojnice', 'ERROR - No results found', 200, 5.0))
+
+        # the process is killed before close
+        with open(sink.csv_path, encoding='utf-8-sig') as reader:
+            lines = reader.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[2], '2,Leśna 12,Chojnice,ERROR - No results found,200,5.0')
+        sink.close()
+
+    def test_nothing_to_save(self):
+        with FailureSink(self.path, self.header):
+            pass
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+from xl_geocoder import address_components
+from tools.gazetteer import Gazetteer
+
+
+class test_gazetteer(unittest.TestCase):
+
+    columns = {'place': 'miejscowosc', 'street': 'ulica', 'number': 'numer', 'lat': 'y', 'lng': 'x'}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.dir.name, 'points.csv')
+        with open(self.csv_path, 'w', encoding='utf-8') as writer:
+            writer.write('miejscowosc;ulica;numer;x;y\n'
+                         'Gdańsk;Hynka;12;18.5576;54.3829\n'
+                         'Gdańsk;Świętego Jerzego;2B;18.6;54.4\n'
+                         'Gdańsk;gen. Hallera;1;18.62;54.38\n'
+                         'Lubkowo;;7;18.1;54.7\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_lookup(self):
+        gazetteer = Gazetteer.open(self.csv_path, columns=self.columns, delimiter=';')
+
+        self.assertEqual(gazetteer.lookup('Gdańsk', 'ul. Hynka', '12'), (54.3829, 18.5576))
+        self.assertEqual(gazetteer.lookup('GDAŃSK', 'ul.  świętego Jerzego', '2 b'), (54.4, 18.6))
+        self.assertEqual(gazetteer.lookup('Lubkowo', '', '7'), (54.7, 18.1))
+        self.assertIsNone(gazetteer.lookup('Gdańsk', 'ul. Hynka', '14'))
+        self.assertEqual((gazetteer.hits, gazetteer.misses), (3, 1))
+
+    def test_row_components(self):
+        gazetteer = Gazetteer.open(self.csv_path, columns=self.columns, delimiter=';')
+        col_indxs = {'st_name_num': 0, 'secondary_place_name': 1, 'postal_code': 2,
+                     'primary_place_name': 3, 'county': 4, 'province': 5}
+
+        for row in [('ul. Hynka 12', None, '80-465', 'Gdańsk', 'Gdańsk', None),
+                    ('ul. św. Jerzego 2 B', None, '80-001', 'Gdańsk', 'Gdańsk', None),
+                    (None, 'Lubkowo 7', None, None, 'Pucki', None)]:
+            components = address_components(row, col_indxs, abbrev_dict={'św.': 'świętego'})
+            gc = gazetteer.lookup_gc(components['city'], components['street'], components['number'])
+            self.assertTrue(gc.ok)
+
+    def test_index_file(self):
+        index_path = os.path.join(self.dir.name, 'points.idx')
+        built = Gazetteer.open(self.csv_path, index_path, self.columns, ';')
+        self.assertTrue(os.path.exists(index_path))
+
+        os.remove(self.csv_path)
+        open(self.csv_path, 'w').close()
+        os.utime(self.csv_path, (0, 0))  # older than the index
+        loaded = Gazetteer.open(self.csv_path, index_path, self.columns, ';')
+        self.assertEqual(len(loaded), len(built))
+        self.assertEqual(loaded.lookup('Gdańsk', 'Hynka', '12'), (54.3829, 18.5576))
+
+        # other settings than those of the index - it's built again from the (now empty) file
+        self.assertEqual(len(Gazetteer.open(self.csv_path, index_path, self.columns, ',')), 0)
+
+    def test_register_abbreviations(self):
+        abbrev_dict = {'gen.': 'generała'}
+        index_path = os.path.join(self.dir.name, 'points.idx')
+        self.assertIsNone(Gazetteer.open(self.csv_path, index_path, self.columns, ';')
+                          .lookup('Gdańsk', 'ul. generała Hallera', '1'))
+        gazetteer = Gazetteer.open(self.csv_path, index_path, self.columns, ';', abbrev_dict)  # rebuilt
+        self.assertEqual(gazetteer.lookup('Gdańsk', 'ul. generała Hallera', '1'), (54.38, 18.62))
+        loaded = Gazetteer.open(self.csv_path, index_path, self.columns, ';', abbrev_dict)
+        self.assertEqual(loaded.lookup('Gdańsk', 'ul. generała Hallera', '1'), (54.38, 18.62))
+        self.assertEqual(loaded.parse_street('gen. Hallera'), 'generała Hallera')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import datetime
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import unittest
+from tools.cache import CachedGC
+from tools.crs import get_crs
+from tools.gpkg import GeoPackageWriter, column_names, layer_name
+from tools.pipeline import Item, GeoPackageSink
+from xl_geocoder import output_formats
+
+
+class test_geopackage(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'out.gpkg')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_writer(self):
+        fields = [['LP', 'N', 3, 0], ['ULICA', 'C', 10], ['DATA', 'D', 8], ['KWOTA', 'N', 6, 2], ['OK', 'L', 1]]
+        points = [(18.6466, 54.3486), (18.5, 54.5), (19.0, 52.0)]
+        with GeoPackageWriter(self.path, 'dane', fields, epsg=2180, batch_size=2) as gpkg:
+            for i, (lng, lat) in enumerate(points, 1):
+                gpkg.add(lng, lat, (i, 'ul. Świętego Jerzego ' * 5, datetime.datetime(2018, 7, i), 1.5, True))
+
+        db = sqlite3.connect(self.path)
+        self.assertEqual(db.execute('PRAGMA application_id').fetchone()[0], 0x47504B47)
+        rows = db.execute('SELECT fid, geom, LP, ULICA, DATA, KWOTA, OK FROM dane ORDER BY fid').fetchall()
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][2:], (1, 'ul. Świętego Jerzego ' * 5, '2018-07-01', 1.5, 1))  # text isn't truncated
+
+        magic, version, flags, srs_id, byte_order, geometry_type, x, y = struct.unpack('<2sBBiBIdd', rows[0][1])
+        self.assertEqual((magic, flags, srs_id, geometry_type), (b'GP', 1, 2180, 1))
+        xs, ys = get_crs(2180).transform([18.6466], [54.3486])
+        self.assertAlmostEqual(x, xs[0], places=6)
+        self.assertAlmostEqual(y, ys[0], places=6)
+
+        # the spatial index finds the points by extent
+        index = db.execute('SELECT id FROM rtree_dane_geom WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?',
+                           (x + 1, x - 1, y + 1, y - 1)).fetchall()
+        self.assertEqual(index, [(1,)])
+        self.assertEqual(db.execute('SELECT count(*) FROM rtree_dane_geom').fetchone()[0], 3)
+
+        contents = db.execute('SELECT data_type, min_y, max_y, srs_id FROM gpkg_contents').fetchone()
+        self.assertEqual(contents[0], 'features')
+        self.assertLess(contents[1], contents[2])
+        self.assertEqual(contents[3], 2180)
+        self.assertEqual(db.execute("SELECT organization_coordsys_id FROM gpkg_spatial_ref_sys "
+                                    "WHERE srs_id = 2180").fetchone(), (2180,))
+        self.assertEqual(db.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger'").fetchone(), (6,))
+        db.close()
+
+    def test_sink(self):
+        gc = CachedGC(True, 'OK', 200, 1.0, "{'display_name': 'Gdańsk'}", 54.4, 18.6, 7.5)
+        with GeoPackageSink(self.path, 'a_Dane', [['ADRES', 'C', 20]], [['STREET_FIX', 'C', 255]]) as sink:
+            sink.write(Item(2, ('12 ul. Hynka',), query='12, ul. Hynka, Gdańsk', gc=gc, extra=['-']))
+
+        db = sqlite3.connect(self.path)
+        self.assertEqual(db.execute('SELECT ADRES, QUERY, OSM_ANSW, CONFIDENCE, STREET_FIX FROM a_Dane').fetchall(),
+                         [('12 ul. Hynka', '12, ul. Hynka, Gdańsk', "{'display_name': 'Gdańsk'}", 7.5, '-')])
+        db.close()
+
+    def test_osm_answer_as_json(self):
+        osm = {'display_name': 'Gdańsk', 'importance': None, 'bbox': [54.2, 54.4], 'exact': True}
+        gc = CachedGC(True, 'OK', 200, 1.0, osm, 54.4, 18.6, 7.5)
+        with GeoPackageSink(self.path, 'a_Dane', [['ADRES', 'C', 20]]) as sink:
+            sink.write(Item(2, ('12 ul. Hynka',), query='12, ul. Hynka, Gdańsk', gc=gc))
+
+        db = sqlite3.connect(self.path)
+        self.assertEqual(json.loads(db.execute('SELECT OSM_ANSW FROM a_Dane').fetchone()[0]), osm)
+        db.close()
+
+    def test_names(self):
+        self.assertEqual(column_names([['LP'], [None], ['lp'], ['geom'], ['Nazwa "DPS"']]),
+                         ['LP', 'field_2', 'lp_2', 'geom_2', 'Nazwa DPS'])
+        self.assertEqual(layer_name('2018 dane-Gdańsk'), 'layer_2018_dane_Gdańsk')
+        self.assertEqual(output_formats(None), ['shp'])
+        self.assertEqual(output_formats({'format': 'gpkg, geojsonl'}), ['gpkg', 'geojsonl'])
+        with self.assertRaises(ValueError):
+            output_formats({'format': ['shp', 'kml']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import csv
+import datetime
+import os
+import tempfile
+import unittest
+from tools.cache import CachedGC
+from tools.incremental import address_hash, PreviousResults, PreviousRunStage
+from tools.failures import FailureSink
+from tools.pipeline import Item, IterableSource, AddressStage, ShapefileSink, FAILURE_COLUMNS
+
+
+COL_INDXS = {'st_name_num': 1, 'primary_place_name': 2}
+
+
+class test_address_hash(unittest.TestCase):
+
+    def test_normalization(self):
+        self.assertEqual(address_hash((1, '12  ul. Hynka ', 'Gdańsk'), COL_INDXS),
+                         address_hash((2, '12 ul. Hynka', 'Gdańsk'), COL_INDXS))  # other columns don't matter
+        self.assertEqual(address_hash((None, 12.0, datetime.datetime(2018, 7, 21)), COL_INDXS),
+                         address_hash((None, 12, datetime.date(2018, 7, 21)), COL_INDXS))
+        self.assertNotEqual(address_hash((None, '12 ul. Hynka', 'Gdańsk'), COL_INDXS),
+                            address_hash((None, '14 ul. Hynka', 'Gdańsk'), COL_INDXS))
+        self.assertEqual(address_hash((None, 'Gdańsk'), {'st_name_num': 1, 'county': 5}),
+                         address_hash((None, 'Gdańsk', None), {'st_name_num': 1, 'county': 5}))
+
+
+class test_previous_run(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'previous')
+        self.report_path = os.path.join(self.dir.name, 'CHANGES.csv')
+        fields = [['ID', 'N', 5, 0], ['ADDRESS', 'C', 50], ['CITY', 'C', 20]]
+        with ShapefileSink(self.path, fields, epsg=2180) as shp:
+            for number, (row, lat) in enumerate([((1, '12 ul. Hynka', 'Gdańsk'), 54.4),
+                                                 ((2, '24 ul. Fromborska', 'Gdańsk'), 54.5),
+                                                 ((3, '1 ul. Długa', 'Gdańsk'), 54.3)], 2):
+                gc = CachedGC(True, 'OK', 200, 1.0, "{'x': 18.6}", lat, 18.6, 7.5)
+                shp.write(Item(number, row, gc=gc, query=f'{row[1]}, {row[2]}'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    address_stage = AddressStage(lambda row: f'{row[1]}, {row[2]}' if row[1] else None)
+
+    def test_copy(self):
+        previous = PreviousResults(self.path + '.shp', COL_INDXS)
+        self.assertEqual(len(previous), 3)
+        stage = PreviousRunStage(previous, COL_INDXS, self.report_path)
+        rows = [(10, '24 ul. Fromborska', 'Gdańsk'), (11, '12 ul. Hynka', 'Gdańsk'), (12, '7 ul. Nowa', 'Gdańsk')]
+        items = list(stage(self.address_stage(iter(IterableSource(rows, start=2)))))
+
+        self.assertEqual(items[0].query, '24 ul. Fromborska, Gdańsk')
+        self.assertEqual(items[0].resolved_by, 'previous')
+        self.assertAlmostEqual(items[0].gc.lat, 54.5, places=9)  # transformed back from EPSG:2180
+        self.assertAlmostEqual(items[0].gc.lng, 18.6, places=9)
+        self.assertEqual((items[0].gc.osm, items[0].gc.confidence), ("{'x': 18.6}", 7.5))
+        self.assertIsNone(items[2].gc)
+        self.assertEqual((stage.copied, stage.changed, stage.removed), (2, 1, 1))
+
+        with open(self.report_path, encoding='utf-8-sig') as reader:
+            report = list(csv.reader(reader))
+        self.assertEqual(report, [['row', 'change', 'query'],
+                                  ['2', 'unchanged', '24 ul. Fromborska, Gdańsk'],
+                                  ['3', 'unchanged', '12 ul. Hynka, Gdańsk'],
+                                  ['4', 'new or changed', '7 ul. Nowa, Gdańsk'],
+                                  ['', 'removed', '1 ul. Długa, Gdańsk']])
+
+
+    def test_not_found_before(self):
+        failures_path = os.path.join(self.dir.name, 'NO_RESULTS_previous.xlsx')
+        with FailureSink(failures_path, ['ID', 'ADDRESS', 'CITY'] + FAILURE_COLUMNS + ['street_fix']) as sink:
+            sink.append((4, '50 Wichulec', 'Brodnicki', '50 Wichulec, Brodnicki', 'ERROR - No results found', 200,
+                         -999, '-'))
+            sink.append((5, None, 'Brodnicki', None, 'ERROR - INCORRECT ADDRESS', -999, -999, '-'))
+        previous = PreviousResults(self.path, COL_INDXS, failures_path)
+        stage = PreviousRunStage(previous, COL_INDXS, self.report_path)
+        rows = [(1, '50 Wichulec', 'Brodnicki'), (2, None, 'Brodnicki'), (3, '7 ul. Nowa', 'Gdańsk')]
+        items = list(stage(self.address_stage(iter(IterableSource(rows, start=2)))))
+
+        self.assertTrue(all(item.gc is None for item in items))
+        self.assertEqual((stage.copied, stage.not_found, stage.changed), (0, 1, 1))
+        with open(self.report_path, encoding='utf-8-sig') as reader:
+            report = list(csv.reader(reader))
+        self.assertEqual(report[:3], [['row', 'change', 'query'],
+                                      ['2', 'not found before', '50 Wichulec, Brodnicki'],
+                                      ['4', 'new or changed', '7 ul. Nowa, Gdańsk']])
+
+
+if __name__ == '__main__':
+    unittest.main()
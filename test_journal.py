@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+from xl_geocoder import FakeGC
+from tools.cache import CachedGC
+from tools.journal import Journal
+from tools.pipeline import IterableSource, AddressStage, KnownResultsStage, ResolveStage, Pipeline
+
+
+class test_journal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'journal.jsonl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_replay(self):
+        found = CachedGC(True, 'OK', 200, 5.0, {'x': 18.6, 'y': 54.4}, 54.4, 18.6, 9)
+        with Journal(self.path, fsync_every=1) as journal:
+            journal.append(2, '12, ul. Hynka, Gdańsk', found)
+            journal.append(3, None, FakeGC(False, 'ERROR - INCORRECT ADDRESS'))
+
+        entries = Journal.load(self.path)
+        self.assertEqual(sorted(entries), [2, 3])
+        gc, query = entries[2]
+        self.assertEqual(query, '12, ul. Hynka, Gdańsk')
+        self.assertEqual((gc.ok, gc.lat, gc.lng, gc.confidence, gc.osm), (True, 54.4, 18.6, 9, found.osm))
+        gc, query = entries[3]
+        self.assertFalse(gc.ok)
+        self.assertEqual(gc.status, 'ERROR - INCORRECT ADDRESS')
+
+    def test_partial_entry(self):
+        with Journal(self.path) as journal:
+            journal.append(2, 'Gdańsk', FakeGC(False, 'ERROR - No results found', 200))
+        with open(self.path, 'a', encoding='utf-8') as writer:
+            writer.write('{"row": 3, "que')  # crash in the middle of writing
+
+        self.assertEqual(list(Journal.load(self.path)), [2])
+        with Journal(self.path) as journal:
+            journal.append(3, 'Gdynia', FakeGC(False, 'ERROR - No results found', 200))
+        self.assertEqual(list(Journal.load(self.path)), [2, 3])
+
+    def test_transient_failures_are_not_restored(self):
+        with Journal(self.path) as journal:
+            journal.append(2, 'Gdańsk', FakeGC(False, 'ERROR - 503 Service Unavailable', 503))
+            journal.append(3, 'Gdynia', FakeGC(False, 'ERROR - No results found', 200))
+            journal.append(4, 'Sopot', FakeGC(False, 'ERROR - No results found', 200))
+            journal.append(4, 'Sopot', FakeGC(False, 'ERROR - Connection timed out', 'Unknown'))
+
+        self.assertEqual(sorted(Journal.load(self.path)), [2, 3, 4])
+        self.assertEqual(sorted(Journal.load(self.path, skip_transient=True)), [3])
+
+    def test_done_rows_are_not_resolved(self):
+        resolved = []
+
+        def resolve_address(address):
+            resolved.append(address)
+            return FakeGC(False, 'ERROR - No results found'), address
+
+        done = {1: (FakeGC(False, 'OK'), 'a'), 2: (FakeGC(False, 'OK'), 'b')}
+        resolve_stage = ResolveStage(resolve_address)
+        stages = [AddressStage(lambda row: row[0]), KnownResultsStage(done, 'journal'), resolve_stage]
+        items = list(Pipeline(IterableSource([('a',), ('b',), ('c',), (None,)]), stages))
+
+        self.assertEqual(resolved, ['c'])
+        self.assertEqual(resolve_stage.submitted, 1)
+        self.assertEqual([item.query for item in items], ['a', 'b', 'c', None])
+        self.assertEqual(items[-1].gc.status, 'ERROR - INCORRECT ADDRESS')  # rows without an address aren't resolved
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import time
+import unittest
+from tools.cache import CachedGC
+from tools.metrics import Histogram, Metrics, metrics
+from tools.pipeline import IterableSource, Pipeline
+
+
+class SlowStage:
+
+    name = 'slow'
+
+    def __call__(self, items):
+        for item in items:
+            time.sleep(0.01)
+            item.gc = CachedGC(True, 'OK', 200, 1.0, '', 54.0, 18.0, 5)
+            yield item
+
+
+class test_histogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram((0.1, 0.5, 1.0))
+        self.assertIsNone(histogram.percentile(50))
+        for value in [0.05] * 8 + [0.3, 2.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.percentile(50), 0.1)
+        self.assertEqual(histogram.percentile(90), 0.5)
+        self.assertEqual(histogram.percentile(99), 2.0)  # above the last bound - the maximum
+        report = histogram.to_dict()
+        self.assertEqual(report['count'], 10)
+        self.assertEqual(report['buckets'], {'0.1': 8, '0.5': 1, '1.0': 0, 'inf': 1})
+
+
+class test_metrics(unittest.TestCase):
+
+    def test_report(self):
+        registry = Metrics()
+        registry.add_time('read', 0.5, calls=10)
+        with registry.timer('read'):
+            pass
+        registry.timed('parse', len)('abc')
+        registry.observe('latency', 0.2)
+        registry.count('status_code', 200)
+        registry.count('status_code', 200)
+        registry.count('status_code', 'Unknown')
+        report = registry.report()
+        self.assertEqual(report['timers']['read']['calls'], 11)
+        self.assertGreaterEqual(report['timers']['read']['seconds'], 0.5)
+        self.assertEqual(report['timers']['parse']['calls'], 1)
+        self.assertEqual(report['histograms']['latency']['count'], 1)
+        self.assertEqual(report['counters'], {'status_code': {'200': 2, 'Unknown': 1}})
+        registry.reset()
+        self.assertEqual(registry.report(), {'timers': {}, 'histograms': {}, 'counters': {}})
+
+    def test_pipeline_timers(self):
+        metrics.reset()
+        rows = [(i,) for i in range(10)]
+        self.assertEqual(len(list(Pipeline(IterableSource(rows), [SlowStage()]))), 10)
+        timers = metrics.report()['timers']
+        self.assertEqual(timers['stage.slow']['calls'], 10)
+        self.assertGreaterEqual(timers['stage.slow']['seconds'], 0.1)
+        self.assertLess(timers['read.IterableSource']['seconds'], 0.1)  # the stage's time isn't counted twice
+        metrics.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+from tools.mock_nominatim import MockNominatim
+
+
+class test_mock_nominatim(unittest.TestCase):
+
+    def test_miss_rate(self):
+        with MockNominatim(miss_rate=0.3) as server:
+            queries = [f'{i}, ul. Długa, Gdańsk' for i in range(1000)]
+            missed = [query for query in queries if server.answer({'q': query}) == (200, [])]
+            self.assertAlmostEqual(len(missed) / len(queries), 0.3, delta=0.05)
+            # always the same queries
+            self.assertEqual(missed, [query for query in queries if server.answer({'q': query}) == (200, [])])
+
+    def test_too_many_requests(self):
+        with MockNominatim(too_many_requests=0.2) as server:
+            statuses = [server.answer({'q': 'Gdańsk'})[0] for _ in range(1000)]
+            self.assertEqual(set(statuses), {200, 429})
+            self.assertAlmostEqual(statuses.count(429) / len(statuses), 0.2, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from functools import partial
+from requests import Session
+from xl_geocoder import FakeGC, resolve
+from tools.cache import CachedGC
+from tools.mock_nominatim import MockNominatim
+from tools.pipeline import (Item, CsvSource, IterableSource, AddressStage, KnownResultsStage, ResolveStage,
+                            Pipeline, GeoJSONLSink, read_ahead, profile_fields)
+
+
+def found(address):
+    return CachedGC(True, 'OK', 200, 1.0, {'display_name': address}, 54.4, 18.6, 9)
+
+
+class test_pipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def resolve(self, address):
+        with self.lock:
+            self.calls.append(address)
+        time.sleep(random.random() / 200)
+        if address.startswith('nowhere'):
+            return FakeGC(False, 'ERROR - No results found', 200), address
+        return found(address), address
+
+    def test_order_and_deduplication(self):
+        rows = [(f'street {i % 7}',) for i in range(50)]
+        resolve_stage = ResolveStage(self.resolve, concurrency=4, queue_size=10)
+        pipeline = Pipeline(IterableSource(rows), [AddressStage(lambda row: row[0]), resolve_stage])
+
+        items = list(pipeline)
+        self.assertEqual([item.number for item in items], list(range(1, 51)))
+        self.assertEqual([item.query for item in items], [row[0] for row in rows])
+        self.assertLess(len(self.calls), 50)  # addresses in flight are resolved once
+        self.assertEqual(resolve_stage.submitted, len(self.calls))
+
+    def test_repeated_addresses_without_cache(self):
+        addresses = [f'{i}, ul. Długa, Gdańsk' for i in range(29)] + ['3, ul. Długa, Gdańsk']
+        with MockNominatim() as server, Session() as session:
+            # one row in flight at a time, so the repeated address is resolved long after the first one
+            stages = [AddressStage(lambda row: row[0]),
+                      ResolveStage(partial(resolve, session=session, cache=None, url=server.url), queue_size=1)]
+            items = list(Pipeline(IterableSource([(address,) for address in addresses]), stages, queue_size=1))
+
+        self.assertEqual(len(server.requests), 29)
+        self.assertTrue(items[-1].gc.ok)
+        self.assertEqual(items[-1].query, '3, ul. Długa, Gdańsk')
+
+    def test_backpressure(self):
+        read = []
+
+        def rows():
+            for i in range(100):
+                read.append(i)
+                yield (f'street {i}',)
+
+        stages = [AddressStage(lambda row: row[0]), ResolveStage(self.resolve, concurrency=2, queue_size=5)]
+        items = iter(Pipeline(IterableSource(rows()), stages, queue_size=5))
+        next(items)
+        time.sleep(0.05)
+        self.assertLessEqual(len(read), 5 + 5 + 3)  # read-ahead queue, items in flight and ones being passed on
+        self.assertEqual(len(list(items)), 99)
+
+    def test_sinks(self):
+        rows = [('Hynka 12', 'Gdańsk'), ('nowhere 1', 'Gdańsk'), ('Fromborska 24', 'Gdańsk')]
+        failures = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'out.geojsonl')
+            with GeoJSONLSink(path, ['ULICA', 'MIEJSC'], ['street_fix']) as sink:
+                stages = [AddressStage(lambda row: ', '.join(row), extra=lambda row: ['-']),
+                          KnownResultsStage({3: (found('cached'), 'cached')}, 'journal'),
+                          ResolveStage(self.resolve)]
+                pipeline = Pipeline(IterableSource(rows), stages, [sink], failure_sink=failures)
+                self.assertEqual(pipeline.run(), 3)
+
+            with open(path, encoding='utf-8') as reader:
+                features = [json.loads(line) for line in reader]
+
+        self.assertEqual((pipeline.rows, pipeline.found), (3, 2))
+        self.assertEqual(features[0]['geometry'], {'type': 'Point', 'coordinates': [18.6, 54.4]})
+        self.assertEqual(features[0]['properties']['ULICA'], 'Hynka 12')
+        self.assertEqual(features[0]['properties']['street_fix'], '-')
+        self.assertEqual(features[1]['properties']['query'], 'cached')
+        self.assertEqual(failures, [('nowhere 1', 'Gdańsk', 'nowhere 1, Gdańsk', 'ERROR - No results found', 200, -999, '-')])
+        self.assertEqual(self.calls, ['Hynka 12, Gdańsk', 'nowhere 1, Gdańsk'])
+
+    def test_read_ahead_errors(self):
+        def rows():
+            yield Item(1, ())
+            raise ValueError('broken row')
+
+        items = read_ahead(rows(), 2)
+        self.assertEqual(next(items).number, 1)
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_csv_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rows.csv')
+            with open(path, 'w', encoding='utf-8') as writer:
+                writer.write('ULICA;KOD\nul. Hynka 12;80-465\nul. Leśna 12;\n')
+            source = CsvSource(path, has_header=True, delimiter=';')
+            items = list(source)
+            fields = profile_fields(source)
+
+        self.assertEqual(source.header, ['ULICA', 'KOD'])
+        self.assertEqual([(item.number, item.row) for item in items],
+                         [(2, ('ul. Hynka 12', '80-465')), (3, ('ul. Leśna 12', None))])
+        self.assertEqual(fields, [['ULICA', 'C', 13, 0], ['KOD', 'C', 6, 0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
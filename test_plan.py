@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+from functools import partial
+from xl_geocoder import FakeGC, query_ladder
+from tools.cache import GeocodeCache, CachedGC
+from tools.gazetteer import LocalGC
+from tools.pipeline import IterableSource, AddressStage
+from tools.plan import Planner, PlanWriter, PlanStage, plan_differences, read_plan_settings
+
+
+def found(address):
+    return CachedGC(True, 'OK', 200, 1.0, {'display_name': address}, 54.4, 18.6, 9)
+
+
+class test_planner(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = GeocodeCache(':memory:')
+
+    def tearDown(self):
+        self.cache.close()
+
+    def plan(self, rows, strict_search=False):
+        planner = Planner(partial(query_ladder, strict_search=strict_search), self.cache, rate=2)
+        items = planner(AddressStage(lambda row: row[0])(iter(IterableSource(rows))))
+        return list(items), planner.report()
+
+    def test_query_ladder(self):
+        self.assertEqual(query_ladder('12, ul. Hynka, Gdańsk'), ['12, ul. Hynka, Gdańsk', 'ul. Hynka, Gdańsk', 'Gdańsk'])
+        self.assertEqual(query_ladder('12, ul. Hynka, Gdańsk', strict_search=True), ['12, ul. Hynka, Gdańsk'])
+        self.assertEqual(query_ladder('ul. Hynka, Gdańsk', strict_search=True), [])
+        self.assertEqual(query_ladder(None), [])
+
+    def test_counts(self):
+        rows = [('12, ul. Hynka, Gdańsk',), ('12, ul. HYNKA,  Gdańsk',), ('24, ul. Fromborska, Gdańsk',), (None,)]
+        items, report = self.plan(rows)
+        self.assertEqual(len(items), 4)
+        self.assertEqual((report['rows'], report['rejected'], report['distinct_queries']), (4, 1, 2))
+        self.assertEqual(report['cache_hits'], 0)
+        self.assertEqual(report['best_case_queries'], 2)
+        # the shared 'Gdańsk' query is sent once
+        self.assertEqual(report['worst_case_queries'], 5)
+        self.assertEqual((report['best_case_seconds'], report['worst_case_seconds']), (1.0, 2.5))
+
+    def test_cache(self):
+        self.cache.set('12, ul. Hynka, Gdańsk', found('12, ul. Hynka, Gdańsk'))
+        self.cache.set('24, ul. Fromborska, Gdańsk', FakeGC(False, 'ERROR - No results found', 200))
+        self.cache.set('ul. Fromborska, Gdańsk', FakeGC(False, 'ERROR - No results found', 200))
+        rows = [('12, ul. Hynka, Gdańsk',), ('24, ul. Fromborska, Gdańsk',), ('1, ul. Długa, Gdańsk',)]
+        _, report = self.plan(rows)
+        self.assertEqual(report['cache_hits'], 1)
+        self.assertEqual(report['best_case_queries'], 2)  # 'Gdańsk' and '1, ul. Długa, Gdańsk'
+        self.assertEqual(report['worst_case_queries'], 3)  # and 'ul. Długa, Gdańsk'
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))  # peeking doesn't count
+
+    def test_strict_search(self):
+        _, report = self.plan([('12, ul. Hynka, Gdańsk',), ('ul. Hynka, Gdańsk',)], strict_search=True)
+        self.assertEqual((report['rejected'], report['distinct_queries'], report['worst_case_queries']), (1, 1, 1))
+
+
+class test_plan_file(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'plan.jsonl')
+        self.settings = {'address': {'col_indxs': {'st_name_num': 0}}, 'strict_search': False}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_plan(self, rows):
+        stage = AddressStage(lambda row: row[0], extra=lambda row: [row[0] and row[0].upper()])
+        with PlanWriter(self.path, self.settings) as plan:
+            for item in stage(iter(IterableSource(rows))):
+                if item.number == 2:
+                    item.gc, item.resolved_by = LocalGC(54.4, 18.6, 'gdańsk|hynka|12'), 'gazetteer'
+                plan.write(item)
+            plan.close({'rows': len(rows)})
+
+    def test_round_trip(self):
+        rows = [('24, ul. Fromborska, Gdańsk',), ('12, ul. Hynka, Gdańsk',), (None,)]
+        self.write_plan(rows)
+        self.assertEqual(read_plan_settings(self.path), self.settings)
+
+        stage = PlanStage(self.path)
+        items = list(stage(iter(IterableSource(rows))))
+        self.assertEqual([item.address for item in items], [row[0] for row in rows])
+        self.assertEqual(items[0].extra, ['24, UL. FROMBORSKA, GDAŃSK'])
+        self.assertIsNone(items[0].gc)
+        self.assertEqual((items[1].gc.lat, items[1].gc.lng, items[1].resolved_by), (54.4, 18.6, 'gazetteer'))
+        self.assertEqual((stage.rejected, stage.resolved), (1, 1))
+
+    def test_partial_rows(self):
+        rows = [('24, ul. Fromborska, Gdańsk',), ('12, ul. Hynka, Gdańsk',), ('1, ul. Długa, Gdańsk',)]
+        self.write_plan(rows)
+        items = list(PlanStage(self.path)(iter(IterableSource(rows[2:], start=3))))
+        self.assertEqual(items[0].address, '1, ul. Długa, Gdańsk')
+
+        with self.assertRaises(ValueError):
+            list(PlanStage(self.path)(iter(IterableSource(rows + [('2, ul. Długa, Gdańsk',)]))))
+
+    def test_differences(self):
+        self.write_plan([('12, ul. Hynka, Gdańsk',)])
+        self.assertEqual(plan_differences(self.path, self.settings), [])
+        self.assertEqual(plan_differences(self.path, dict(self.settings, strict_search=True)), ['strict_search'])
+
+        with open(self.path, 'w') as writer:
+            writer.write('not a plan\n')
+        with self.assertRaises(ValueError):
+            read_plan_settings(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
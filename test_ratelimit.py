@@ -0,0 +1,77 @@
+import time
+import unittest
+from functools import partial
+from requests import Session
+from requests.adapters import HTTPAdapter
+from xl_geocoder import resolve
+from tools.mock_nominatim import MockNominatim
+from tools.pipeline import IterableSource, AddressStage, ResolveStage, Pipeline
+from tools.ratelimit import TokenBucket, limiter_from_config
+
+
+class test_token_bucket(unittest.TestCase):
+
+    def test_limiter_from_config(self):
+        self.assertAlmostEqual(1 / limiter_from_config(None).rate, 1.2)
+        self.assertAlmostEqual(1 / limiter_from_config({'rate_limit': 20}).rate, 1.2)  # public OSM server
+        self.assertEqual(limiter_from_config({'url': 'http://localhost/search', 'rate_limit': 20}).rate, 20)
+
+    def test_rate(self):
+        bucket = TokenBucket(50)
+        start = time.monotonic()
+        for _ in range(26):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.5)
+
+
+class test_concurrent_geocoding(unittest.TestCase):
+
+    rate = 40
+
+    def geocode(self, server, addresses, concurrency):
+        with Session() as session:
+            session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+            resolve_address = partial(resolve, session=session, limiter=TokenBucket(self.rate), url=server.url)
+            stages = [AddressStage(lambda row: row[0]), ResolveStage(resolve_address, concurrency)]
+            return list(Pipeline(IterableSource([(address,) for address in addresses]), stages))
+
+    def test_rate_limit_compliance(self):
+        addresses = [f'{i}, ul. Długa, Gdańsk' for i in range(40)]
+        with MockNominatim(latency=0.1) as server:
+            items = self.geocode(server, addresses, concurrency=8)
+
+        times = sorted(t for t, _ in server.requests)
+        self.assertEqual(len(times), 40)
+        # any 1 s window holds no more than rate + 1 requests
+        for i, t in enumerate(times):
+            in_window = len([u for u in times[i:] if u - t < 1])
+            self.assertLessEqual(in_window, self.rate + 1)
+        self.assertEqual([item.address for item in items], addresses)
+
+    def test_throughput(self):
+        addresses = [f'{i}, ul. Długa, Gdańsk' for i in range(40)]
+        with MockNominatim(latency=0.1) as server:
+            start = time.monotonic()
+            self.geocode(server, addresses, concurrency=8)
+            elapsed = time.monotonic() - start
+
+        # serial run would take 40 * 0.1 s, the limiter allows ~1 s
+        self.assertLess(elapsed, 2.5)
+
+    def test_deterministic_order_and_dedup(self):
+        addresses = [f'{i % 5}, ul. Długa, Gdańsk' for i in range(30)]
+        with MockNominatim(known=lambda query: not query.startswith('3,')) as server:
+            items = self.geocode(server, addresses, concurrency=4)
+
+        self.assertEqual(len(server.requests), 6)  # 5 addresses + 1 fallback query
+        self.assertEqual([item.address for item in items], addresses)
+        for item in items:
+            if item.address.startswith('3,'):
+                self.assertEqual(item.query, 'ul. Długa, Gdańsk')
+            else:
+                self.assertTrue(item.gc.ok)
+                self.assertEqual(item.query, item.address)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+from collections import Counter
+from functools import partial
+from types import SimpleNamespace
+from requests import Session
+from xl_geocoder import FakeGC, resolve
+from tools.cache import CachedGC, LadderCache
+from tools.mock_nominatim import MockNominatim
+from tools.pipeline import IterableSource, AddressStage, ResolveStage, RetryStage, Pipeline
+from tools.ratelimit import TokenBucket
+from tools.retry import Backoff, is_transient, retry_after
+
+
+def found(address):
+    return CachedGC(True, 'OK', 200, 1.0, {'display_name': address}, 54.4, 18.6, 9)
+
+
+class test_retry_policy(unittest.TestCase):
+
+    def test_is_transient(self):
+        self.assertTrue(is_transient(FakeGC(False, 'ERROR - 429 Client Error: Too Many Requests', 429)))
+        self.assertTrue(is_transient(FakeGC(False, 'ERROR - 503 Server Error', 503)))
+        self.assertTrue(is_transient(FakeGC(False, 'ERROR - Read timed out', 'Unknown')))
+        self.assertFalse(is_transient(FakeGC(False, 'ERROR - No results found', 200)))
+        self.assertFalse(is_transient(FakeGC(False, 'ERROR - 400 Client Error: Bad Request', 400)))
+        self.assertFalse(is_transient(FakeGC(False, 'ERROR - INCORRECT ADDRESS')))
+        self.assertFalse(is_transient(found('Gdańsk')))
+
+    def test_backoff(self):
+        backoff = Backoff(delay=1.0, cap=5.0)
+        for attempt, limit in [(1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0)]:
+            waits = [backoff.wait(attempt) for _ in range(200)]
+            self.assertLessEqual(max(waits), limit)
+            self.assertGreater(max(waits), limit / 2)  # jitter covers the range
+
+        gc = FakeGC(False, 'ERROR - 429', 429)
+        gc.response = SimpleNamespace(headers={'Retry-After': '3'})
+        self.assertEqual(retry_after(gc), 3.0)
+        self.assertGreaterEqual(backoff.wait(1, gc), 3.0)
+        gc.response.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        self.assertIsNone(retry_after(gc))
+
+    def test_adaptive_rate(self):
+        bucket = TokenBucket(8)
+        for _ in range(5):
+            bucket.slow_down()
+        self.assertEqual((bucket.rate, bucket.slowdowns), (0.5, 5))  # not below 1/16 of the rate
+        for _ in range(100):
+            bucket.speed_up()
+        self.assertEqual(bucket.rate, 8)
+
+
+class test_retry_stage(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = Counter()  # calls of RetryStage's resolve_address
+        self.waits = []
+
+    @staticmethod
+    def answer(address):
+        if address.startswith('nowhere'):
+            return FakeGC(False, 'ERROR - No results found', 200), address
+        return found(address), address
+
+    def first_pass(self, address, failures):
+        if address in failures:
+            return FakeGC(False, 'ERROR - 503 Server Error', 503), address
+        return self.answer(address)
+
+    def retry(self, address, failures):
+        """Fails `failures[address]` more times with HTTP 503, then answers"""
+        self.calls[address] += 1
+        if self.calls[address] <= failures[address]:
+            return FakeGC(False, 'ERROR - 503 Server Error', 503), address
+        return self.answer(address)
+
+    def run_pipeline(self, rows, failures, attempts=3):
+        retry_stage = RetryStage(partial(self.retry, failures=failures), Backoff(delay=0.01, attempts=attempts),
+                                 sleep=self.waits.append)
+        failed = []
+        stages = [AddressStage(lambda row: row[0]), ResolveStage(partial(self.first_pass, failures=failures), 2),
+                  retry_stage]
+        pipeline = Pipeline(IterableSource(rows), stages, failure_sink=SimpleNamespace(append=failed.append))
+        return list(pipeline), failed, retry_stage
+
+    def test_recovery(self):
+        rows = [('a',), ('b',), ('a',), ('nowhere',), ('c',)]
+        items, failed, stage = self.run_pipeline(rows, {'a': 1, 'nowhere': 0})
+
+        # deferred rows come out last, found rows don't wait for them
+        self.assertEqual([item.number for item in items][:2], [2, 5])
+        self.assertEqual(sorted(item.number for item in items[2:]), [1, 3, 4])
+        self.assertTrue(all(item.gc.ok for item in items if item.address != 'nowhere'))
+        self.assertEqual(self.calls['a'], 2)  # rows sharing an address are retried together
+        self.assertEqual((stage.deferred, stage.retries, stage.recovered, stage.failed), (3, 3, 3, 0))
+        self.assertEqual([row[-3] for row in failed], ['ERROR - No results found'])  # only the permanent failure
+
+    def test_permanent_failure(self):
+        items, failed, stage = self.run_pipeline([('a',), ('b',)], {'a': 10}, attempts=2)
+        self.assertEqual(self.calls['a'], 2)
+        self.assertEqual((stage.recovered, stage.failed), (0, 1))
+        self.assertEqual([row[0] for row in failed], ['a'])
+        self.assertEqual(failed[0][-2], 503)
+
+
+class test_retries_with_server(unittest.TestCase):
+
+    def test_server_errors(self):
+        answers = Counter()
+
+        def errors(query):
+            answers[query] += 1
+            if query == '12, ul. hynka, gdańsk' and answers[query] <= 2:
+                return 429
+            return None
+
+        limiter = TokenBucket(50)
+        with MockNominatim(errors=errors) as server, Session() as session:
+            resolve_address = partial(resolve, session=session, limiter=limiter, url=server.url,
+                                      ladder_cache=LadderCache())
+            stages = [AddressStage(lambda row: row[0]), ResolveStage(resolve_address),
+                      RetryStage(resolve_address, Backoff(delay=0.05))]
+            items = list(Pipeline(IterableSource([('12, ul. Hynka, Gdańsk',), ('24, ul. Fromborska, Gdańsk',)]),
+                                  stages))
+
+        self.assertTrue(all(item.gc.ok for item in items))
+        self.assertEqual(items[-1].query, '12, ul. Hynka, Gdańsk')  # the fallback ladder wasn't used
+        self.assertEqual(limiter.slowdowns, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
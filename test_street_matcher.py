@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from xl_geocoder import build_address, build_structured_query, street_correction
+from tools.street_matcher import StreetMatcher, trigrams
+
+
+class test_street_matcher(unittest.TestCase):
+
+    columns = {'place': 'miejscowosc', 'street': 'ulica'}
+    col_indxs = {'st_name_num': 0, 'secondary_place_name': 1, 'postal_code': 2,
+                 'primary_place_name': 3, 'county': 4, 'province': 5}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, 'streets.csv')
+        with open(path, 'w', encoding='utf-8') as writer:
+            writer.write('miejscowosc;ulica\n'
+                         'Gdańsk;ul. Hynka\n'
+                         'Gdańsk;Fromborska\n'
+                         'Gdańsk;Świętego Jerzego\n'
+                         'Gdańsk;Hallera\n'
+                         'Sopot;Haffnera\n')
+        self.matcher = StreetMatcher.open(path, self.columns, ';')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('ab'), {'  a', ' ab', 'ab '})
+        self.assertEqual(trigrams(''), set())
+
+    def test_correct(self):
+        self.assertEqual(len(self.matcher), 5)
+        self.assertEqual(self.matcher.correct('Gdańsk', 'ul. Hynak'), 'ul. Hynka')
+        self.assertEqual(self.matcher.correct('GDAŃSK', 'ul. Frombroska'), 'ul. Fromborska')
+        self.assertEqual(self.matcher.correct('Gdańsk', 'ul. świętego Jeżego'), 'ul. Świętego Jerzego')
+        self.assertEqual(self.matcher.correct('Gdańsk', 'ul. hynka'), 'ul. hynka')  # exact match
+        self.assertEqual(self.matcher.correct('Gdańsk', 'ul. Kartuska'), 'ul. Kartuska')  # nothing similar
+        self.assertEqual(self.matcher.correct('Sopot', 'ul. Hynak'), 'ul. Hynak')  # other place
+        self.assertEqual(self.matcher.correct('Gdynia', 'ul. Hynak'), 'ul. Hynak')  # place not in the dictionary
+
+    def test_dictionary_without_places(self):
+        matcher = StreetMatcher()
+        matcher.add(None, 'Hynka')
+        self.assertEqual(matcher.correct('Gdynia', 'Hynak'), 'Hynka')
+
+    def test_build_address(self):
+        row = ('ul. Hynak 12', None, '80-465', 'Gdańsk', 'Gdańsk', 'Pomorskie')
+        self.assertEqual(build_address(row, self.col_indxs, street_matcher=self.matcher), '12, ul. Hynka, Gdańsk')
+        self.assertEqual(build_structured_query(row, self.col_indxs, street_matcher=self.matcher),
+                         'street=12 ul. Hynka; city=Gdańsk; state=Pomorskie; postalcode=80-465')
+        self.assertEqual(street_correction(row, self.col_indxs, self.matcher), 'ul. Hynak -> ul. Hynka')
+
+        row = ('ul. Hynka 12', None, '80-465', 'Gdańsk', 'Gdańsk', 'Pomorskie')
+        self.assertEqual(street_correction(row, self.col_indxs, self.matcher), '')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from requests import Session
+from xl_geocoder import build_structured_query, resolve
+from tools.mock_nominatim import MockNominatim
+from tools.structured import query_text, parse_query_text, structured_ladder
+
+
+class test_structured_query(unittest.TestCase):
+
+    col_indxs = {'st_name_num': 0, 'secondary_place_name': 1, 'postal_code': 2,
+                 'primary_place_name': 3, 'county': 4, 'province': 5}
+
+    def test_build(self):
+        row = ('ul. Leśna 12', None, '89-600', 'Chojnice', 'Chojnicki', 'Pomorskie')
+        self.assertEqual(build_structured_query(row, self.col_indxs),
+                         'street=12 ul. Leśna; city=Chojnice; county=Chojnicki; state=Pomorskie; postalcode=89-600')
+        row = (None, 'Lubkowo 7', '84-100', None, 'Pucki', 'Pomorskie')
+        self.assertEqual(build_structured_query(row, self.col_indxs),
+                         'street=7; city=Lubkowo; county=Pucki; state=Pomorskie; postalcode=84-100')
+        row = ('dz. 12', None, '80-465', 'Gdańsk', 'Gdańsk', 'Pomorskie')
+        self.assertIsNone(build_structured_query(row, self.col_indxs, illegal_street_names=['dz.']))
+
+    def test_query_text(self):
+        components = {'street': '12 ul. Hynka', 'city': 'Gdańsk', 'postalcode': '80-465', 'county': None}
+        self.assertEqual(query_text(components), 'street=12 ul. Hynka; city=Gdańsk; postalcode=80-465')
+        self.assertEqual(parse_query_text(query_text(components)),
+                         {'street': '12 ul. Hynka', 'city': 'Gdańsk', 'postalcode': '80-465'})
+
+    def test_ladder(self):
+        components = {'street': '12 ul. Leśna', 'city': 'Chojnice', 'county': 'Chojnicki', 'postalcode': '89-600'}
+        self.assertEqual(structured_ladder(components), [
+            'street=12 ul. Leśna; city=Chojnice; county=Chojnicki; postalcode=89-600',
+            'street=ul. Leśna; city=Chojnice; county=Chojnicki; postalcode=89-600',
+            'city=Chojnice; county=Chojnicki; postalcode=89-600',
+            'city=Chojnice; county=Chojnicki',
+            'county=Chojnicki'])
+
+    def test_resolve(self):
+        address = 'street=12 ul. Leśna; city=Chojnice; postalcode=89-601'
+        with MockNominatim(known=lambda query: 'postalcode' not in query) as server, Session() as session:
+            gc, query = resolve(address, session, url=server.url, structured=True)
+
+        self.assertTrue(gc.ok)
+        self.assertEqual(query, 'city=Chojnice')
+        self.assertEqual(len(server.requests), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from copy import deepcopy
+from datetime import datetime
+from openpyxl import load_workbook
+from tools.xl import (DEFAULT_PROPERTIES, FieldProfiler, determine_field_properties, profile_worksheet,
+                      get_column_samples_from_worksheet)
+
+
+class test_determine_field_properties(unittest.TestCase):
+
+    def test_defaults_are_not_modified(self):
+        defaults = deepcopy(DEFAULT_PROPERTIES)
+        custom = {str: ['C', 50, 0]}
+
+        self.assertEqual(determine_field_properties('abc', 'auto'), ['C', 3, 0])
+        self.assertEqual(determine_field_properties(1.25, 'auto'), ['N', 4, 2])
+        self.assertEqual(determine_field_properties(1e-05, 'auto'), ['N', 7, 5])
+        field = determine_field_properties('abc', custom)
+        field.insert(0, 'NAME')
+
+        self.assertEqual(DEFAULT_PROPERTIES, defaults)
+        self.assertEqual(custom, {str: ['C', 50, 0]})
+        self.assertEqual(determine_field_properties('abc'), ['C', 255, 0])
+
+
+class test_field_profiler(unittest.TestCase):
+
+    def test_type_widening(self):
+        profiler = FieldProfiler(['INT', 'NUM', 'TEXT', 'MIXED', 'BOOL', 'DATE', 'EMPTY'])
+        rows = [(1, 2, 'Gdańsk', 5, True, datetime(2018, 2, 20), None),
+                (-150, 12.125, 'Hel', 'b', False, datetime(2018, 7, 21), ''),
+                (None, -0.5, None, 2.5, None, None, None)]
+        for row in rows:
+            profiler.update(row)
+
+        self.assertEqual(profiler.fields(), [
+            ['INT', 'N', 4, 0],
+            ['NUM', 'N', 6, 3],
+            ['TEXT', 'C', 7, 0],  # 'ń' takes 2 bytes in utf-8
+            ['MIXED', 'C', 3, 0],
+            ['BOOL', 'L', 1, 0],
+            ['DATE', 'D', 8, 0],
+            ['EMPTY', 'C', 1, 0],
+        ])
+
+    def test_unnamed_and_long_columns(self):
+        profiler = FieldProfiler()
+        profiler.update(('x' * 300, 10 ** 25))
+        self.assertEqual(profiler.fields(), [['A', 'C', 255, 0], ['B', 'C', 26, 0]])
+
+
+class test_worksheet(unittest.TestCase):
+
+    def setUp(self):
+        self.wb = load_workbook('demo_data/DPSiPOC.xlsx', read_only=True)
+        self.ws = self.wb.active
+
+    def tearDown(self):
+        self.wb.close()
+
+    def test_profile_worksheet(self):
+        fields = profile_worksheet(self.ws, has_header=True)
+        self.assertEqual(fields[0], ['LP', 'N', 3, 0])
+        self.assertEqual([field[0] for field in fields[:3]], ['LP', 'TYP', 'IL_MIEJSC'])
+        self.assertTrue(all(field[2] < 255 for field in fields))
+
+        sampled = profile_worksheet(self.ws, has_header=True, sample_rows=9)
+        self.assertEqual(sampled[0], ['LP', 'N', 1, 0])
+
+    def test_column_samples(self):
+        samples = get_column_samples_from_worksheet(self.ws, has_header=True)
+        self.assertEqual(samples[0], ['LP', 1])
+        self.assertEqual(samples[4], ['ULICA', 'ul. Hynka 12'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from xl_geocoder import parse_street_name
+from xl_geocoder import parse_street_name, build_address
+from tools.street import StreetNameParser
 
 
 class test_parse_street_name(unittest.TestCase):
@@ -69,5 +70,57 @@ class test_parse_street_name(unittest.TestCase):
             self.assertEquals(parse_street_name(case, building_number_first=True), answer)
 
 
+class test_street_name_parser(unittest.TestCase):
+
+    def assertSameAsFunction(self, names, **kwargs):
+        parser = StreetNameParser(**kwargs)
+        expected = [parse_street_name(name, **kwargs) for name in names]
+        self.assertEqual(parser.parse_many(names), expected)
+        self.assertEqual(parser.parse_many(names), expected)  # memoized results
+
+    def test_same_results(self):
+        names = list(test_parse_street_name.num_first_cases['positive'])
+        names += list(test_parse_street_name.num_first_cases['negative'])
+        names += ['ul. Dworcowa 35', 'ul. św. Jerzego 20', 'ul. gen. Hallera 3', 'ŚW. Wojciecha dz. 12']
+
+        self.assertSameAsFunction(names, building_number_first=True)
+        self.assertSameAsFunction(names, name_filter=['Krucza', 'dz.', 'ul.'])
+        self.assertSameAsFunction(names, name_filter=['Krucza'], remove_abbrev=True)
+        self.assertSameAsFunction(names, expand_abbrev={'św.': 'świętego', 'gen.': 'generała'},
+                                  remove_abbrev=True, building_number_first=True)
+
+    def test_chained_expansions(self):
+        names = ['ul. św. Jerzego 20', 'al. Jerozolimskie 3']
+        self.assertSameAsFunction(names, expand_abbrev={'św.': 'św. Jerzego', 'Jerzego': 'J.'})
+        self.assertSameAsFunction(names, expand_abbrev={'al.': 'aleja', 'a': 'A'})
+        self.assertSameAsFunction(names, expand_abbrev={'św.': r'\g<0>'})
+
+    def test_overlapping_keys(self):
+        self.assertSameAsFunction(['ul. abc 5'], expand_abbrev={'bc': 'Y', 'ab': 'X'})
+        self.assertEqual(StreetNameParser(expand_abbrev={'bc': 'Y', 'ab': 'X'}).parse('ul. abc 5'), 'ul. aY 5')
+
+
+class test_build_address(unittest.TestCase):
+
+    col_indxs = {'st_name_num': 0, 'secondary_place_name': 1, 'postal_code': 2,
+                 'primary_place_name': 3, 'county': 4, 'province': 5}
+
+    def test_branches(self):
+        self.assertEqual(build_address(('Długa 50', 'Lubkowo', '84-100', 'Puck', 'Pucki', None),
+                                       self.col_indxs), '50, Długa, Lubkowo, Pucki')
+        self.assertEqual(build_address((None, 'Lubkowo 7', None, None, 'Pucki', None),
+                                       self.col_indxs), '7, Lubkowo, Pucki')
+        self.assertEqual(build_address(('ul. Hynka 12', None, '80-465', 'Gdańsk', 'Gdańsk', None),
+                                       self.col_indxs), '12, ul. Hynka, Gdańsk')
+        self.assertEqual(build_address(('ul. Leśna 12', None, '89-600', 'Chojnice', 'Chojnicki', None),
+                                       self.col_indxs), '12, ul. Leśna, Chojnice, Chojnicki')
+        self.assertIsNone(build_address(('ul. Leśna 12', None, None, None, 'Chojnicki', None),
+                                        self.col_indxs))
+
+    def test_illegal_street_name(self):
+        row = ('dz. 123/4', None, None, 'Chojnice', 'Chojnicki', None)
+        self.assertIsNone(build_address(row, self.col_indxs, illegal_street_names=['dz.']))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,13 @@
+import logging
 import yaml
 
 
+log = logging.getLogger(__name__)
+
+
 def load_config(config_file):
     with open(config_file, 'r') as stream:
         try:
             return yaml.safe_load(stream)
         except yaml.YAMLError as e:
-            print(e)
\ No newline at end of file
+            log.error(e)
\ No newline at end of file
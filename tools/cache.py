@@ -0,0 +1,232 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """Returns cache key for the query string
+
+    Case, surrounding whitespace, repeated spaces and spaces around commas are ignored,
+    so 'ul. Hynka 12 ,Gdańsk' and 'UL. HYNKA 12, gdańsk' share one cache entry.
+    """
+    query = re.sub(r'\s+', ' ', str(query)).strip().lower()
+    return re.sub(r'\s*,\s*', ', ', query)
+
+
+class CachedGC:
+    """Simulates geocoder.osm output restored from the cache"""
+
+    def __init__(self, ok, status, status_code=-999, timeout=-999, osm='',
+                 lat=None, lng=None, confidence=0):
+        self.ok = ok
+        self.status = status
+        self.status_code = status_code
+        self.timeout = timeout
+        self.osm = osm
+        self.lat = lat
+        self.lng = lng
+        self.confidence = confidence
+
+
+class GeocodeCache:
+    """Persistent geocoding results cache stored in a SQLite database
+
+    Positive results and "No results" answers are stored, errors (timeouts, HTTP errors)
+    are not, so they will be queried again in the next run.
+    The instance can be shared by geocoding threads, the file - by processes (each opening its own instance).
+
+    Args:
+        path        - (string) - database file location, ':memory:' for a throwaway cache
+        ttl         - (int, optional) - entry lifetime in seconds, None - entries never expire
+        max_entries - (int, optional) - the least recently used entries above this number are
+                                        evicted, None - no size limit. They are evicted in batches,
+                                        down to 90% of max_entries, so the entries are counted
+                                        once per batch, not after every insert
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._count = None  # upper estimate of the number of entries, see _evict
+        self._lock = threading.RLock()
+        # processes sharing the file wait for each other's writes instead of failing
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        if path != ':memory:':
+            self.connection.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' query TEXT PRIMARY KEY,'
+            ' ok INTEGER, status TEXT, status_code INTEGER, timeout REAL,'
+            ' osm TEXT, lat REAL, lng REAL, confidence INTEGER,'
+            ' created REAL, accessed REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self.purge()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    @staticmethod
+    def is_cacheable(gc):
+        """Only definite answers are cached - results and "No results" """
+        return bool(gc.ok) or 'No results' in str(gc.status)
+
+    def get(self, query):
+        """Returns CachedGC for the query or None if it's not in the cache or has expired"""
+        key = normalize_query(query)
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT ok, status, status_code, timeout, osm, lat, lng, confidence, created '
+                'FROM results WHERE query = ?', (key,)).fetchone()
+
+            now = time.time()
+            if row is None or (self.ttl is not None and now - row[8] > self.ttl):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if self.max_entries is not None:  # the access time only matters for the eviction order
+                with self.connection:
+                    self.connection.execute('UPDATE results SET accessed = ? WHERE query = ?', (now, key))
+        ok, status, status_code, timeout, osm, lat, lng, confidence, _ = row
+        return CachedGC(bool(ok), status, status_code, timeout, json.loads(osm), lat, lng, confidence)
+
+    def peek(self, query):
+        """Returns CachedGC for the query like get, but doesn't count it as a hit or a miss
+        and doesn't refresh its position in the eviction order"""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT ok, status, status_code, timeout, osm, lat, lng, confidence, created '
+                'FROM results WHERE query = ?', (normalize_query(query),)).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[8] > self.ttl):
+            return None
+        ok, status, status_code, timeout, osm, lat, lng, confidence, _ = row
+        return CachedGC(bool(ok), status, status_code, timeout, json.loads(osm), lat, lng, confidence)
+
+    def set(self, query, gc):
+        """Stores geocoder.osm (or compatible) output, returns False if gc was not cacheable"""
+        if not self.is_cacheable(gc):
+            return False
+
+        if gc.ok:
+            lat, lng, osm, confidence = gc.lat, gc.lng, gc.osm, gc.confidence
+        else:
+            lat, lng, osm, confidence = None, None, '', 0
+
+        now = time.time()
+        with self._lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (normalize_query(query), int(bool(gc.ok)), gc.status, gc.status_code, gc.timeout,
+                     json.dumps(osm), lat, lng, confidence, now, now))
+            if self._count is not None:
+                self._count += 1  # or the entry was replaced, the estimate can only be too high
+            self._evict()
+        return True
+
+    def purge(self):
+        """Removes expired entries"""
+        with self._lock:
+            if self.ttl is not None:
+                with self.connection:
+                    self.connection.execute('DELETE FROM results WHERE created < ?',
+                                            (time.time() - self.ttl,))
+            self._evict()
+
+    def _evict(self):
+        # entries are counted only when the running estimate exceeds max_entries, not on every insert
+        if self.max_entries is None or (self._count is not None and self._count <= self.max_entries):
+            return
+        count = len(self)
+        excess = count - self.max_entries
+        if excess > 0:
+            excess += self.max_entries // 10
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM results WHERE query IN '
+                    '(SELECT query FROM results ORDER BY accessed LIMIT ?)', (excess,))
+            count -= excess
+        self._count = count
+
+    def close(self):
+        self.connection.close()
+
+
+class LadderCache:
+    """Fallback ladder results shared by all rows of the run
+
+    In non-strict search a row that wasn't found is queried again without the part before
+    the first comma, so many rows end with the same '<town>, <county>' or '<county>' queries.
+    Their results are kept here, together with the queries known to give no results.
+    Only the fallback queries are meant to be added (not the full addresses, which rarely repeat),
+    they are stored as CachedGC and the least recently used ones above `max_entries` are dropped,
+    so memory use doesn't grow with the number of rows.
+    Fallback queries known to give no results are skipped (if 'ul. X, Town' wasn't found for one
+    building, the other buildings on that street go on to 'Town' without sending it again). Only the
+    known misses themselves are skipped - a more specific query may still be found even if its suffix
+    isn't (e.g. a street in a county whose name alone isn't found) - see skip.
+
+    Args:
+        cache       - (GeocodeCache, optional) - "No results" answers from the previous runs
+                                                 are also treated as known misses
+        max_entries - (int, optional) - number of results kept, None - no limit
+    """
+
+    def __init__(self, cache=None, max_entries=100000):
+        self.cache = cache
+        self.max_entries = max_entries
+        self.skipped = 0  # ladder steps not queried thanks to known misses
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, query):
+        """Returns gc of the query if it was already resolved in this run, otherwise None"""
+        key = normalize_query(query)
+        with self._lock:
+            gc = self._results.get(key)
+            if gc is not None:
+                self._results.move_to_end(key)
+            return gc
+
+    def add(self, query, gc):
+        if not GeocodeCache.is_cacheable(gc):
+            return
+        if gc.ok:
+            gc = CachedGC(True, gc.status, gc.status_code, gc.timeout, gc.osm, gc.lat, gc.lng, gc.confidence)
+        else:
+            gc = CachedGC(False, gc.status, gc.status_code, gc.timeout)
+        key = normalize_query(query)
+        with self._lock:
+            self._results[key] = gc
+            self._results.move_to_end(key)
+            if self.max_entries is not None and len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def is_miss(self, query):
+        gc = self.get(query)
+        if gc is None and self.cache is not None:
+            gc = self.cache.peek(query)
+        return gc is not None and not gc.ok
+
+    def skip(self, query):
+        """Returns True if the fallback query is a known miss and is not worth sending"""
+        if not self.is_miss(query):
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
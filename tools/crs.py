@@ -0,0 +1,197 @@
+"""Bundled coordinate reference systems, no network access required
+
+ESRI WKT (.prj contents) of common EPSG codes, plus NumPy transformations of WGS 84
+longitudes and latitudes to their coordinates. ETRS89 based systems (e.g. EPSG:2180) are
+treated as WGS 84 based - the datums differ by less than a meter, far below geocoding accuracy.
+
+    crs = get_crs(2180)
+    crs.wkt                          # contents of the .prj file
+    x, y = crs.transform(lng, lat)   # arrays of coordinates
+    lng, lat = crs.inverse(x, y)
+"""
+
+import numpy as np
+
+
+WGS_1984 = ('WGS_1984', 6378137.0, 298.257223563)
+GRS_1980 = ('GRS_1980', 6378137.0, 298.257222101)
+
+
+class CRS:
+    """Coordinate reference system
+
+    Args:
+        name       - (string) - ESRI name, e.g. 'ETRS_1989_Poland_CS92'
+        geogcs     - (tuple) - (geographic CRS name, datum name, spheroid)
+        projection - (string, optional) - ESRI projection name, None - geographic coordinates
+        parameters - ESRI projection parameters, e.g. False_Easting=500000.0
+    """
+
+    def __init__(self, name, geogcs, projection=None, **parameters):
+        self.name = name
+        self.geogcs = geogcs
+        self.projection = projection
+        self.parameters = parameters
+
+    @property
+    def is_geographic(self):
+        return self.projection is None
+
+    @property
+    def spheroid(self):
+        return self.geogcs[2]
+
+    def wkt_for(self, name=None):
+        """Returns ESRI WKT, `name` replaces the CRS name"""
+        gcs_name, datum, (spheroid, a, inverse_f) = self.geogcs
+        geogcs = (f'GEOGCS["{name if self.is_geographic and name else gcs_name}",'
+                  f'DATUM["{datum}",SPHEROID["{spheroid}",{a},{inverse_f}]],'
+                  f'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+        if self.is_geographic:
+            return geogcs
+        parameters = ','.join(f'PARAMETER["{key}",{float(value)}]' for key, value in self.parameters.items())
+        return f'PROJCS["{name or self.name}",{geogcs},PROJECTION["{self.projection}"],{parameters},UNIT["Meter",1.0]]'
+
+    @property
+    def wkt(self):
+        return self.wkt_for()
+
+    def transform(self, lng, lat):
+        """Returns (x, y) arrays of WGS 84 longitudes and latitudes (sequences or arrays, in degrees)"""
+        lng = np.asarray(lng, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        if self.is_geographic:
+            return lng, lat
+        if self.projection == 'Transverse_Mercator':
+            p = self.parameters
+            return transverse_mercator(lng, lat, self.spheroid[1], 1 / self.spheroid[2], p['Central_Meridian'],
+                                       p['Scale_Factor'], p['False_Easting'], p['False_Northing'])
+        if self.projection == 'Mercator_Auxiliary_Sphere':
+            return web_mercator(lng, lat, self.spheroid[1])
+        raise NotImplementedError(f'Unsupported projection: {self.projection}')
+
+    def inverse(self, x, y):
+        """Returns (lng, lat) arrays of WGS 84 longitudes and latitudes (in degrees) of the coordinates"""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.is_geographic:
+            return x, y
+        if self.projection == 'Transverse_Mercator':
+            p = self.parameters
+            return inverse_transverse_mercator(x, y, self.spheroid[1], 1 / self.spheroid[2], p['Central_Meridian'],
+                                               p['Scale_Factor'], p['False_Easting'], p['False_Northing'])
+        if self.projection == 'Mercator_Auxiliary_Sphere':
+            a = self.spheroid[1]
+            return np.degrees(x / a), np.degrees(2 * np.arctan(np.exp(y / a)) - np.pi / 2)
+        raise NotImplementedError(f'Unsupported projection: {self.projection}')
+
+
+def transverse_mercator(lng, lat, a, f, lon0, k0, false_easting, false_northing):
+    """Gauss-Krüger projection (Krüger's series in n, accurate to a millimeter within the zone)"""
+    n = f / (2 - f)
+    big_a = a / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    alpha = (n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16,
+             13 * n ** 2 / 48 - 3 * n ** 3 / 5,
+             61 * n ** 3 / 240)
+
+    phi = np.radians(lat)
+    dlam = np.radians(lng - lon0)
+    c = 2 * np.sqrt(n) / (1 + n)
+    t = np.sinh(np.arctanh(np.sin(phi)) - c * np.arctanh(c * np.sin(phi)))
+    xi = np.arctan2(t, np.cos(dlam))
+    eta = np.arctanh(np.sin(dlam) / np.sqrt(1 + t ** 2))
+
+    easting, northing = eta.copy(), xi.copy()
+    for j, alpha_j in enumerate(alpha, 1):
+        easting += alpha_j * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+        northing += alpha_j * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+    return false_easting + k0 * big_a * easting, false_northing + k0 * big_a * northing
+
+
+def inverse_transverse_mercator(x, y, a, f, lon0, k0, false_easting, false_northing):
+    """Inverse of transverse_mercator (Krüger's series, latitude series to n^4 - accurate to 0.1 mm)"""
+    n = f / (2 - f)
+    big_a = a / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    beta = (n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96,
+            n ** 2 / 48 + n ** 3 / 15,
+            17 * n ** 3 / 480)
+    delta = (2 * n - 2 * n ** 2 / 3 - 2 * n ** 3 + 116 * n ** 4 / 45,
+             7 * n ** 2 / 3 - 8 * n ** 3 / 5 - 227 * n ** 4 / 45,
+             56 * n ** 3 / 15 - 136 * n ** 4 / 35,
+             4279 * n ** 4 / 630)
+
+    xi = (y - false_northing) / (k0 * big_a)
+    eta = (x - false_easting) / (k0 * big_a)
+    xi_prime, eta_prime = xi.copy(), eta.copy()
+    for j, beta_j in enumerate(beta, 1):
+        xi_prime -= beta_j * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        eta_prime -= beta_j * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+    chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))  # conformal latitude
+    phi = chi.copy()
+    for j, delta_j in enumerate(delta, 1):
+        phi += delta_j * np.sin(2 * j * chi)
+    return lon0 + np.degrees(np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))), np.degrees(phi)
+
+
+def web_mercator(lng, lat, a):
+    """Spherical Mercator used by web maps"""
+    return a * np.radians(lng), a * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _utm(name, geogcs, zone):
+    return CRS(name, geogcs, 'Transverse_Mercator', False_Easting=500000.0, False_Northing=0.0,
+               Central_Meridian=zone * 6 - 183, Scale_Factor=0.9996, Latitude_Of_Origin=0.0)
+
+
+def _poland_cs2000(zone):
+    return CRS(f'ETRS_1989_Poland_CS2000_Zone_{zone}', GCS_ETRS_1989, 'Transverse_Mercator',
+               False_Easting=zone * 1000000.0 + 500000.0, False_Northing=0.0, Central_Meridian=zone * 3.0,
+               Scale_Factor=0.999923, Latitude_Of_Origin=0.0)
+
+
+GCS_WGS_1984 = ('GCS_WGS_1984', 'D_WGS_1984', WGS_1984)
+GCS_ETRS_1989 = ('GCS_ETRS_1989', 'D_ETRS_1989', GRS_1980)
+
+REGISTRY = {
+    4326: CRS('GCS_WGS_1984', GCS_WGS_1984),
+    4258: CRS('GCS_ETRS_1989', GCS_ETRS_1989),
+    3857: CRS('WGS_1984_Web_Mercator_Auxiliary_Sphere', GCS_WGS_1984, 'Mercator_Auxiliary_Sphere',
+              False_Easting=0.0, False_Northing=0.0, Central_Meridian=0.0, Standard_Parallel_1=0.0,
+              Auxiliary_Sphere_Type=0.0),
+    2180: CRS('ETRS_1989_Poland_CS92', GCS_ETRS_1989, 'Transverse_Mercator',
+              False_Easting=500000.0, False_Northing=-5300000.0, Central_Meridian=19.0,
+              Scale_Factor=0.9993, Latitude_Of_Origin=0.0),
+    2176: _poland_cs2000(5),
+    2177: _poland_cs2000(6),
+    2178: _poland_cs2000(7),
+    2179: _poland_cs2000(8),
+}
+REGISTRY.update({32600 + zone: _utm(f'WGS_1984_UTM_Zone_{zone}N', GCS_WGS_1984, zone) for zone in range(1, 61)})
+REGISTRY.update({25800 + zone: _utm(f'ETRS_1989_UTM_Zone_{zone}N', GCS_ETRS_1989, zone) for zone in range(28, 39)})
+
+
+def find_crs(wkt):
+    """Returns EPSG code of the ESRI WKT (e.g. contents of a .prj file), raises ValueError if it's not in the registry
+
+    WKT written by other programs may differ in formatting, so CRS names are compared if the text doesn't match.
+    """
+    wkt = wkt.strip()
+    for epsg, crs in REGISTRY.items():
+        if crs.wkt == wkt:
+            return epsg
+    name = wkt.split('"')[1] if wkt.count('"') >= 2 else None
+    geographic = wkt.startswith('GEOGCS')
+    for epsg, crs in REGISTRY.items():
+        if crs.name == name and crs.is_geographic == geographic:
+            return epsg
+    raise ValueError(f'Coordinate system {name or wkt[:50]!r} is not in the bundled CRS registry')
+
+
+def get_crs(epsg):
+    """Returns CRS of the EPSG code, raises ValueError if it's not in the registry"""
+    try:
+        return REGISTRY[int(epsg)]
+    except (KeyError, ValueError, TypeError):
+        raise ValueError(f'EPSG:{epsg} is not in the bundled CRS registry, supported codes: 4326, 4258, 3857, '
+                         f'2180, 2176-2179 (CS2000), 32601-32660 (WGS 84 UTM N), 25828-25838 (ETRS89 UTM N)') from None
@@ -0,0 +1,85 @@
+import csv
+import os
+import time
+from openpyxl import Workbook
+
+
+class FailureSink:
+    """Streams rows that couldn't be geocoded to an xlsx file
+
+    Rows are added to a write-only workbook, which keeps memory usage constant and is saved
+    just once - on close. Until then they are also appended to a CSV file next to it
+    (flushed every `flush_every` rows or `flush_interval` seconds), so a crashed run still
+    leaves its failures on the disk. The CSV file is removed once the xlsx is saved.
+    Nothing is saved if no rows were added.
+
+    Args:
+        path           - (string) - xlsx file location
+        header         - (list) - column names
+        flush_every    - (int) - maximum number of rows kept in the CSV buffer
+        flush_interval - (float) - maximum number of seconds between CSV flushes
+    """
+
+    def __init__(self, path, header, flush_every=100, flush_interval=30):
+        self.path = path
+        self.csv_path = os.path.splitext(path)[0] + '.csv'
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.count = 0
+
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet('No result')
+        self._ws.append(header)
+
+        self._csv_file = open(self.csv_path, 'w', newline='', encoding='utf-8-sig')
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(header)
+        self._pending = 0
+        self._flushed = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, values):
+        values = list(values)
+        self._ws.append(values)
+        self._csv.writerow(values)
+        self.count += 1
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._csv_file.flush()
+        os.fsync(self._csv_file.fileno())
+        self._pending = 0
+        self._flushed = time.monotonic()
+
+    def close(self):
+        """Saves the xlsx file (if any row was added) and removes the CSV one
+
+        Returns:
+            string or None - path of the saved file
+        """
+        if self._csv_file.closed:
+            return None
+        self.flush()
+        self._csv_file.close()
+
+        if not self.count:
+            self._ws.close()  # drops the temporary sheet file
+            os.remove(self.csv_path)
+            return None
+
+        try:
+            self._wb.save(self.path)
+            saved = self.path
+        except Exception:
+            # e.g. the file from the previous run is still open in Excel
+            saved = self.path.replace('.xlsx', '_alt.xlsx')
+            self._wb.save(saved)
+        os.remove(self.csv_path)
+        return saved
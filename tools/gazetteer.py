@@ -0,0 +1,154 @@
+import csv
+import os
+import pickle
+import re
+from array import array
+import shapefile
+from tools.street import get_parser
+
+
+INDEX_VERSION = 2
+STREET_PREFIX_REGEX = re.compile(r'^(ul\.|ulica)\s+')
+
+
+class LocalGC:
+    """Simulates geocoder.osm output for points found in the gazetteer"""
+
+    def __init__(self, lat, lng, key):
+        self.ok = True
+        self.status = 'OK'
+        self.status_code = -999
+        self.timeout = -999
+        self.lat = lat
+        self.lng = lng
+        self.confidence = 10
+        self.osm = {'x': lng, 'y': lat, 'source': 'gazetteer', 'key': key}
+
+
+class Gazetteer:
+    """In-memory index of address points keyed by (place, street, building number)
+
+    Spreadsheet streets are expected to be parsed with parse_street_name/StreetNameParser first
+    (see xl_geocoder.address_components), so their abbreviations are already expanded. Street names
+    of the loaded points go through the same parser (`expand_abbrev` and `remove_abbrev` of the
+    `address` section), so 'św. Jerzego' of the register matches 'świętego Jerzego' of the spreadsheet.
+    Keys are then normalized the same way on both sides: case and repeated spaces are
+    ignored, leading 'ul.'/'ulica' is dropped and spaces are removed from building numbers
+    ('2 B' -> '2b'). Coordinates are kept in two float arrays, so an index of a few million
+    points takes a few hundred MB and loads from its pickle in seconds.
+
+    Usage:
+        gazetteer = Gazetteer.open('prg_points.csv', 'prg_points.idx', columns)
+        gazetteer.lookup('Gdańsk', 'ul. Hynka', '12')  # (lat, lng) or None
+
+    Args:
+        expand_abbrev - (dict, optional) - abbreviations expanded in the street names of the loaded points
+        remove_abbrev - (bool) - remove the remaining abbreviations from them
+    """
+
+    def __init__(self, expand_abbrev=None, remove_abbrev=False):
+        self.settings = {}  # what the index was built with, see open
+        self.parse_street = get_parser(expand_abbrev=expand_abbrev, remove_abbrev=remove_abbrev)
+        self.hits = 0
+        self.misses = 0
+        self._index = {}
+        self._lat = array('d')
+        self._lng = array('d')
+
+    def __len__(self):
+        return len(self._index)
+
+    def key(self, place, street, number):
+        place = re.sub(r'\s+', ' ', str(place or '')).strip().lower()
+        street = STREET_PREFIX_REGEX.sub('', re.sub(r'\s+', ' ', str(street or '')).strip().lower())
+        number = re.sub(r'\s+', '', str(number or '')).lower()
+        return f'{place}|{street}|{number}'
+
+    def add(self, place, street, number, lat, lng):
+        key = self.key(place, street, number)
+        if key not in self._index:
+            self._index[key] = len(self._lat)
+            self._lat.append(float(lat))
+            self._lng.append(float(lng))
+
+    def lookup(self, place, street, number):
+        """Returns (lat, lng) of the address point or None"""
+        i = self._index.get(self.key(place, street, number))
+        if i is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._lat[i], self._lng[i]
+
+    def lookup_gc(self, place, street, number):
+        """Returns LocalGC of the address point or None"""
+        location = self.lookup(place, street, number)
+        if location is None:
+            return None
+        return LocalGC(*location, self.key(place, street, number))
+
+    def load_csv(self, path, columns, delimiter=','):
+        """Adds points from CSV file, `columns` maps place, street, number, lat and lng to column names"""
+        with open(path, newline='', encoding='utf-8-sig') as reader:
+            for record in csv.DictReader(reader, delimiter=delimiter):
+                self.add(record[columns['place']], self.parse_street(record.get(columns.get('street')) or ''),
+                         record[columns['number']], record[columns['lat']], record[columns['lng']])
+
+    def load_shp(self, path, columns):
+        """Adds points from point shapefile in EPSG:4326, `columns` maps place, street and number to field names"""
+        with shapefile.Reader(path) as shp:
+            for shape_record in shp.iterShapeRecords():
+                record = shape_record.record.as_dict()
+                lng, lat = shape_record.shape.points[0]
+                self.add(record[columns['place']], self.parse_street(record.get(columns.get('street')) or ''),
+                         record[columns['number']], lat, lng)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['parse_street']  # rebuilt from the settings
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.settings = state.get('settings', {})  # missing in the indexes of older versions
+        self.parse_street = get_parser(expand_abbrev=self.settings.get('expand_abbrev'),
+                                       remove_abbrev=self.settings.get('remove_abbrev'))
+
+    def save(self, path):
+        with open(path, 'wb') as writer:
+            pickle.dump((INDEX_VERSION, self), writer, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as reader:
+            version, gazetteer = pickle.load(reader)
+        if version != INDEX_VERSION:
+            raise ValueError(f'Unsupported gazetteer index version: {version}')
+        return gazetteer
+
+    @classmethod
+    def open(cls, path, index_path=None, columns=None, delimiter=',', expand_abbrev=None, remove_abbrev=False):
+        """Loads the index from `index_path`, or builds it from the source file (CSV or shp) and saves it there
+
+        The index is rebuilt if the source file is newer than the index, if it was built with other
+        columns, delimiter or abbreviations, or by another version of the script.
+        """
+        settings = {'columns': dict(columns or {}), 'delimiter': delimiter,
+                    'expand_abbrev': dict(expand_abbrev or {}), 'remove_abbrev': bool(remove_abbrev)}
+        if index_path and os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+            try:
+                gazetteer = cls.load(index_path)
+            except ValueError:  # index of another version
+                gazetteer = None
+            if gazetteer is not None and gazetteer.settings == settings:
+                return gazetteer
+
+        gazetteer = cls(expand_abbrev, remove_abbrev)
+        gazetteer.settings = settings
+        if os.path.splitext(path)[-1].lower() == '.shp':
+            gazetteer.load_shp(path, columns)
+        else:
+            gazetteer.load_csv(path, columns, delimiter)
+        if index_path:
+            gazetteer.save(index_path)
+        return gazetteer
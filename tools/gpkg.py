@@ -0,0 +1,255 @@
+"""GeoPackage (OGC 1.3) point layer writer - plain sqlite3, no GDAL needed
+
+Unlike a shapefile, a GeoPackage has no 10 character field names, no fixed text widths and
+no 2 GB limit. Points are written in batches, one transaction each, together with their
+entries of the R-tree spatial index (gpkg_rtree_index extension), so GIS programs can
+query the layer by extent without scanning it.
+"""
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+import struct
+from array import array
+from tools.crs import get_crs
+
+
+APPLICATION_ID = 0x47504B47  # 'GPKG'
+USER_VERSION = 10300
+RTREE_EXTENSION = 'http://www.geopackage.org/spec120/#extension_rtree'
+
+# shapefile field types (see tools.xl.FieldProfiler) and their GeoPackage column types
+COLUMN_TYPES = {'C': 'TEXT', 'N': 'INTEGER', 'F': 'DOUBLE', 'D': 'DATE', 'L': 'BOOLEAN'}
+SQL_TYPES = {str, int, float, bytes, type(None)}
+
+SCHEMA = """
+CREATE TABLE gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+CREATE TABLE gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+    description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE gpkg_geometry_columns (
+    table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));
+CREATE TABLE gpkg_extensions (
+    table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL,
+    scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+"""
+
+# the triggers keep the index up to date when the layer is edited later (by GDAL, QGIS etc.),
+# they use spatial SQL functions missing from plain sqlite3, so they are created after writing
+RTREE_TRIGGERS = """
+CREATE TRIGGER "{rtree}_insert" AFTER INSERT ON "{table}"
+  WHEN (new."{geom}" NOT NULL AND NOT ST_IsEmpty(NEW."{geom}"))
+BEGIN
+  INSERT OR REPLACE INTO "{rtree}" VALUES (NEW.fid, ST_MinX(NEW."{geom}"), ST_MaxX(NEW."{geom}"),
+                                           ST_MinY(NEW."{geom}"), ST_MaxY(NEW."{geom}"));
+END;
+CREATE TRIGGER "{rtree}_update1" AFTER UPDATE OF "{geom}" ON "{table}"
+  WHEN OLD.fid = NEW.fid AND (NEW."{geom}" NOTNULL AND NOT ST_IsEmpty(NEW."{geom}"))
+BEGIN
+  INSERT OR REPLACE INTO "{rtree}" VALUES (NEW.fid, ST_MinX(NEW."{geom}"), ST_MaxX(NEW."{geom}"),
+                                           ST_MinY(NEW."{geom}"), ST_MaxY(NEW."{geom}"));
+END;
+CREATE TRIGGER "{rtree}_update2" AFTER UPDATE OF "{geom}" ON "{table}"
+  WHEN OLD.fid = NEW.fid AND (NEW."{geom}" ISNULL OR ST_IsEmpty(NEW."{geom}"))
+BEGIN
+  DELETE FROM "{rtree}" WHERE id = OLD.fid;
+END;
+CREATE TRIGGER "{rtree}_update3" AFTER UPDATE ON "{table}"
+  WHEN OLD.fid != NEW.fid AND (NEW."{geom}" NOTNULL AND NOT ST_IsEmpty(NEW."{geom}"))
+BEGIN
+  DELETE FROM "{rtree}" WHERE id = OLD.fid;
+  INSERT OR REPLACE INTO "{rtree}" VALUES (NEW.fid, ST_MinX(NEW."{geom}"), ST_MaxX(NEW."{geom}"),
+                                           ST_MinY(NEW."{geom}"), ST_MaxY(NEW."{geom}"));
+END;
+CREATE TRIGGER "{rtree}_update4" AFTER UPDATE ON "{table}"
+  WHEN OLD.fid != NEW.fid AND (NEW."{geom}" ISNULL OR ST_IsEmpty(NEW."{geom}"))
+BEGIN
+  DELETE FROM "{rtree}" WHERE id IN (OLD.fid, NEW.fid);
+END;
+CREATE TRIGGER "{rtree}_delete" AFTER DELETE ON "{table}"
+  WHEN old."{geom}" NOT NULL
+BEGIN
+  DELETE FROM "{rtree}" WHERE id = OLD.fid;
+END;
+"""
+
+
+def point_blob(x, y, srs_id):
+    """Returns GeoPackage binary of the point - header without envelope, little endian WKB"""
+    return struct.pack('<2sBBiBIdd', b'GP', 0, 1, srs_id, 1, 1, x, y)
+
+
+def column_names(fields):
+    """Returns unique column names of the fields, empty ones are named after their position"""
+    names = []
+    taken = {'fid', 'geom'}
+    for i, field in enumerate(fields, 1):
+        name = str(field[0]).replace('"', '').strip() if field[0] not in (None, '') else f'field_{i}'
+        unique, n = name, 1
+        while unique.lower() in taken:
+            n += 1
+            unique = f'{name}_{n}'
+        taken.add(unique.lower())
+        names.append(unique)
+    return names
+
+
+def column_type(field):
+    """Returns GeoPackage column type of the shapefile field, numbers with decimal places are DOUBLE"""
+    if field[1] == 'N' and len(field) > 3 and field[3]:
+        return 'DOUBLE'
+    return COLUMN_TYPES.get(field[1], 'TEXT')
+
+
+def sql_value(value):
+    """Returns the row value as a value of SQLite - dates as ISO text, logical values as 0 and 1,
+    dicts and lists (e.g. the OSM answer) as JSON, other types as text"""
+    value_type = type(value)
+    if value_type in SQL_TYPES:
+        return value
+    if value_type is bool:
+        return int(value)
+    if value_type is datetime.datetime:
+        return value.date().isoformat()
+    if value_type is datetime.date:
+        return value.isoformat()
+    if value_type is dict or value_type is list:
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+class GeoPackageWriter:
+    """Point layer of a new GeoPackage file, points are buffered and written in batched transactions
+
+    The file is overwritten if it exists. WGS 84 coordinates of a batch are reprojected by a single
+    vectorized call, like tools.shp.PointBatch does it.
+
+    Args:
+        path       - (string) - file location (.gpkg)
+        table      - (string) - layer name
+        fields     - (list) - [name, type, size, decimal] shapefile field definitions (see tools.xl.FieldProfiler),
+                              sizes are ignored - text columns have no fixed width
+        epsg       - (int) - EPSG code of the output coordinates, see tools.crs.REGISTRY
+        batch_size - (int) - number of points written in one transaction
+
+    Usage:
+        with GeoPackageWriter('out.gpkg', 'addresses', [['CITY', 'C', 20]], 2180) as gpkg:
+            gpkg.add(18.6466, 54.3486, ['Gdańsk'])
+    """
+
+    def __init__(self, path, table, fields, epsg=4326, batch_size=10000):
+        self.path = path
+        self.table = table
+        self.crs = get_crs(epsg)
+        self.epsg = int(epsg)
+        self.batch_size = batch_size
+        self.count = 0
+        self.columns = column_names(fields)
+        self._rtree = f'rtree_{table}_geom'
+        self._extent = None  # min_x, min_y, max_x, max_y
+        self._lng, self._lat, self._records = array('d'), array('d'), []
+
+        if os.path.exists(path):
+            os.remove(path)
+        self._db = sqlite3.connect(path, isolation_level=None)
+        # R-tree inserts touch many pages, an interrupted file is written again anyway (see --resume)
+        self._db.execute('PRAGMA cache_size = -65536')
+        self._db.execute('PRAGMA synchronous = OFF')
+        self._create(fields)
+        columns = ', '.join(['"geom"'] + [f'"{name}"' for name in self.columns])
+        self._insert = f'INSERT INTO "{table}" ({columns}) VALUES ({", ".join("?" * (len(self.columns) + 1))})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create(self, fields):
+        db = self._db
+        db.execute(f'PRAGMA application_id = {APPLICATION_ID}')
+        db.execute(f'PRAGMA user_version = {USER_VERSION}')
+        db.execute('BEGIN')
+        for sql in SCHEMA.split(';'):
+            if sql.strip():
+                db.execute(sql)
+        srs = [('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+               ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+               ('WGS 84 geodetic', 4326, 'EPSG', 4326, get_crs(4326).wkt, None)]
+        if self.epsg != 4326:
+            srs.append((self.crs.name, self.epsg, 'EPSG', self.epsg, self.crs.wkt, None))
+        db.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', srs)
+
+        columns = ''.join(f', "{name}" {column_type(field)}' for name, field in zip(self.columns, fields))
+        db.execute(f'CREATE TABLE "{self.table}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom POINT{columns})')
+        db.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                   (self.table, 'features', self.table, self.epsg))
+        db.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+                   (self.table, 'geom', 'POINT', self.epsg))
+        db.execute(f'CREATE VIRTUAL TABLE "{self._rtree}" USING rtree(id, minx, maxx, miny, maxy)')
+        db.execute('INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+                   (self.table, 'geom', 'gpkg_rtree_index', RTREE_EXTENSION, 'write-only'))
+        db.execute('COMMIT')
+
+    def add(self, lng, lat, record):
+        self._lng.append(lng)
+        self._lat.append(lat)
+        self._records.append(record)
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        xs, ys = self.crs.transform(self._lng, self._lat)
+        xs, ys = xs.tolist(), ys.tolist()
+        extent = (min(xs), min(ys), max(xs), max(ys))
+        if self._extent is not None:
+            extent = (min(extent[0], self._extent[0]), min(extent[1], self._extent[1]),
+                      max(extent[2], self._extent[2]), max(extent[3], self._extent[3]))
+        self._extent = extent
+
+        rows = [(point_blob(x, y, self.epsg), *map(sql_value, record)) for x, y, record in zip(xs, ys, self._records)]
+        first_fid = self.count + 1  # fids are consecutive, the layer is written by this writer only
+        db = self._db
+        db.execute('BEGIN')
+        db.executemany(self._insert, rows)
+        db.executemany(f'INSERT INTO "{self._rtree}" VALUES (?, ?, ?, ?, ?)',
+                       ((fid, x, x, y, y) for fid, x, y in zip(range(first_fid, first_fid + len(rows)), xs, ys)))
+        db.execute('COMMIT')
+        self.count += len(rows)
+        self._lng, self._lat, self._records = array('d'), array('d'), []
+
+    def close(self):
+        if self._db is None:
+            return
+        self.flush()
+        db = self._db
+        db.execute('BEGIN')
+        if self._extent is not None:
+            db.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ?, "
+                       "last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE table_name = ?",
+                       (*self._extent, self.table))
+        for sql in RTREE_TRIGGERS.format(rtree=self._rtree, table=self.table, geom='geom').split('END;'):
+            if sql.strip():
+                db.execute(sql + 'END;')
+        db.execute('COMMIT')
+        db.close()
+        self._db = None
+
+
+def layer_name(name):
+    """Returns table name made of the output name - letters, digits and underscores, starting with a letter"""
+    name = re.sub(r'\W+', '_', name).strip('_') or 'layer'
+    return name if name[0].isalpha() else 'layer_' + name
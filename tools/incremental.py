@@ -0,0 +1,187 @@
+"""Incremental geocoding - results of a previous run are reused for rows whose address didn't change
+
+Rows are recognized by a hash of their address columns (col_indxs), so they may move, be added
+or removed between the versions of the workbook. Only found rows are taken from the previous
+shapefile, the others are geocoded again (the cache answers the "No results" ones). Addresses
+of the previous NO_RESULTS spreadsheet are recognized as well, so the change report tells
+the rows that weren't found before from the new ones.
+"""
+
+import csv
+import datetime
+import hashlib
+import os
+import re
+from array import array
+import shapefile
+from openpyxl import load_workbook
+from tools.crs import get_crs, find_crs
+from tools.pipeline import FAILURE_COLUMNS
+
+
+CHANGE_COLUMNS = ['row', 'change', 'query']
+
+
+def address_hash(row, col_indxs):
+    """Returns 16 byte digest of the address columns of the row
+
+    Values are compared as text, so they match after a round trip through a shapefile
+    (12.0 -> 12, datetime -> date, repeated spaces).
+    """
+    values = []
+    for i in sorted(set(col_indxs.values())):
+        value = row[i] if i < len(row) else None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, datetime.datetime):
+            value = value.date()
+        values.append('' if value is None else re.sub(r'\s+', ' ', str(value)).strip())
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=16).digest()
+
+
+class PreviousGC:
+    """Simulates geocoder.osm output for results copied from the previous run"""
+
+    def __init__(self, lat, lng, osm, confidence):
+        self.ok = True
+        self.status = 'OK'
+        self.status_code = -999
+        self.timeout = -999
+        self.lat = lat
+        self.lng = lng
+        self.osm = osm
+        self.confidence = confidence
+
+
+class PreviousResults:
+    """Found rows of a previous run's shapefile, keyed by address_hash
+
+    Points are transformed back to WGS 84 (see tools.crs.CRS.inverse), so the output may use
+    a different coordinate system than the previous one.
+
+    Args:
+        path          - (string) - shapefile location (with or without the .shp extension)
+        col_indxs     - (dict) - address columns, as in config.yaml
+        failures_path - (string, optional) - NO_RESULTS spreadsheet of the previous run, its rows
+                                             with a valid address are recognized by failed_before
+    """
+
+    def __init__(self, path, col_indxs, failures_path=None):
+        self.path = os.path.splitext(path)[0]
+        self._failed = self._read_failures(failures_path, col_indxs) if failures_path else set()
+        self._index = {}  # address hash: position
+        self._queries = []
+        self._osm = []
+        self._confidence = []
+        with open(self.path + '.prj') as reader:
+            crs = get_crs(find_crs(reader.read()))
+
+        xs, ys = array('d'), array('d')
+        with shapefile.Reader(self.path) as shp:
+            names = [field[0] for field in shp.fields[1:]]
+            width = names.index('QUERY')  # row values come first
+            query, osm, confidence = (names.index(name) for name in ('QUERY', 'OSM_ANSW', 'CONFIDENCE'))
+            for shape_record in shp.iterShapeRecords():
+                record = shape_record.record
+                key = address_hash(record[:width], col_indxs)
+                if key in self._index:
+                    continue
+                self._index[key] = len(self._queries)
+                self._queries.append(record[query])
+                self._osm.append(record[osm])
+                self._confidence.append(record[confidence])
+                x, y = shape_record.shape.points[0]
+                xs.append(x)
+                ys.append(y)
+        lng, lat = crs.inverse(xs, ys)
+        self._lng, self._lat = array('d', lng.tolist()), array('d', lat.tolist())
+        self._matched = bytearray(len(self._queries))
+
+    def __len__(self):
+        return len(self._queries)
+
+    @staticmethod
+    def _read_failures(path, col_indxs):
+        """Returns address hashes of the NO_RESULTS rows, apart from the ones without a valid address"""
+        failed = set()
+        wb = load_workbook(path, read_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = list(next(rows, None) or [])
+            # row values come first, followed by FAILURE_COLUMNS and the extra columns
+            width = next((i for i in range(len(header)) if header[i:i + len(FAILURE_COLUMNS)] == FAILURE_COLUMNS),
+                         None)
+            if width is None:
+                raise ValueError(f'{path} is not a NO_RESULTS spreadsheet, its columns: {header}')
+            for row in rows:
+                if 'INCORRECT ADDRESS' not in str(row[width + 1]):
+                    failed.add(address_hash(row[:width], col_indxs))
+        finally:
+            wb.close()
+        return failed
+
+    def failed_before(self, row, col_indxs):
+        """Returns True if the address of the row was in the previous NO_RESULTS spreadsheet"""
+        return address_hash(row, col_indxs) in self._failed
+
+    def lookup(self, row, col_indxs):
+        """Returns (PreviousGC, query) of the row if its address was found in the previous run, otherwise None"""
+        i = self._index.get(address_hash(row, col_indxs))
+        if i is None:
+            return None
+        self._matched[i] = 1
+        return PreviousGC(self._lat[i], self._lng[i], self._osm[i], self._confidence[i]), self._queries[i]
+
+    def unmatched(self):
+        """Yields queries of the previous results that weren't looked up - addresses removed from the workbook"""
+        for i, matched in enumerate(self._matched):
+            if not matched:
+                yield self._queries[i]
+
+
+class PreviousRunStage:
+    """Copies results of the rows whose address didn't change since the previous run, writes the change report
+
+    The report is a CSV file with the row number, its change ('unchanged', 'not found before',
+    'new or changed') and query, followed by the queries of the addresses that are gone ('removed').
+    Rows without a valid address are left out.
+
+    Args:
+        previous    - PreviousResults instance
+        col_indxs   - (dict) - address columns, as in config.yaml
+        report_path - (string) - change report location
+    """
+
+    def __init__(self, previous, col_indxs, report_path):
+        self.previous = previous
+        self.col_indxs = col_indxs
+        self.report_path = report_path
+        self.copied = 0
+        self.not_found = 0  # unchanged rows that weren't found in the previous run
+        self.changed = 0
+        self.removed = 0
+
+    def __call__(self, items):
+        with open(self.report_path, 'w', newline='', encoding='utf-8-sig') as report_file:
+            report = csv.writer(report_file)
+            report.writerow(CHANGE_COLUMNS)
+            for item in items:
+                result = self.previous.lookup(item.row, self.col_indxs)
+                if item.gc is None and result is not None:
+                    item.gc, item.query = result
+                    item.resolved_by = 'previous'
+                    self.copied += 1
+                    report.writerow([item.number, 'unchanged', item.query])
+                elif item.gc is None and not item.address:
+                    pass  # rejected, not geocoded anyway
+                elif item.gc is None and self.previous.failed_before(item.row, self.col_indxs):
+                    self.not_found += 1
+                    report.writerow([item.number, 'not found before', item.address])
+                elif item.gc is None:
+                    self.changed += 1
+                    report.writerow([item.number, 'new or changed', item.address])
+                yield item
+
+            for query in self.previous.unmatched():
+                self.removed += 1
+                report.writerow(['', 'removed', query])
@@ -0,0 +1,97 @@
+import json
+import os
+from tools.cache import CachedGC
+from tools.retry import is_transient
+
+
+class Journal:
+    """Append-only log of processed spreadsheet rows and their geocoding results (JSON Lines)
+
+    Every entry is flushed to the OS immediately and synced to the disk every `fsync_every`
+    entries, so after a crash no more than the last few rows have to be geocoded again.
+
+    Args:
+        path        - (string) - journal file location, entries are appended to an existing file
+        fsync_every - (int) - number of entries between disk syncs
+    """
+
+    def __init__(self, path, fsync_every=100):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._unsynced = 0
+        self._drop_partial_entry()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _drop_partial_entry(self):
+        """Cuts off the last line if a crash left it incomplete, so new entries start on a new line"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as file:
+            content = file.read()
+            if content and not content.endswith(b'\n'):
+                file.truncate(content.rfind(b'\n') + 1)
+
+    def append(self, row_number, query, gc):
+        """Logs the result of the spreadsheet row"""
+        entry = {
+            'row': row_number,
+            'query': query,
+            'ok': bool(gc.ok),
+            'status': gc.status,
+            'status_code': gc.status_code,
+            'timeout': gc.timeout,
+        }
+        if gc.ok:
+            entry.update(osm=gc.osm, lat=gc.lat, lng=gc.lng, confidence=gc.confidence)
+
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    @staticmethod
+    def load(path, skip_transient=False):
+        """Reads the journal
+
+        Args:
+            path           - (string)
+            skip_transient - (bool) - leave out the rows whose last result is a transient failure
+                                      (see tools.retry.is_transient), so they are geocoded again
+
+        Returns:
+            dict - {row_number: (CachedGC, query)}, empty if the file doesn't exist
+        """
+        entries = {}
+        if not os.path.exists(path):
+            return entries
+
+        with open(path, encoding='utf-8') as reader:
+            for line in reader:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # entry cut short by a crash, the row will be geocoded again
+                gc = CachedGC(entry['ok'], entry['status'], entry['status_code'], entry['timeout'],
+                              entry.get('osm', ''), entry.get('lat'), entry.get('lng'),
+                              entry.get('confidence', 0))
+                if skip_transient and is_transient(gc):
+                    entries.pop(entry['row'], None)
+                else:
+                    entries[entry['row']] = gc, entry['query']
+        return entries
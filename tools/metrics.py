@@ -0,0 +1,125 @@
+"""Run metrics - timers, histograms and counters collected while geocoding
+
+Modules record into the process-wide `metrics` registry (like logging's loggers), the report
+is saved in the output directory as JSON, so runs can be compared:
+
+    with metrics.timer('parse_street_name'):
+        ...
+    metrics.observe('geocoder_latency', seconds)
+    metrics.count('status_code', gc.status_code)
+    metrics.report()  # {'timers': {...}, 'histograms': {...}, 'counters': {...}}
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket holds everything slower
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Counts of values in buckets with fixed upper bounds
+
+    Args:
+        buckets - (tuple) - ascending upper bounds, values above the last one go to an extra bucket
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """Returns upper bound of the bucket holding the q-th (0-100) percentile, the maximum for the extra bucket"""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        bounds = [str(bound) for bound in self.buckets] + ['inf']
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'max': round(self.max, 6) if self.max is not None else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(zip(bounds, self.counts)),
+        }
+
+
+class Metrics:
+    """Thread safe registry of timers (total seconds and number of calls), histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}      # name: [seconds, calls]
+            self.histograms = {}  # name: Histogram
+            self.counters = {}    # name: Counter
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name, func):
+        """Returns the function adding the time of every call to the `name` timer"""
+        def wrapper(*args, **kwargs):
+            with self.timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def count(self, name, key, n=1):
+        with self._lock:
+            self.counters.setdefault(name, Counter())[str(key)] += n
+
+    def report(self):
+        """Returns JSON serializable dict of all the metrics"""
+        with self._lock:
+            return {
+                'timers': {name: {'seconds': round(seconds, 6), 'calls': calls}
+                           for name, (seconds, calls) in sorted(self.timers.items())},
+                'histograms': {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+                'counters': {name: dict(sorted(counter.items())) for name, counter in sorted(self.counters.items())},
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,132 @@
+"""Local Nominatim imitation for tests and benchmarks, no network access required"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from tools.cache import normalize_query
+from tools.structured import query_text
+
+
+def fake_location(query):
+    """Returns deterministic (lat, lng) inside Poland for the query string"""
+    h = zlib.crc32(normalize_query(query).encode('utf-8'))
+    return 49.0 + (h % 5000) / 1000, 14.5 + (h // 5000 % 9000) / 1000
+
+
+class MockNominatim:
+    """Minimal /search endpoint answering with Nominatim's jsonv2 format
+
+    Args:
+        known    - (callable, optional) - takes normalized query, returns True if it should be found,
+                                          by default every query is found. Structured queries are
+                                          passed as tools.structured.query_text strings
+        latency  - (float) - seconds added to every response
+        errors   - (callable, optional) - takes normalized query, returns HTTP error status to answer with
+                                          (e.g. 429 or 503) or None to answer normally
+        miss_rate         - (float) - share of the queries that are not found, always the same ones
+        too_many_requests - (float) - share of the requests answered with HTTP 429, picked at random,
+                                      so a repeated request may succeed
+        seed     - (int) - seed of the too_many_requests choice
+
+    Attributes:
+        url      - search endpoint address, pass it to geocoder.osm(url=...)
+        requests - list of (time.monotonic(), query string) of the received requests
+
+    Use as a context manager:
+        with MockNominatim() as server:
+            geocoder.osm('Gdańsk', url=server.url)
+    """
+
+    def __init__(self, known=None, latency=0.0, errors=None, miss_rate=0.0, too_many_requests=0.0, seed=0):
+        self.known = known or (lambda query: True)
+        self.latency = latency
+        self.errors = errors or (lambda query: None)
+        self.miss_rate = miss_rate
+        self.too_many_requests = too_many_requests
+        self._random = random.Random(seed)
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/search'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def query(params):
+        """Returns free-text or structured query string of the request"""
+        return params.get('q') or query_text(params)
+
+    def answer(self, params):
+        """Returns (HTTP status, JSON body) for the query parameters"""
+        query = self.query(params)
+        normalized = normalize_query(query)
+        if self.too_many_requests:
+            with self._lock:
+                throttled = self._random.random() < self.too_many_requests
+            if throttled:
+                return 429, {'error': {'code': 429, 'message': 'Too Many Requests'}}
+        error = self.errors(normalized)
+        if error:
+            return error, {'error': {'code': error, 'message': 'Mock error'}}
+        if not self.known(normalized) or self.missed(normalized):
+            return 200, []
+        lat, lng = fake_location(query)
+        return 200, [{
+            'lat': str(lat),
+            'lon': str(lng),
+            'display_name': query,
+            'boundingbox': [str(lat - 0.0005), str(lat + 0.0005), str(lng - 0.0005), str(lng + 0.0005)],
+            'address': {},
+        }]
+
+    def missed(self, normalized):
+        """Returns True if the query belongs to the `miss_rate` share of not found queries"""
+        return zlib.crc32(normalized.encode('utf-8')) % 10000 < self.miss_rate * 10000
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                with mock._lock:
+                    mock.requests.append((time.monotonic(), mock.query(params)))
+                if mock.latency:
+                    time.sleep(mock.latency)
+                status, body = mock.answer(params)
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,628 @@
+"""Streaming geocoding pipeline: source -> stages -> sinks
+
+Rows flow one by one through generator stages, so memory use doesn't depend on the number of rows:
+
+    source = XlsxSource('addresses.xlsx', has_header=True)
+    pipeline = Pipeline(source,
+                        stages=[AddressStage(build), ResolveStage(resolve_address, concurrency=4)],
+                        sinks=[GeoJSONLSink('addresses.geojsonl', source.header)],
+                        failure_sink=FailureSink('NO_RESULTS.xlsx', header))
+    for item in pipeline:
+        ...
+
+Sources yield Item objects, every stage is a callable taking and returning an iterable of them,
+sinks have write(item) and close() methods. Source rows are read ahead by a separate thread
+into a bounded queue - reading the workbook overlaps with waiting for the geocoder, and stops
+while `queue_size` rows are waiting. ResolveStage keeps at most `queue_size` rows in flight as well.
+
+Time spent reading the source, in every stage (`name` of the stage or its class name) and writing
+to every sink is added to tools.metrics.metrics as 'read.<source>', 'stage.<name>' and 'sink.<sink>' timers.
+"""
+
+import csv
+import heapq
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+import shapefile
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+from tools.cache import CachedGC, normalize_query
+from tools.metrics import metrics
+from tools.retry import Backoff, is_transient
+from tools.shp import add_fields_to_shp, create_prj_file, PointBatch
+from tools.gpkg import GeoPackageWriter
+from tools.xl import FieldProfiler
+
+
+RESULT_FIELDS = [
+    ['QUERY', 'C', 255],
+    ['OSM_ANSW', 'C', 255],
+    ['CONFIDENCE', 'F', 5, 2]
+]
+FAILURE_COLUMNS = ['query', 'gc_status', 'gc_status_code', 'gc_timeout']
+
+
+class Item:
+    """Spreadsheet row passing through the pipeline
+
+    Attributes:
+        number      - (int) - row number in the source (the first row is 1)
+        row         - (tuple) - row values
+        address     - (string or None) - query built from the row, None if the row doesn't hold a valid address
+        gc          - geocoder.osm output or an object with the same attributes, None until resolved
+        query       - (string) - the query that gave `gc` (e.g. shortened by the fallback ladder)
+        extra       - (list) - additional output values, e.g. street name correction
+        resolved_by - (string or None) - what set `gc` without resolving the address, e.g. 'journal'
+    """
+
+    __slots__ = ('number', 'row', 'address', 'gc', 'query', 'extra', 'resolved_by')
+
+    def __init__(self, number, row, address=None, gc=None, query=None, extra=None, resolved_by=None):
+        self.number = number
+        self.row = row
+        self.address = address
+        self.gc = gc
+        self.query = query
+        self.extra = extra if extra is not None else []
+        self.resolved_by = resolved_by
+
+    def __repr__(self):
+        return f'Item({self.number}, {self.address!r}, ok={getattr(self.gc, "ok", None)})'
+
+
+# Sources -------------------------------------------------------------------------------
+
+class XlsxSource:
+    """Rows of an Excel worksheet, the workbook is read again on every iteration
+
+    Args:
+        path       - (string) - xlsx file location
+        sheet      - (string, optional) - worksheet name, None - the active one
+        has_header - (bool) - the first row holds column names
+        min_row, max_row, max_col - (int, optional) - range of the rows, as in worksheet.iter_rows
+    """
+
+    def __init__(self, path, sheet=None, has_header=False, min_row=None, max_row=None, max_col=None):
+        self.path = path
+        self.sheet = sheet
+        self.min_row = min_row or (2 if has_header else 1)
+        self.max_row = max_row
+        self.max_col = max_col
+        with self._worksheet() as ws:
+            first_row = next(ws.iter_rows(min_row=1, max_row=1, max_col=max_col, values_only=True), ())
+        self.width = len(first_row)
+        self.header = [str(value) for value in first_row] if has_header else None
+
+    @contextmanager
+    def _worksheet(self):
+        wb = load_workbook(self.path, read_only=True)
+        try:
+            yield wb[self.sheet] if self.sheet else wb.active
+        finally:
+            wb.close()
+
+    def __iter__(self):
+        with self._worksheet() as ws:
+            rows = ws.iter_rows(min_row=self.min_row, max_row=self.max_row, max_col=self.max_col, values_only=True)
+            for number, row in enumerate(rows, self.min_row):
+                yield Item(number, row)
+
+
+class CsvSource:
+    """Rows of a CSV file, values are strings (empty cells - None)
+
+    Args:
+        path       - (string) - CSV file location
+        has_header - (bool) - the first line holds column names
+        delimiter  - (string)
+        encoding   - (string)
+    """
+
+    def __init__(self, path, has_header=False, delimiter=',', encoding='utf-8-sig'):
+        self.path = path
+        self.has_header = has_header
+        self.delimiter = delimiter
+        self.encoding = encoding
+        with open(path, newline='', encoding=encoding) as reader:
+            first_row = next(csv.reader(reader, delimiter=delimiter), [])
+        self.width = len(first_row)
+        self.header = first_row if has_header else None
+
+    def __iter__(self):
+        with open(self.path, newline='', encoding=self.encoding) as reader:
+            rows = csv.reader(reader, delimiter=self.delimiter)
+            if self.has_header:
+                next(rows, None)
+            for number, row in enumerate(rows, 2 if self.has_header else 1):
+                yield Item(number, tuple(value if value != '' else None for value in row))
+
+
+class IterableSource:
+    """Rows from any iterable of tuples, e.g. a database cursor
+
+    A list can be iterated many times, a generator only once - so profile_fields
+    can't be used with it (pass the shapefile fields explicitly).
+
+    Args:
+        rows   - iterable of tuples
+        header - (list, optional) - column names
+        start  - (int) - number of the first row
+    """
+
+    def __init__(self, rows, header=None, start=1):
+        self.rows = rows
+        self.header = header
+        self.start = start
+
+    def __iter__(self):
+        for number, row in enumerate(self.rows, self.start):
+            yield Item(number, tuple(row))
+
+
+def profile_fields(source, sample_rows=None):
+    """Returns shapefile fields fitted to the source rows, see tools.xl.FieldProfiler
+
+    Args:
+        source      - XlsxSource, CsvSource or IterableSource of a list
+        sample_rows - (int, optional) - number of rows to profile, None - all of them
+    """
+    # columns of the first row are in the output even if there are no rows
+    column_names = source.header or [get_column_letter(i + 1) for i in range(getattr(source, 'width', 0))]
+    profiler = FieldProfiler(column_names)
+    for item in islice(source, sample_rows):
+        profiler.update(item.row)
+    return profiler.fields()
+
+
+def timed(items, timings, name):
+    """Yields the items, adds time spent waiting for each of them to timings[name]"""
+    iterator = iter(items)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        timings[name] = timings.get(name, 0.0) + total
+
+
+def read_ahead(items, queue_size):
+    """Yields items produced by a separate thread, at most `queue_size` of them wait in a queue
+
+    Exceptions of the producer are raised in the consumer. If the consumer stops early, the producer stops too.
+    """
+    buffer = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            else:
+                put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# Stages --------------------------------------------------------------------------------
+
+class AddressStage:
+    """Builds the query of every row
+
+    Args:
+        build  - (callable) - takes row values, returns the query string or None,
+                              e.g. xl_geocoder.build_address with bound column indexes
+        extra  - (callable, optional) - takes row values, returns list of additional output values
+    """
+
+    name = 'address'
+
+    def __init__(self, build, extra=None):
+        self.build = build
+        self.extra = extra
+        self.rejected = 0
+
+    def __call__(self, items):
+        for item in items:
+            item.address = self.build(item.row)
+            if not item.address:
+                self.rejected += 1
+            if self.extra is not None:
+                item.extra = list(self.extra(item.row)) + item.extra
+            yield item
+
+
+class LookupStage:
+    """Resolves rows without querying the geocoder, e.g. from a gazetteer
+
+    Args:
+        lookup - (callable) - takes Item, returns gc or None if the row can't be resolved this way
+        name   - (string) - set as `resolved_by` of the resolved items
+    """
+
+    def __init__(self, lookup, name):
+        self.lookup = lookup
+        self.name = name
+        self.resolved = 0
+
+    def __call__(self, items):
+        for item in items:
+            if item.gc is None and item.address:
+                gc = self.lookup(item)
+                if gc is not None:
+                    item.gc, item.query, item.resolved_by = gc, item.address, self.name
+                    self.resolved += 1
+            yield item
+
+
+class KnownResultsStage(LookupStage):
+    """Sets results known beforehand, e.g. restored from a journal
+
+    Args:
+        results - (dict) - {row number: (gc, query)}
+        name    - (string) - set as `resolved_by` of the restored items
+    """
+
+    def __init__(self, results, name):
+        super().__init__(None, name)
+        self.results = results
+
+    def __call__(self, items):
+        for item in items:
+            if item.gc is None and item.number in self.results:
+                item.gc, item.query = self.results[item.number]
+                item.resolved_by = self.name
+                self.resolved += 1
+            yield item
+
+
+class ResolveStage:
+    """Resolves the addresses in a thread pool, items are yielded in the order they came in
+
+    Items already holding a result are passed through, items without a valid address get
+    an 'ERROR - INCORRECT ADDRESS' result without resolving it. Every distinct address is resolved once:
+    rows sharing an address in flight wait for the same result, later rows get the result kept for it
+    (the last `results_size` addresses, apart from transient failures, which are worth resolving again).
+    At most `queue_size` items are in flight, the previous stage is not asked for more until the oldest
+    one is resolved (backpressure).
+
+    Args:
+        resolve_address - (callable) - takes address, returns (gc, query), e.g. xl_geocoder.resolve with bound arguments
+        concurrency     - (int) - number of addresses resolved at the same time
+        queue_size      - (int) - maximum number of items in flight
+        results_size    - (int) - number of resolved addresses whose results are kept
+    """
+
+    name = 'resolve'
+
+    def __init__(self, resolve_address, concurrency=1, queue_size=1000, results_size=100000):
+        self.resolve_address = resolve_address
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.results_size = results_size
+        self.submitted = 0
+        self._results = OrderedDict()  # normalized address: (gc, query), least recently used first
+
+    def __call__(self, items):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            window = deque()
+            in_flight = {}  # normalized address: future
+            for item in items:
+                if item.gc is None and not item.address:
+                    item.gc, item.query = CachedGC(False, 'ERROR - INCORRECT ADDRESS'), item.address
+                if item.gc is None:
+                    key = normalize_query(item.address)
+                    if key in self._results:
+                        item.gc, item.query = self._results[key]
+                        self._results.move_to_end(key)
+                if item.gc is None:
+                    future = in_flight.get(key)
+                    if future is None:
+                        future = in_flight[key] = executor.submit(self.resolve_address, item.address)
+                        self.submitted += 1
+                    window.append((item, key, future))
+                else:
+                    window.append((item, None, None))
+
+                while window and (len(window) > self.queue_size or window[0][2] is None or window[0][2].done()):
+                    yield self._finish(window.popleft(), in_flight)
+
+            while window:
+                yield self._finish(window.popleft(), in_flight)
+
+    def _finish(self, entry, in_flight):
+        item, key, future = entry
+        if future is not None:
+            item.gc, item.query = future.result()
+            if in_flight.get(key) is future:
+                del in_flight[key]
+                if not is_transient(item.gc):
+                    self._results[key] = item.gc, item.query
+                    if len(self._results) > self.results_size:
+                        self._results.popitem(last=False)
+        return item
+
+
+class RetryStage:
+    """Defers rows that failed for a transient reason (see tools.retry.is_transient) and retries them at the end
+
+    Other rows are passed on at once, so a server hiccup doesn't stop the run. When the previous stage
+    is exhausted, the deferred addresses are resolved again (once per distinct address), waiting
+    according to the backoff between the attempts. Deferred rows come out after all the others,
+    with the result of their last attempt.
+
+    Args:
+        resolve_address - (callable) - takes address, returns (gc, query), the one given to ResolveStage
+        backoff         - (tools.retry.Backoff, optional) - waits and the number of attempts
+        sleep           - (callable) - waits the given number of seconds
+    """
+
+    name = 'retry'
+
+    def __init__(self, resolve_address, backoff=None, sleep=time.sleep):
+        self.resolve_address = resolve_address
+        self.backoff = backoff or Backoff()
+        self.sleep = sleep
+        self.deferred = 0   # rows that failed for a transient reason
+        self.retries = 0    # queries resolved again
+        self.recovered = 0  # rows resolved by a retry
+        self.failed = 0     # rows still failing after the last attempt
+
+    def __call__(self, items):
+        deferred = {}  # normalized address: items
+        waiting = []   # heap of (due time, normalized address, attempt)
+        for item in items:
+            if item.resolved_by is None and item.gc is not None and is_transient(item.gc):
+                key = normalize_query(item.address)
+                if key not in deferred:
+                    deferred[key] = []
+                    heapq.heappush(waiting, (time.monotonic() + self.backoff.wait(1, item.gc), key, 1))
+                deferred[key].append(item)
+                self.deferred += 1
+            else:
+                yield item
+
+        while waiting:
+            due, key, attempt = heapq.heappop(waiting)
+            wait = due - time.monotonic()
+            if wait > 0:
+                self.sleep(wait)
+            rows = deferred[key]
+            gc, query = self.resolve_address(rows[0].address)
+            self.retries += 1
+            if is_transient(gc) and attempt < self.backoff.attempts:
+                heapq.heappush(waiting, (time.monotonic() + self.backoff.wait(attempt + 1, gc), key, attempt + 1))
+                continue
+            for item in deferred.pop(key):
+                item.gc, item.query = gc, query
+                if is_transient(gc):
+                    self.failed += 1
+                else:
+                    self.recovered += 1
+                yield item
+
+
+class JournalStage:
+    """Logs the results of the rows to tools.journal.Journal, rows restored from it are skipped
+
+    Args:
+        journal - Journal instance
+        skip    - (string) - `resolved_by` of the rows that are already logged
+    """
+
+    name = 'journal_write'
+
+    def __init__(self, journal, skip='journal'):
+        self.journal = journal
+        self.skip = skip
+
+    def __call__(self, items):
+        for item in items:
+            if item.resolved_by != self.skip:
+                self.journal.append(item.number, item.query, item.gc)
+            yield item
+
+
+# Sinks ---------------------------------------------------------------------------------
+
+class ShapefileSink:
+    """Point shapefile with row values, QUERY, OSM_ANSW, CONFIDENCE and extra fields
+
+    Args:
+        path         - (string) - shapefile location (without extension)
+        fields       - (list) - fields of the row values, e.g. from profile_fields
+        extra_fields - (list) - fields of Item.extra values
+        epsg         - (int) - EPSG code of the output coordinates, see tools.crs
+    """
+
+    def __init__(self, path, fields, extra_fields=(), epsg=4326):
+        self.path = path
+        self._shp = shapefile.Writer(path, 1)
+        add_fields_to_shp(self._shp, list(fields) + RESULT_FIELDS + list(extra_fields))
+        create_prj_file(path + '.prj', epsg)
+        self._points = PointBatch(self._shp, epsg)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, item):
+        gc = item.gc
+        self._points.add(gc.lng, gc.lat, (*item.row, item.query, gc.osm, gc.confidence, *item.extra))
+
+    def close(self):
+        if self._shp is not None:
+            self._points.flush()
+            self._shp.close()
+            self._shp = None
+
+
+class GeoPackageSink:
+    """GeoPackage point layer with the fields of ShapefileSink, see tools.gpkg.GeoPackageWriter
+
+    Field names and text values are not truncated, so QUERY and OSM_ANSW hold the whole query and answer.
+
+    Args:
+        path         - (string) - file location (.gpkg)
+        table        - (string) - layer name
+        fields       - (list) - fields of the row values, e.g. from profile_fields
+        extra_fields - (list) - fields of Item.extra values
+        epsg         - (int) - EPSG code of the output coordinates, see tools.crs
+    """
+
+    def __init__(self, path, table, fields, extra_fields=(), epsg=4326):
+        self.path = path
+        self._gpkg = GeoPackageWriter(path, table, list(fields) + RESULT_FIELDS + list(extra_fields), epsg)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, item):
+        gc = item.gc
+        self._gpkg.add(gc.lng, gc.lat, (*item.row, item.query, gc.osm, gc.confidence, *item.extra))
+
+    def close(self):
+        self._gpkg.close()
+
+
+class GeoJSONLSink:
+    """GeoJSON Lines file - one Feature per line, appended as the rows come, WGS 84 coordinates
+
+    Args:
+        path        - (string) - file location
+        header      - (list, optional) - names of the row values, None - column letters
+        extra_names - (list) - names of Item.extra values
+    """
+
+    def __init__(self, path, header=None, extra_names=()):
+        self.path = path
+        self.header = header
+        self.extra_names = list(extra_names)
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _names(self, width):
+        header = self.header or []
+        return [header[i] if i < len(header) else get_column_letter(i + 1) for i in range(width)]
+
+    def write(self, item):
+        gc = item.gc
+        properties = dict(zip(self._names(len(item.row)), item.row))
+        properties.update(query=item.query, osm_answer=gc.osm, confidence=gc.confidence)
+        properties.update(zip(self.extra_names, item.extra))
+        feature = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [gc.lng, gc.lat]},
+                   'properties': properties}
+        self._file.write(json.dumps(feature, ensure_ascii=False, default=str) + '\n')
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class Pipeline:
+    """Reads the source, passes the rows through the stages and writes them to the sinks
+
+    Found rows (gc.ok) go to all `sinks`, the others to `failure_sink` (e.g. tools.failures.FailureSink)
+    with query, gc_status, gc_status_code, gc_timeout and extra values appended to the row.
+    Iterating the pipeline yields every item after it's written; run() just processes all of them.
+
+    Args:
+        source       - iterable of Items, e.g. XlsxSource
+        stages       - (list) - callables taking and returning an iterable of Items
+        sinks        - (list) - objects with write(item) method
+        failure_sink - (optional) - object with append(values) method
+        queue_size   - (int) - maximum number of rows read ahead of the stages
+    """
+
+    def __init__(self, source, stages=(), sinks=(), failure_sink=None, queue_size=1000):
+        self.source = source
+        self.stages = list(stages)
+        self.sinks = list(sinks)
+        self.failure_sink = failure_sink
+        self.queue_size = queue_size
+        self.rows = 0
+        self.found = 0
+
+    def __iter__(self):
+        timings = {}  # time spent waiting for the output of the source and the stages, upstream ones included
+        names = ['source'] + [getattr(stage, 'name', type(stage).__name__) for stage in self.stages]
+        read_timings = {}
+        items = timed(read_ahead(timed(self.source, read_timings, 'read'), self.queue_size), timings, names[0])
+        for stage, name in zip(self.stages, names[1:]):
+            items = timed(stage(items), timings, name)
+
+        try:
+            for item in items:
+                self.rows += 1
+                gc = item.gc
+                if gc.ok:
+                    self.found += 1
+                    for sink in self.sinks:
+                        with metrics.timer('sink.' + type(sink).__name__):
+                            sink.write(item)
+                elif self.failure_sink is not None:
+                    with metrics.timer('sink.failures'):
+                        self.failure_sink.append(tuple(item.row) + (item.query, gc.status, gc.status_code,
+                                                                    gc.timeout, *item.extra))
+                yield item
+        finally:
+            items.close()
+            metrics.add_time('read.' + type(self.source).__name__, read_timings.get('read', 0.0), self.rows)
+            for upstream, name in zip(names, names[1:]):
+                metrics.add_time('stage.' + name, timings.get(name, 0.0) - timings.get(upstream, 0.0), self.rows)
+
+    def run(self):
+        """Processes all rows, returns the number of rows"""
+        for _ in self:
+            pass
+        return self.rows
@@ -0,0 +1,204 @@
+"""Dry run of the geocoding - what a run will cost, without sending a single query
+
+The Planner stage follows the rows' queries down their fallback ladders, checking the cache
+instead of Nominatim, and PlanWriter saves the built addresses, so the real run can read them
+with PlanStage instead of parsing the rows again:
+
+    python xl_geocoder.py --plan plan.jsonl
+    python xl_geocoder.py --from-plan plan.jsonl
+
+Plan file is JSON Lines: the settings the plan was made with, one line per row and the report.
+"""
+
+import json
+from tools.cache import normalize_query
+from tools.gazetteer import LocalGC
+
+
+PLAN_VERSION = 1
+
+
+class Planner:
+    """Counts the rows, distinct queries and cache hits, estimates the number of network queries
+
+    Distinct addresses are walked down their ladders: cached answers are free, a cached result
+    ends the ladder, cached "No results" move on to the next query. The best case is that the first
+    query that's not cached finds the address, the worst case - that none of them does. Queries shared
+    by many ladders (e.g. '<town>, <county>') are counted once, like in a real run.
+
+    Args:
+        ladder - (callable) - takes address, returns list of queries resolve would send, empty if the address
+                              is rejected (e.g. xl_geocoder.query_ladder with bound arguments)
+        cache  - (GeocodeCache, optional)
+        rate   - (float, optional) - requests per second, see tools.ratelimit.TokenBucket
+    """
+
+    def __init__(self, ladder, cache=None, rate=None):
+        self.ladder = ladder
+        self.cache = cache
+        self.rate = rate
+        self.rows = 0
+        self.rejected = 0        # rows without a valid address
+        self.resolved_locally = 0  # rows resolved by an earlier stage, e.g. gazetteer
+        self.distinct = 0        # distinct addresses to geocode
+        self.cache_hits = 0      # distinct addresses answered by the cache alone
+        self._addresses = {}     # normalized address: ladder is valid
+        self._answers = {}       # normalized query: True - cached result, False - cached miss, None - not cached
+        self._first_queries = set()
+        self._network_queries = set()
+
+    def _cached(self, query):
+        if self.cache is None:
+            return None
+        key = normalize_query(query)
+        if key not in self._answers:
+            gc = self.cache.peek(query)
+            self._answers[key] = None if gc is None else bool(gc.ok)
+        return self._answers[key]
+
+    def add(self, address):
+        """Adds address of a row, returns False if it's rejected"""
+        key = normalize_query(address) if address else None
+        if key in self._addresses:
+            return self._addresses[key]
+        ladder = self.ladder(address) if address else []
+        self._addresses[key] = bool(ladder)
+        if not ladder:
+            return False
+
+        self.distinct += 1
+        first = None
+        for query in ladder:
+            answer = self._cached(query)
+            if answer is None:
+                first = first or normalize_query(query)
+                self._network_queries.add(normalize_query(query))
+            elif answer:
+                break
+        if first is None:
+            self.cache_hits += 1
+        else:
+            self._first_queries.add(first)
+        return True
+
+    def __call__(self, items):
+        for item in items:
+            self.rows += 1
+            if item.gc is not None:
+                self.resolved_locally += 1
+            elif not self.add(item.address):
+                self.rejected += 1
+            yield item
+
+    def seconds(self, queries):
+        return queries / self.rate if self.rate else None
+
+    def report(self):
+        best, worst = len(self._first_queries), len(self._network_queries)
+        return {
+            'rows': self.rows,
+            'rejected': self.rejected,
+            'resolved_locally': self.resolved_locally,
+            'distinct_queries': self.distinct,
+            'cache_hits': self.cache_hits,
+            'best_case_queries': best,
+            'worst_case_queries': worst,
+            'rate_limit': self.rate,
+            'best_case_seconds': self.seconds(best),
+            'worst_case_seconds': self.seconds(worst),
+        }
+
+
+class PlanWriter:
+    """Saves the addresses of the rows and the results of local lookups
+
+    Args:
+        path     - (string) - plan file location
+        settings - (dict) - JSON serializable settings the addresses depend on, checked by PlanStage
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+        self._write({'version': PLAN_VERSION, 'settings': settings})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def write(self, item):
+        record = {'row': item.number, 'address': item.address, 'extra': item.extra}
+        if item.resolved_by == 'gazetteer':
+            record['gazetteer'] = [item.gc.lat, item.gc.lng, item.gc.osm['key']]
+        self._write(record)
+
+    def close(self, report=None):
+        if not self._file.closed:
+            if report is not None:
+                self._write({'report': report})
+            self._file.close()
+
+
+def read_plan_settings(path):
+    """Returns settings saved in the plan file, raises ValueError if it's not a plan"""
+    with open(path, encoding='utf-8') as reader:
+        try:
+            header = json.loads(reader.readline())
+        except json.JSONDecodeError:
+            header = None
+    if not isinstance(header, dict) or header.get('version') != PLAN_VERSION:
+        raise ValueError(f'{path} is not a plan made by this version of xl_geocoder')
+    return header['settings']
+
+
+def plan_differences(path, settings):
+    """Returns names of the settings that changed since the plan was made"""
+    saved = read_plan_settings(path)
+    current = json.loads(json.dumps(settings, default=str))
+    return sorted(key for key in set(saved) | set(current) if saved.get(key) != current.get(key))
+
+
+class PlanStage:
+    """Sets addresses, extra values and gazetteer results of the rows from the plan file
+
+    Replaces AddressStage (and the gazetteer LookupStage). The plan is read along with the rows,
+    so it has to be made from the same rows - ValueError is raised if a row is missing from it.
+
+    Args:
+        path - (string) - plan file saved by PlanWriter
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rejected = 0
+        self.resolved = 0  # rows found in the gazetteer
+
+    def _records(self):
+        with open(self.path, encoding='utf-8') as reader:
+            for line in reader:
+                record = json.loads(line)
+                if 'row' in record:
+                    yield record
+
+    def __call__(self, items):
+        records = self._records()
+        record = next(records, None)
+        for item in items:
+            while record is not None and record['row'] < item.number:
+                record = next(records, None)
+            if record is None or record['row'] != item.number:
+                raise ValueError(f'Row {item.number} is not in the plan {self.path}, the workbook has changed')
+            item.address = record['address']
+            item.extra = record['extra'] + item.extra
+            if not item.address:
+                self.rejected += 1
+            elif 'gazetteer' in record:
+                item.gc, item.query, item.resolved_by = LocalGC(*record['gazetteer']), item.address, 'gazetteer'
+                self.resolved += 1
+            yield item
+        records.close()
@@ -0,0 +1,107 @@
+import multiprocessing
+import threading
+import time
+
+
+PUBLIC_OSM_RATE = 1 / 1.2  # the usage policy allows 1 request per second, 1.2 s between them leaves a margin
+
+
+class TokenBucket:
+    """Thread safe token bucket rate limiter
+
+    Every network query takes one token. Tokens are refilled at `rate` per second, up to
+    `capacity`, so no more than `capacity` queries can be sent in a burst and the long term
+    rate never exceeds `rate`, regardless of the number of threads sharing the bucket.
+
+    The rate adapts to the server (AIMD, like TCP congestion control): slow_down halves it
+    when the server answers with HTTP 429 Too Many Requests, speed_up brings it back
+    a little after every successful query, up to the initial `rate`.
+
+    Args:
+        rate     - (float) - tokens (requests) per second
+        capacity - (int, optional) - bucket size, 1 - evenly spaced requests, no bursts
+        min_rate - (float, optional) - slow_down doesn't go below it, None - 1/16 of `rate`
+    """
+
+    def __init__(self, rate, capacity=1, min_rate=None):
+        if rate <= 0:
+            raise ValueError('Rate must be greater than 0')
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.slowdowns = 0  # number of slow_down calls
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0  # total time spent waiting for tokens
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a token is available and takes it, returns waiting time in seconds"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # tokens may go below zero - the debt reserves a time slot for this caller,
+            # so waiting threads are served in order without polling
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def slow_down(self, factor=0.5):
+        """Multiplies the rate by `factor` and empties the bucket, call it when the server is overloaded"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, 0)
+            self.slowdowns += 1
+
+    def speed_up(self, step=0.05):
+        """Increases the rate by `step` of the initial rate, up to the initial rate"""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * step)
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket shared by processes, its state is kept in shared memory
+
+    Pass it to the worker processes when they are started, e.g. in ProcessPoolExecutor's initargs.
+    time.monotonic() is the same clock in all processes of the machine.
+    """
+
+    def __init__(self, rate, capacity=1, min_rate=None):
+        self._state = multiprocessing.Array('d', 5, lock=False)  # rate, tokens, updated, waited, slowdowns
+        super().__init__(rate, capacity, min_rate)
+        self._lock = multiprocessing.Lock()
+
+    def _shared(index, cast=float):
+        return property(lambda self: cast(self._state[index]),
+                        lambda self, value: self._state.__setitem__(index, value))
+
+    rate = _shared(0)
+    tokens = _shared(1)
+    updated = _shared(2)
+    waited = _shared(3)
+    slowdowns = _shared(4, int)
+    del _shared
+
+
+def limiter_from_config(geocoder_config, shared=False):
+    """Returns TokenBucket enforcing the usage policy of the configured Nominatim server
+
+    Public OSM server is always limited to PUBLIC_OSM_RATE, `rate_limit` applies
+    only to custom (self-hosted) servers. `shared` - SharedTokenBucket for worker processes.
+    """
+    geocoder_config = geocoder_config or {}
+    rate = geocoder_config.get('rate_limit') or PUBLIC_OSM_RATE
+    if not geocoder_config.get('url'):
+        rate = min(rate, PUBLIC_OSM_RATE)
+    return SharedTokenBucket(rate) if shared else TokenBucket(rate)
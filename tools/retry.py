@@ -0,0 +1,50 @@
+import random
+
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(gc):
+    """Returns True if the query failed for a reason that may go away - timeout, lost connection,
+    HTTP 408, 429 or 5xx - and is worth sending again later
+
+    geocoder sets status_code to 'Unknown' if the request raised an exception (timeout, connection error).
+    Results, "No results" answers and invalid addresses are final.
+    """
+    if gc.ok or 'No results' in str(gc.status):
+        return False
+    return gc.status_code in TRANSIENT_STATUS_CODES or gc.status_code in ('Unknown', None)
+
+
+def retry_after(gc):
+    """Returns seconds from the Retry-After header of the server's response, None if there's none"""
+    response = getattr(gc, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None  # HTTP dates are not worth parsing here
+
+
+class Backoff:
+    """Exponential backoff with full jitter
+
+    The n-th retry waits a random time between 0 and min(cap, delay * 2 ** (n - 1)) seconds, so rows
+    that failed together don't retry together. Server's Retry-After is respected.
+
+    Args:
+        delay    - (float) - seconds, upper limit of the first wait
+        cap      - (float) - seconds, upper limit of any wait
+        attempts - (int) - maximum number of retries
+    """
+
+    def __init__(self, delay=2.0, cap=300.0, attempts=3):
+        self.delay = delay
+        self.cap = cap
+        self.attempts = attempts
+
+    def wait(self, attempt, gc=None):
+        """Returns seconds to wait before the retry number `attempt` (the first one is 1)"""
+        wait = random.uniform(0, min(self.cap, self.delay * 2 ** (attempt - 1)))
+        server_wait = retry_after(gc) if gc is not None else None
+        return max(wait, min(self.cap, server_wait)) if server_wait is not None else wait
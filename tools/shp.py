@@ -1,6 +1,6 @@
 import os
 import shapefile
-import pycrs
+from tools.crs import get_crs
 
 
 def create_empty_shp(path, field_params, shapeType):
@@ -27,14 +27,66 @@ def add_fields_to_shp(shp_writer, field_params):
         shp_writer.field(*field_params)
 
 
-def create_prj_file(path, epsg, proj_name="Unknown"):
-    """Creates prj file with coordinates system info in ESRI format"""
+def create_prj_file(path, epsg, proj_name=None):
+    """Creates prj file with coordinates system info in ESRI format
 
-    crs = pycrs.parse.from_epsg_code(epsg)
+    The WKT comes from the bundled registry (tools.crs), no network access is needed.
+    `proj_name` replaces the name of the coordinates system, None - its ESRI name.
+    """
+    crs = get_crs(epsg)
 
-    crs.name = proj_name
     if os.path.splitext(path)[-1] == '.prj':
         with open(path, "w") as writer:
-            writer.write(crs.to_esri_wkt())
+            writer.write(crs.wkt_for(proj_name))
     else:
         raise ValueError
+
+
+class PointBatch:
+    """Buffers points with their records and writes them in batches, reprojected to the target CRS
+
+    WGS 84 coordinates of a whole batch are transformed by a single vectorized call
+    (see tools.crs), so reprojection costs next to nothing even for millions of points.
+    Use as a context manager, or call flush() before the shapefile is closed.
+
+    Args:
+        shp_writer - Writer class instance of shapefile module
+        epsg       - (int) - EPSG code of the output coordinates, see tools.crs.REGISTRY
+        batch_size - (int) - number of points buffered before writing
+
+    Usage:
+        with shapefile.Writer(path, 1) as shp, PointBatch(shp, 2180) as points:
+            points.add(18.6466, 54.3486, ['Gdańsk'])
+    """
+
+    def __init__(self, shp_writer, epsg=4326, batch_size=10000):
+        self.shp = shp_writer
+        self.crs = get_crs(epsg)
+        self.batch_size = batch_size
+        self.count = 0
+        self._lng = []
+        self._lat = []
+        self._records = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, lng, lat, record):
+        self._lng.append(lng)
+        self._lat.append(lat)
+        self._records.append(record)
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        xs, ys = self.crs.transform(self._lng, self._lat)
+        for x, y, record in zip(xs.tolist(), ys.tolist(), self._records):
+            self.shp.point(x, y)
+            self.shp.record(*record)
+        self.count += len(self._records)
+        self._lng, self._lat, self._records = [], [], []
@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+
+
+ABBREV_REGEX = re.compile(r'\w+\.', re.UNICODE)
+BUILDING_NUMBER_REGEX = re.compile(r'((?<= )\d*)((?<=\d)/|(?<=\d)-|(?<=\d)\\)?(\d+)(?: |/|\\)?([a-zA-Z])?$')
+
+
+def parse_street_name(street_name, name_filter=None, expand_abbrev=None,
+                      remove_abbrev=False, building_number_first=False):
+    """Street name parsing and filtering
+
+    Args:
+        name_filter   - (list) - returns False if string from the list is found in the street name
+        expand_abbrev - (dict) - if key is found in the street name it will be replaced by its value
+        remove_abbrev - (bool) - removes every word ending with a '.'
+        building_number_first (bool) - moves the building number from the end of the string to the beginning
+
+    Returns:
+        string, False or None
+    """
+    if name_filter:
+        for substring in name_filter:
+            if substring in street_name:
+                return False
+    if expand_abbrev:
+        for key in expand_abbrev:
+            street_name = re.sub(key, expand_abbrev[key], street_name, flags=re.IGNORECASE)
+    if remove_abbrev:
+        street_name = ABBREV_REGEX.sub('', street_name).strip()
+    if building_number_first:
+        try:
+            match = BUILDING_NUMBER_REGEX.search(street_name)
+            building_number = match.group()
+            mod_number = match.expand(r'\1\2\3\4')
+            street_name = mod_number + ', ' + street_name.replace(building_number, '').strip()
+        except AttributeError:
+            None
+    return street_name.strip()
+
+
+class StreetNameParser:
+    """parse_street_name compiled once for a given configuration
+
+    Regular expressions are compiled in the constructor, all `name_filter` substrings are
+    matched by a single regex alternation and results are memoized, so repeated names are
+    parsed only once. `expand_abbrev` keys are replaced one by one with precompiled patterns,
+    in the order of the dictionary, as parse_street_name does - replacing them in a single pass
+    could give a different result when matches of two keys overlap.
+
+    Args:
+        name_filter, expand_abbrev, remove_abbrev, building_number_first - see parse_street_name
+        cache_size - (int) - number of memoized results, None - unlimited, 0 - no memoization
+
+    Usage:
+        parser = StreetNameParser(expand_abbrev={'św.': 'świętego'}, building_number_first=True)
+        parser('ul. św. Jerzego 20')  # '20, ul. świętego Jerzego'
+        parser.parse_many(names)
+    """
+
+    def __init__(self, name_filter=None, expand_abbrev=None, remove_abbrev=False,
+                 building_number_first=False, cache_size=100000):
+        self.remove_abbrev = remove_abbrev
+        self.building_number_first = building_number_first
+
+        if name_filter:
+            self._filter = re.compile('|'.join(re.escape(substring) for substring in name_filter))
+        else:
+            self._filter = None
+
+        self._abbrev_patterns = [(re.compile(key, re.IGNORECASE), value)
+                                 for key, value in (expand_abbrev or {}).items()]
+
+        if cache_size == 0:
+            self.parse = self._parse
+        else:
+            self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def __call__(self, street_name):
+        return self.parse(street_name)
+
+    def _parse(self, street_name):
+        if self._filter is not None and self._filter.search(street_name):
+            return False
+        for pattern, value in self._abbrev_patterns:
+            street_name = pattern.sub(value, street_name)
+        if self.remove_abbrev:
+            street_name = ABBREV_REGEX.sub('', street_name).strip()
+        if self.building_number_first:
+            match = BUILDING_NUMBER_REGEX.search(street_name)
+            if match:
+                building_number = match.group()
+                mod_number = match.expand(r'\1\2\3\4')
+                street_name = mod_number + ', ' + street_name.replace(building_number, '').strip()
+        return street_name.strip()
+
+    def parse_many(self, street_names):
+        """Returns list of parsed names, in the same order"""
+        return [self.parse(street_name) for street_name in street_names]
+
+
+@lru_cache(maxsize=None)
+def _get_parser(name_filter, expand_abbrev, remove_abbrev, building_number_first):
+    return StreetNameParser(name_filter, dict(expand_abbrev) if expand_abbrev else None,
+                            remove_abbrev, building_number_first)
+
+
+def get_parser(name_filter=None, expand_abbrev=None, remove_abbrev=False, building_number_first=False):
+    """Returns StreetNameParser for the configuration, the same instance for the same arguments"""
+    return _get_parser(tuple(name_filter) if name_filter else None,
+                       tuple(expand_abbrev.items()) if expand_abbrev else None,
+                       bool(remove_abbrev), bool(building_number_first))
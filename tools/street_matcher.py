@@ -0,0 +1,183 @@
+import csv
+import heapq
+import re
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain
+from functools import lru_cache
+
+
+STREET_PREFIX_REGEX = re.compile(r'^(ul\.|ulica|al\.|aleja|pl\.|plac|os\.|osiedle)\s+', re.IGNORECASE)
+CANDIDATES = 5                # names compared by edit distance
+MIN_COMMON_POSTING = 100      # trigrams found in more names (and in over 5% of names of the place) are common
+RARE_TRIGRAMS = 3
+
+
+def edit_similarity(a, b, min_similarity=0.0):
+    """Returns 1 - (optimal string alignment distance / length of the longer string)
+
+    The distance counts insertions, deletions, substitutions and transpositions
+    of adjacent characters ('Hynak' -> 'Hynka' is one edit). Returns 0 as soon as
+    the similarity is known to be below `min_similarity`.
+    """
+    if a == b:
+        return 1.0
+    length = max(len(a), len(b))
+    # typos are usually in one place, the common prefix and suffix don't change the distance
+    start = 0
+    while start < min(len(a), len(b)) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < min(len(a), len(b)) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return 1 - max(len(a), len(b)) / length
+    max_distance = int((1 - min_similarity) * length + 1e-9)
+    if abs(len(a) - len(b)) > max_distance:
+        return 0.0
+
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > max_distance and min(previous) > max_distance:  # transpositions look two rows back
+            return 0.0
+    return 1 - current[-1] / length
+
+
+def trigrams(name):
+    """Returns set of trigrams of the name, words are padded like in PostgreSQL's pg_trgm ('  hynka ')"""
+    result = set()
+    for word in name.split():
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class _PlaceIndex:
+    """Trigram index of the street names of one place"""
+
+    def __init__(self):
+        self.names = []      # normalized names
+        self.canonical = []  # names as given in the dictionary, without the prefix
+        self.ids = {}        # normalized name: id
+        self.sizes = array('H')  # numbers of trigrams of the names
+        self.postings = defaultdict(list)
+
+    def add(self, name, canonical):
+        if name in self.ids:
+            return
+        i = len(self.names)
+        self.ids[name] = i
+        self.names.append(name)
+        self.canonical.append(canonical)
+        name_trigrams = trigrams(name)
+        self.sizes.append(min(len(name_trigrams), 65535))
+        for trigram in name_trigrams:
+            self.postings[trigram].append(i)
+
+    def candidates(self, name, limit=CANDIDATES):
+        """Returns ids of up to `limit` names with the highest trigram similarity, the most similar first
+
+        Trigram similarity is the Jaccard index of the trigram sets. Shared trigrams are counted only
+        in the postings of the query's rare trigrams - common ones (e.g. of 'świętego') would
+        add thousands of ids and hardly change the order. If every trigram is common,
+        the RARE_TRIGRAMS rarest ones are used.
+        """
+        query = trigrams(name)
+        if not query:
+            return []
+        ordered = sorted(query, key=lambda trigram: len(self.postings.get(trigram, ())))
+        max_posting = max(MIN_COMMON_POSTING, len(self.names) // 20)
+        used = [trigram for trigram in ordered if len(self.postings.get(trigram, ())) <= max_posting]
+        used = used or ordered[:RARE_TRIGRAMS]
+        counts = Counter(chain.from_iterable(self.postings.get(trigram, ()) for trigram in used))
+
+        scored = [(shared / (len(query) + self.sizes[i] - shared), i) for i, shared in counts.most_common(limit * 3)]
+        return [i for _, i in heapq.nlargest(limit, scored)]
+
+
+class StreetMatcher:
+    """Corrects misspelled street names using a dictionary of streets of every place
+
+    Names sharing the most trigrams with the spreadsheet's name are found in the trigram index
+    of the place, the one with the highest edit_similarity is used if it's above `min_similarity`.
+
+    Names are compared without case, repeated spaces and the leading 'ul.', 'al.', 'pl.' or 'os.',
+    the prefix of the spreadsheet's name is kept in the corrected one:
+        'ul. Hynak' -> 'ul. Hynka'
+    Names of places missing from the dictionary are returned unchanged. If the dictionary has
+    no place column, its streets are used for every place.
+
+    Args:
+        min_similarity - (float) - minimum edit_similarity (0-1) of the corrected name
+        cache_size     - (int) - number of memoized corrections, None - unlimited
+
+    Usage:
+        matcher = StreetMatcher.open('streets.csv', {'place': 'miejscowosc', 'street': 'ulica'})
+        matcher.correct('Gdańsk', 'ul. Hynak')  # 'ul. Hynka'
+    """
+
+    def __init__(self, min_similarity=0.8, cache_size=100000):
+        self.min_similarity = min_similarity
+        self._places = {}
+        self.correct = lru_cache(maxsize=cache_size)(self._correct)
+
+    def __len__(self):
+        return sum(len(index.names) for index in self._places.values())
+
+    @staticmethod
+    def normalize(name):
+        return re.sub(r'\s+', ' ', str(name or '')).strip().lower()
+
+    def add(self, place, street):
+        street = STREET_PREFIX_REGEX.sub('', re.sub(r'\s+', ' ', str(street or '')).strip())
+        if street:
+            place = self.normalize(place)
+            if place not in self._places:
+                self._places[place] = _PlaceIndex()
+            self._places[place].add(street.lower(), street)
+
+    def load_csv(self, path, columns, delimiter=','):
+        """Adds streets from CSV file, `columns` maps street and (optionally) place to column names"""
+        with open(path, newline='', encoding='utf-8-sig') as reader:
+            for record in csv.DictReader(reader, delimiter=delimiter):
+                self.add(record[columns['place']] if columns.get('place') else '', record[columns['street']])
+
+    @classmethod
+    def open(cls, path, columns, delimiter=',', min_similarity=0.8):
+        matcher = cls(min_similarity)
+        matcher.load_csv(path, columns, delimiter)
+        return matcher
+
+    def match(self, place, street):
+        """Returns (canonical street name without the prefix, similarity) or None"""
+        index = self._places.get(self.normalize(place)) or self._places.get('')
+        name = STREET_PREFIX_REGEX.sub('', self.normalize(street))
+        if index is None or not name:
+            return None
+        if name in index.ids:
+            return index.canonical[index.ids[name]], 1.0
+        best = None
+        for i in index.candidates(name):
+            # names that can't beat the best one so far are rejected early
+            similarity = edit_similarity(name, index.names[i], best[1] if best else self.min_similarity)
+            if similarity >= self.min_similarity and (best is None or similarity > best[1]):
+                best = index.canonical[i], similarity
+        return best
+
+    def _correct(self, place, street):
+        """Returns the street name corrected to its dictionary form, or unchanged if nothing is similar enough"""
+        match = self.match(place, street)
+        if match is None:
+            return street
+        prefix = STREET_PREFIX_REGEX.match(street.strip())
+        corrected = (prefix.group() if prefix else '') + match[0]
+        if self.normalize(corrected) == self.normalize(street):
+            return street
+        return corrected
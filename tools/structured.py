@@ -0,0 +1,59 @@
+"""Structured Nominatim queries (street, city, county, state, postalcode parameters)
+
+Structured queries are passed around as strings, e.g.
+    'street=12 ul. Hynka; city=Gdańsk; state=Pomorskie; postalcode=80-465'
+so they can be deduplicated, cached, journaled and saved in the QUERY field like free-text ones.
+"""
+
+import re
+
+
+STRUCTURED_FIELDS = ['street', 'city', 'county', 'state', 'postalcode']
+
+
+def query_text(components):
+    """Returns string representation of the structured query, empty components are skipped"""
+    return '; '.join(f'{key}={components[key]}' for key in STRUCTURED_FIELDS if components.get(key))
+
+
+def parse_query_text(text):
+    """Returns dict of query components, reverses query_text"""
+    return dict(part.split('=', 1) for part in text.split('; ') if '=' in part)
+
+
+def strip_building_number(street):
+    """'12 ul. Hynka' -> 'ul. Hynka', returns '' if the street holds only the number"""
+    if re.match(r'^\d+\S*$', street):
+        return ''
+    return re.sub(r'^\d+\S*\s+', '', street)
+
+
+def structured_ladder(components):
+    """Returns list of structured queries, from the most to the least precise
+
+    Street is relaxed first (building number, then the whole street), postal code next,
+    as a wrong or outdated postal code is more common than a wrong town name,
+    and finally only county and state are left:
+        street=12 ul. Hynka; city=Gdańsk; postalcode=80-465
+        street=ul. Hynka; city=Gdańsk; postalcode=80-465
+        city=Gdańsk; postalcode=80-465
+        city=Gdańsk
+    """
+    steps = [dict(components)]
+    street = components.get('street')
+    if street:
+        street_name = strip_building_number(street)
+        if street_name and street_name != street:
+            steps.append(dict(components, street=street_name))
+        steps.append(dict(components, street=None))
+    if components.get('postalcode'):
+        steps.append(dict(steps[-1], postalcode=None))
+    if components.get('city') and components.get('county'):
+        steps.append(dict(steps[-1], city=None))
+
+    ladder = []
+    for step in steps:
+        text = query_text(step)
+        if text and text not in ladder:
+            ladder.append(text)
+    return ladder
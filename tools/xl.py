@@ -1,5 +1,22 @@
-from datetime import datetime
+from datetime import date, datetime
+from decimal import Decimal
 from openpyxl import load_workbook, Workbook
+from openpyxl.utils import get_column_letter
+
+
+DEFAULT_PROPERTIES = {
+    # [type_letter, field_length, decimal_places]
+    str:      ['C', 255, 0],
+    int:      ['N', 9, 0],
+    float:    ['N', 6, 2],
+    bool:     ['L'],
+    datetime: ['D'],
+    None:     ['C', 255, 0]
+}
+
+MAX_CHARACTER_LENGTH = 255  # length of the longest C field
+MAX_NUMERIC_LENGTH = 20     # length of the longest N field, most programs can't read longer ones
+MAX_DECIMALS = 15
 
 
 def get_column_samples_from_worksheet(worksheet_object, has_header=None, row_number=None):
@@ -18,9 +35,9 @@ def get_column_samples_from_worksheet(worksheet_object, has_header=None, row_num
     """
 
     ws = worksheet_object
-    max_row = ws.max_row
 
     if row_number:
+        max_row = ws.max_row
         if 1 <= row_number <= max_row:
             i = row_number
         else:
@@ -31,14 +48,17 @@ def get_column_samples_from_worksheet(worksheet_object, has_header=None, row_num
         else:
             i = 1
 
+    # iter_rows reads just the requested rows, ws[i] would load the whole sheet in read-only mode
+    first_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    sample_row = next(ws.iter_rows(min_row=i, max_row=i, values_only=True), ())
+    sample_row = tuple(sample_row) + (None,) * (len(first_row) - len(sample_row))
+
     if has_header:
-        column_names = [str(cell.internal_value) for cell in ws[1]]
-        column_types = [cell.internal_value for cell in ws[i]]
+        column_names = [str(value) for value in first_row]
     else:
-        column_names = [cell.column_letter for cell in ws[1]]
-        column_types = [cell.internal_value for cell in ws[i]]
+        column_names = [get_column_letter(j + 1) for j in range(len(first_row))]
 
-    return list(map(list, zip(column_names, column_types)))
+    return list(map(list, zip(column_names, sample_row)))
 
 
 def _validate_custom_properties(custom_properties):
@@ -84,36 +104,20 @@ def determine_field_properties(value, custom_properties=None):
         list - Lists of field properties to be used by the shapefile package
     """
 
-    default_properties = {
-        # [type_letter, field_length, decimal_places]
-        str:      ['C', 255, 0],
-        int:      ['N', 9, 0],
-        float:    ['N', 6, 2],
-        bool:     ['L'],
-        datetime: ['D'],
-        None:     ['C', 255, 0]
-    }
-
     value_type = type(value)
 
+    # DEFAULT_PROPERTIES and custom_properties lists are never modified, the result is a new list
+    field_types_properties = dict(DEFAULT_PROPERTIES)
     if custom_properties == 'auto':
         if value_type == str:
-            length = len(value)
-            default_properties[str][1] = length
+            field_types_properties[str] = ['C', len(value), 0]
         if value_type == int:
-            length = len(str(value))
-            default_properties[int][1] = length
+            field_types_properties[int] = ['N', len(str(value)), 0]
         if value_type == float:
-            s = str(value)
-            length = len(s.split('.')[0])
-            decimal = len(s.split('.')[1])
-            default_properties[float][1] = length + decimal
-            default_properties[float][2] = decimal
-        field_types_properties = default_properties
+            length, decimal = _numeric_size(value)
+            field_types_properties[float] = ['N', length, decimal]
     elif custom_properties:
-        default_properties.update(custom_properties)
-
-    field_types_properties = default_properties
+        field_types_properties.update(custom_properties)
 
     if value_type in [str, int, float, bool, datetime]:
         field_property = field_types_properties[value_type]
@@ -125,6 +129,144 @@ def determine_field_properties(value, custom_properties=None):
     return list(field_property)
 
 
+def _numeric_size(value):
+    """Returns (length, decimal places) of the number written in a N field without losing digits
+
+    1.25 -> (4, 2), -30 -> (3, 0), 1e-05 -> (7, 5)
+    """
+    if isinstance(value, float):
+        text = repr(value)
+        if 'e' in text or 'n' in text:  # 1e-05, 1e+22, inf, nan
+            if value != value or value in (float('inf'), float('-inf')):
+                return len(text), 0
+            decimal = min(max(-Decimal(text).as_tuple().exponent, 0), MAX_DECIMALS)
+            return len(format(value, f'.{decimal}f')), decimal
+        if text.endswith('.0'):
+            return len(text) - 2, 0
+        decimal = len(text) - text.index('.') - 1
+        if decimal > MAX_DECIMALS:
+            return len(format(value, f'.{MAX_DECIMALS}f')), MAX_DECIMALS
+        return len(text), decimal
+    return len(str(value)), 0
+
+
+class FieldProfiler:
+    """Infers tight shapefile (DBF) field definitions from the worksheet rows in a single pass
+
+    Rows are passed one by one (e.g. while they are read for geocoding), so the worksheet
+    doesn't have to be read twice. For every column it keeps only the types seen so far,
+    the longest text and the longest integer and fractional part of the numbers. Types are widened:
+        int           -> N with as many digits as the longest number
+        int and float -> N with as many decimal places as the most precise number (up to MAX_DECIMALS)
+        bool          -> L
+        date/datetime -> D
+        str or any other mix of types -> C as long as the longest value (in bytes of `encoding`)
+    Numbers longer than MAX_NUMERIC_LENGTH are saved as text. Columns with no values are
+    1 character C fields. Empty cells (None, '') don't change the type.
+
+    If only a sample of the rows is profiled, longer values of the other rows are truncated
+    by the shapefile writer - numbers too, so profile all the rows if the columns hold numbers.
+
+    Args:
+        column_names - (list) - field names, columns beyond the list are named with the column letters
+        encoding     - (string) - encoding of the DBF file, shapefile.Writer's default is utf-8
+
+    Usage:
+        profiler = FieldProfiler(['LP', 'ULICA'])
+        for row in rows:
+            profiler.update(row)
+        profiler.fields()  # [['LP', 'N', 3, 0], ['ULICA', 'C', 31, 0]]
+    """
+
+    def __init__(self, column_names=None, encoding='utf-8'):
+        self.column_names = list(column_names or [])
+        self.encoding = encoding
+        self.rows = 0
+        self._columns = []
+
+    def update(self, row):
+        self.rows += 1
+        columns = self._columns
+        while len(columns) < len(row):
+            # [types, longest text, longest integer part, most decimal places]
+            columns.append([set(), 0, 0, 0])
+
+        for column, value in zip(columns, row):
+            if value is None or value == '':
+                continue
+            value_type = type(value)
+            if value_type is str:
+                column[0].add(str)
+                length = len(value) if value.isascii() else len(value.encode(self.encoding, 'replace'))
+            elif value_type is int or value_type is float:
+                column[0].add(value_type)
+                length, decimal = _numeric_size(value)
+                column[2] = max(column[2], length - (decimal + 1 if decimal else 0))
+                column[3] = max(column[3], decimal)
+                length = len(str(value))
+            elif value_type is bool:
+                column[0].add(bool)
+                length = len(str(value))
+            elif isinstance(value, date):
+                column[0].add(date)
+                length = len(str(value))
+            else:
+                column[0].add(str)
+                length = len(str(value).encode(self.encoding, 'replace'))
+            if length > column[1]:
+                column[1] = length
+
+    def fields(self):
+        """Returns list of lists - ['field_name', 'data_type_symbol', 'length', 'decimal']"""
+        fields = []
+        for i, (types, text_length, integer_length, decimal) in enumerate(self._columns):
+            name = self.column_names[i] if i < len(self.column_names) else get_column_letter(i + 1)
+            if types == {bool}:
+                fields.append([name, 'L', 1, 0])
+            elif types == {date}:
+                fields.append([name, 'D', 8, 0])
+            elif types and types <= {int, float} and integer_length <= MAX_NUMERIC_LENGTH:
+                decimal = min(decimal, max(MAX_NUMERIC_LENGTH - integer_length - 1, 0))
+                length = integer_length + (decimal + 1 if decimal else 0)
+                fields.append([name, 'N', length, decimal])
+            else:
+                fields.append([name, 'C', min(max(text_length, 1), MAX_CHARACTER_LENGTH), 0])
+
+        for name in self.column_names[len(fields):]:  # columns without any cells
+            fields.append([name, 'C', 1, 0])
+        return fields
+
+
+def profile_worksheet(worksheet_object, has_header=None, min_row=None, max_row=None, max_col=None,
+                      sample_rows=None, encoding='utf-8'):
+    """Reads the worksheet once and returns shapefile table config fitted to its values, see FieldProfiler
+
+    Args:
+        worksheet_object - openpyxl worksheet object
+        has_header (bool, optional) -
+            True  - column names based on the first row
+            False - column names as alphabet letters
+        min_row, max_row, max_col (int, optional) - range of the profiled cells, as in worksheet.iter_rows
+        sample_rows (int, optional) - number of rows to profile, None - all of them
+
+    Returns:
+        list - list of lists - ['field_name', 'data_type_symbol', 'length', 'decimal']
+    """
+    ws = worksheet_object
+    column_names = None
+    if has_header:
+        header = next(ws.iter_rows(min_row=1, max_row=1, max_col=max_col, values_only=True), ())
+        column_names = [str(value) for value in header]
+        min_row = max(min_row or 2, 2)
+
+    profiler = FieldProfiler(column_names, encoding)
+    for row in ws.iter_rows(min_row=min_row, max_row=max_row, max_col=max_col, values_only=True):
+        if sample_rows is not None and profiler.rows >= sample_rows:
+            break
+        profiler.update(row)
+    return profiler.fields()
+
+
 def get_fields_properties_from_worksheet(worksheet_object, has_header=None, row_number=None,
                                         custom_properties=None):
     """Analyzes worksheet content and returns corresponding shapefile table config
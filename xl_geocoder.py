@@ -11,16 +11,47 @@
 """
 
 import os
+import argparse
+import fnmatch
+import glob
 import geocoder
-import shapefile
 import datetime
 import re
-from time import sleep
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from functools import partial
+from openpyxl import load_workbook
 from requests import Session
-from openpyxl import load_workbook, Workbook
+from requests.adapters import HTTPAdapter
 from tools import load_config
-from tools.xl import get_fields_properties_from_worksheet
-from tools.shp import add_fields_to_shp, create_prj_file
+from tools.cache import GeocodeCache, LadderCache
+from tools.ratelimit import limiter_from_config
+from tools.retry import Backoff, is_transient
+from tools.journal import Journal
+from tools.failures import FailureSink
+from tools.gazetteer import Gazetteer
+from tools.street import parse_street_name, get_parser
+from tools.street_matcher import StreetMatcher
+from tools.structured import query_text, parse_query_text, structured_ladder
+from tools.crs import get_crs
+from tools.gpkg import layer_name
+from tools.plan import Planner, PlanWriter, PlanStage, plan_differences
+from tools.incremental import PreviousResults, PreviousRunStage
+from tools.metrics import metrics
+from tools.pipeline import (XlsxSource, AddressStage, LookupStage, KnownResultsStage, ResolveStage,
+                            RetryStage, JournalStage, Pipeline, ShapefileSink, GeoPackageSink, GeoJSONLSink,
+                            FAILURE_COLUMNS, profile_fields)
+
+
+log = logging.getLogger('xl_geocoder')
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(message)s'
+PROGRESS_INTERVAL = 10  # seconds between the progress messages
+REPORT_VERSION = 1
+OUTPUT_FORMATS = ('shp', 'gpkg', 'geojsonl')
 
 
 class FakeGC:
@@ -47,181 +78,836 @@ def sanitize_value(value, replace_none=False):
         return 'INCORRECT TYPE'
 
 
-def parse_street_name(street_name, name_filter=None, expand_abbrev=None,
-                      remove_abbrev=False, building_number_first=False):
-    """Street name parsing and filtering
+def geocode(address, session, cache=None, limiter=None, url=None, structured=False):
+    """Queries OSM for the address, cached answer is returned if available
 
     Args:
-        name_filter   - (list) - returns False if string from the list is found in the street name
-        expand_abbrev - (dict) - if key is found in the street name it will be replaced by its value
-        remove_abbrev - (bool) - removes every word ending with a '.'
-        building_number_first (bool) - moves the building number from the end of the string to the beginning
+        address    - (string) - query string
+        session    - requests.Session instance
+        cache      - (GeocodeCache, optional)
+        limiter    - (TokenBucket, optional) - rate limiter shared by all network queries, slowed down on HTTP 429
+        url        - (string, optional) - custom Nominatim search endpoint
+        structured - (bool) - address is a structured query string (see tools.structured)
 
     Returns:
-        string, False or None
+        tuple - (geocoder.osm output or CachedGC, True if the answer came from the cache)
     """
-    regex = re.compile(r'\w+\.', re.UNICODE)
-    regex2 = re.compile(r'((?<= )\d*)((?<=\d)/|(?<=\d)-|(?<=\d)\\)?(\d+)(?: |/|\\)?([a-zA-Z])?$')
-
-    if name_filter:
-        for substring in name_filter:
-            if substring in street_name:
-                return False
-    if expand_abbrev:
-        for key in expand_abbrev:
-            street_name = re.sub(key, expand_abbrev[key], street_name, flags=re.IGNORECASE)
-    if remove_abbrev:
-        street_name = re.sub(regex, '', street_name).strip()
-    if building_number_first:
-        try:
-            match = re.search(regex2, street_name)
-            building_number = match.group()
-            mod_number = match.expand(r'\1\2\3\4')
-            street_name = mod_number + ', ' + street_name.replace(building_number, '').strip()
-        except AttributeError:
-            None
-    return street_name.strip()
+    if cache is not None:
+        gc = cache.get(address)
+        if gc is not None:
+            return gc, True
+
+    kwargs = {'session': session}
+    if url:
+        kwargs['url'] = url
+    if structured:
+        # free-text 'q' parameter can't be mixed with the structured ones, None drops it
+        kwargs['params'] = dict(parse_query_text(address), q=None)
+
+    if limiter is not None:
+        metrics.add_time('rate_limit_sleep', limiter.acquire())
+    start = time.perf_counter()
+    gc = geocoder.osm('' if structured else address, **kwargs)
+    latency = time.perf_counter() - start
+    metrics.add_time('network', latency)
+    metrics.observe('geocoder_latency', latency)
+    metrics.count('status_code', gc.status_code)
+    if limiter is not None:
+        if gc.status_code == 429:  # Too Many Requests
+            limiter.slow_down()
+        elif not is_transient(gc):
+            limiter.speed_up()
+    if cache is not None:
+        cache.set(address, gc)
+    return gc, False
+
+
+def correct_street(parsed_st_name, place, street_matcher=None):
+    """Corrects the street name of the parsed '<building number>, <street>' string, see tools.street_matcher"""
+    if street_matcher is None or not parsed_st_name:
+        return parsed_st_name
+    number, separator, street = parsed_st_name.rpartition(', ')
+    return number + separator + street_matcher.correct(place, street)
+
+
+def build_address(row, col_indxs, illegal_street_names=None, abbrev_dict=None, remove_abbrev=False,
+                  street_matcher=None):
+    """Builds the query string from the address columns of the spreadsheet row
 
+    Args:
+        row            - (tuple) - spreadsheet row values
+        col_indxs      - (dict)  - address ingredient names and their column indexes
+        illegal_street_names, abbrev_dict, remove_abbrev - see parse_street_name
+        street_matcher - (StreetMatcher, optional) - corrects misspelled street names
 
-if __name__ == "__main__":
+    Returns:
+        string or None - None if the row doesn't hold a valid address
+    """
+    parse_street = metrics.timed('parse_street_name', get_parser(illegal_street_names, abbrev_dict, remove_abbrev,
+                                                                 building_number_first=True))
+    parse_place = metrics.timed('parse_street_name', get_parser(illegal_street_names, building_number_first=True))
+
+    idx = col_indxs
+    st_name_num            = sanitize_value(row[idx['st_name_num']])
+    secondary_place_name   = sanitize_value(row[idx['secondary_place_name']])
+    primary_place_name     = sanitize_value(row[idx['primary_place_name']])
+    county                 = sanitize_value(row[idx['county']])
+
+    if secondary_place_name != '' and st_name_num != '':     # named streets, shared postal code - villages
+        parsed_st_name = correct_street(parse_street(st_name_num), secondary_place_name, street_matcher)
+        if not parsed_st_name:
+            return None
+        return parsed_st_name + ', ' + secondary_place_name + ', ' + county
+
+    elif secondary_place_name != '':         # no street names (just building numbers) - small villages and other settlements
+        parsed_st_name = parse_place(secondary_place_name)
+        if not parsed_st_name:
+            return None
+        return parsed_st_name + ', ' + county
+
+    elif primary_place_name != '' and st_name_num != '':         # named streets and own postal code - large villages, towns, cities
+        parsed_st_name = correct_street(parse_street(st_name_num), primary_place_name, street_matcher)
+        if not parsed_st_name:
+            return None
+        if primary_place_name.lower() == county.lower():
+            return parsed_st_name + ', ' + primary_place_name
+        else:
+            return parsed_st_name + ', ' + primary_place_name + ', ' + county
 
-    # Config ----------------------------------------------------------------------------
+    return None
+
+
+def address_components(row, col_indxs, illegal_street_names=None, abbrev_dict=None, remove_abbrev=False,
+                       street_matcher=None):
+    """Splits the address columns of the spreadsheet row into parts
+
+    Uses the same branches as build_address, but keeps the building number apart from the street name.
+
+    Returns:
+        dict or None - number, street, city, county, state and postalcode, None if the row doesn't hold a valid address
+    """
+    parse_street = metrics.timed('parse_street_name', get_parser(illegal_street_names, abbrev_dict, remove_abbrev,
+                                                                 building_number_first=True))
+    parse_place = metrics.timed('parse_street_name', get_parser(illegal_street_names, building_number_first=True))
+
+    idx = col_indxs
+    st_name_num            = sanitize_value(row[idx['st_name_num']])
+    secondary_place_name   = sanitize_value(row[idx['secondary_place_name']])
+    postal_code            = sanitize_value(row[idx['postal_code']])
+    primary_place_name     = sanitize_value(row[idx['primary_place_name']])
+    county                 = sanitize_value(row[idx['county']])
+    province               = sanitize_value(row[idx['province']])
+
+    if secondary_place_name != '' and st_name_num != '':
+        city = secondary_place_name
+        parsed_st_name = correct_street(parse_street(st_name_num), city, street_matcher)
+    elif secondary_place_name != '':
+        parsed_st_name, city = parse_place(secondary_place_name), None
+    elif primary_place_name != '' and st_name_num != '':
+        city = primary_place_name
+        parsed_st_name = correct_street(parse_street(st_name_num), city, street_matcher)
+    else:
+        return None
+
+    if not parsed_st_name:
+        return None
+
+    if ', ' in parsed_st_name:
+        number, street = parsed_st_name.split(', ', 1)
+    else:
+        number, street = '', parsed_st_name
+    if city is None:  # '7, Lubkowo' - villages without street names
+        city, street = street, ''
+
+    return {'number': number, 'street': street, 'city': city,
+            'county': county if county.lower() != city.lower() else '',
+            'state': province, 'postalcode': postal_code}
+
+
+def build_structured_query(row, col_indxs, illegal_street_names=None, abbrev_dict=None, remove_abbrev=False,
+                           street_matcher=None):
+    """Builds the structured query string (see tools.structured) from the address columns of the spreadsheet row
+
+    Uses the same branches as build_address, but keeps postal code and province.
+
+    Returns:
+        string or None - None if the row doesn't hold a valid address
+    """
+    components = address_components(row, col_indxs, illegal_street_names, abbrev_dict, remove_abbrev,
+                                    street_matcher)
+    if components is None:
+        return None
+    components['street'] = (components.pop('number') + ' ' + components['street']).strip()
+    return query_text(components)
+
+
+def street_correction(row, col_indxs, street_matcher, illegal_street_names=None, abbrev_dict=None,
+                      remove_abbrev=False):
+    """Returns 'original -> corrected' street name of the row, '' if the street wasn't corrected"""
+    components = address_components(row, col_indxs, illegal_street_names, abbrev_dict, remove_abbrev)
+    if components is None or not components['street']:
+        return ''
+    corrected = street_matcher.correct(components['city'], components['street'])
+    if corrected == components['street']:
+        return ''
+    return f"{components['street']} -> {corrected}"
+
+
+def fallback_ladder(address):
+    """Returns list of queries for non-strict search - the address and all of its parts
+    left after dropping the parts before consecutive commas"""
+    ladder = [address]
+    while address.find(',') > -1:
+        address = address[address.find(',') + 1:].strip()  # drop the part before the comma
+        ladder.append(address)
+    return ladder
+
+
+def query_ladder(address, strict_search=False, structured=False):
+    """Returns list of queries resolve sends until something is found, the most specific first
+
+    Args:
+        address, strict_search, structured - see resolve
+
+    Returns:
+        list - query strings, empty if the address is incorrect
+    """
+    if not address:
+        return []
+    if strict_search:
+        street = parse_query_text(address).get('street', '') if structured else address
+        has_leading_number = re.match(r'^\d+\S*', street)  # Correct address must contain a building number
+        return [address] if has_leading_number else []
+    if structured:
+        return structured_ladder(parse_query_text(address))
+    return fallback_ladder(address)
+
+
+def resolve(address, session, cache=None, strict_search=False, limiter=None, url=None, ladder_cache=None,
+            structured=False):
+    """Geocodes the address, in non-strict mode relaxes the query until something is found
+
+    Args:
+        address       - (string or None) - query string built by build_address or build_structured_query
+        session       - requests.Session instance
+        cache         - (GeocodeCache, optional)
+        strict_search - (bool) - see README
+        limiter, url  - see geocode
+        ladder_cache  - (LadderCache, optional) - fallback ladder results shared by all rows
+        structured    - (bool) - address is a structured query string, tools.structured.structured_ladder
+                                 is used instead of dropping the parts before commas
+
+    Returns:
+        tuple - (gc, final query string)
+    """
+    ladder = query_ladder(address, strict_search, structured)
+    if not ladder:
+        return FakeGC(False, u"ERROR - INCORRECT ADDRESS"), address
+
+    for depth, query in enumerate(ladder):
+        # the full address is always queried, the fallback queries known to give no results are skipped
+        if depth and ladder_cache is not None and ladder_cache.skip(query):
+            continue
+        log.debug('query: %s', query)
+        gc = ladder_cache.get(query) if ladder_cache is not None else None
+        if gc is None:
+            gc, _ = geocode(query, session, cache, limiter, url, structured)
+            if ladder_cache is not None and depth:  # full addresses rarely repeat, fallback queries do
+                ladder_cache.add(query, gc)
+        queried = depth
+        if 'No results' not in gc.status:
+            break
+
+    metrics.count('fallback_depth', queried)  # 0 - the full address, 1 - its first part dropped etc.
+    return gc, ladder[queried]
+
+
+def open_cache(cache_config):
+    """Returns GeocodeCache configured by the `cache` section of config.yaml, None if it's disabled"""
+    if not cache_config:
+        return None
+    ttl_days = cache_config.get('ttl_days')
+    return GeocodeCache(cache_config['path'], ttl=ttl_days * 86400 if ttl_days else None,
+                        max_entries=cache_config.get('max_entries'))
+
+
+def open_gazetteer(gazetteer_config, address_config=None):
+    """Returns Gazetteer configured by the `gazetteer` section of config.yaml, None if it's disabled
+
+    Street names of the gazetteer are parsed with `abbrev_expansions` and `remove_abbrev` of the `address` section.
+    """
+    if not gazetteer_config:
+        return None
+    address_config = address_config or {}
+    return Gazetteer.open(gazetteer_config['path'], gazetteer_config.get('index_path'),
+                          gazetteer_config['columns'], gazetteer_config.get('delimiter') or ',',
+                          address_config.get('abbrev_expansions'), address_config.get('remove_abbrev'))
+
+
+def open_street_matcher(street_dictionary_config):
+    """Returns StreetMatcher configured by the `street_dictionary` section of config.yaml, None if it's disabled"""
+    if not street_dictionary_config:
+        return None
+    return StreetMatcher.open(street_dictionary_config['path'], street_dictionary_config['columns'],
+                              street_dictionary_config.get('delimiter') or ',',
+                              street_dictionary_config.get('min_similarity') or 0.8)
 
-    config = load_config('config.yaml')
 
-    xls_path = config['xls']['path']
-    xls_name = os.path.splitext(os.path.basename(xls_path))[0]
-    xls_has_header = config['xls']['has_header']
-    xls_min_row = config['xls']['min_row']
-    xls_max_row = config['xls']['max_row']
-    xls_max_column = config['xls']['max_column']
+def output_formats(output_config):
+    """Returns list of the formats of the `output` section of config.yaml, raises ValueError for an unknown one"""
+    formats = (output_config or {}).get('format') or ['shp']
+    if isinstance(formats, str):
+        formats = [fmt.strip() for fmt in formats.split(',')]
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f'Unknown output format: {", ".join(unknown)}, use {", ".join(OUTPUT_FORMATS)}')
+    return formats
 
-    address_columns_indxs = config['address']['col_indxs']
+
+def open_sink(output_format, path, fields, extra_fields=(), epsg=4326):
+    """Returns sink of the found rows
+
+    Args:
+        output_format - (string) - 'shp', 'gpkg' (GeoPackage) or 'geojsonl' (GeoJSON Lines, always WGS 84)
+        path          - (string) - output location without extension
+        fields        - (list) - fields of the row values, e.g. from profile_fields
+        extra_fields  - (list) - fields of Item.extra values
+        epsg          - (int) - EPSG code of the output coordinates
+    """
+    if output_format == 'gpkg':
+        return GeoPackageSink(path + '.gpkg', layer_name(os.path.basename(path)), fields, extra_fields, epsg)
+    if output_format == 'geojsonl':
+        return GeoJSONLSink(path + '.geojsonl', [field[0] for field in fields],
+                            [field[0].lower() for field in extra_fields])
+    return ShapefileSink(path, fields, extra_fields, epsg)
+
+
+def output_name(xls_path, sheet=None):
+    """Returns base name of the outputs of the worksheet - the workbook's name, followed by the sheet's name if given"""
+    name = os.path.splitext(os.path.basename(xls_path))[0]
+    if sheet:
+        name += '_' + re.sub(r'[^\w\-]+', '_', sheet)
+    return name
+
+
+def plan_settings(config, xls_path=None, sheet=None):
+    """Returns everything the queries depend on, a plan made with different settings can't be used"""
+    xls_path = xls_path or config['xls']['path']
+    geocoder_config = config.get('geocoder') or {}
+    return {
+        'xls': {key: config['xls'].get(key) for key in ('has_header', 'min_row', 'max_row', 'max_column')},
+        'xls_path': xls_path,
+        'sheet': sheet,
+        'xls_modified': os.path.getmtime(xls_path),
+        'address': config['address'],
+        'strict_search': config['strict_search'],
+        'structured': geocoder_config.get('query_mode') == 'structured',
+        'gazetteer': config.get('gazetteer'),
+        'street_dictionary': config.get('street_dictionary'),
+    }
+
+
+def address_stages(config, gazetteer=None, street_matcher=None, plan_path=None):
+    """Returns (stage building the queries of the rows, gazetteer LookupStage or None)
+
+    With `plan_path` the queries and gazetteer results are read from the plan made by plan_sheet.
+    """
+    if plan_path:
+        return PlanStage(plan_path), None
+
+    col_indxs = config['address']['col_indxs']
     illegal_street_names = config['address']['illegal_street_names']
     abbrev_dict = config['address']['abbrev_expansions']
     remove_abbrev = config['address']['remove_abbrev']
+    structured = (config.get('geocoder') or {}).get('query_mode') == 'structured'
+
+    def street_fix(row):
+        return [street_correction(row, col_indxs, street_matcher, illegal_street_names, abbrev_dict, remove_abbrev)]
+
+    def gazetteer_lookup(item):
+        components = address_components(item.row, col_indxs, illegal_street_names, abbrev_dict, remove_abbrev,
+                                        street_matcher)
+        return gazetteer.lookup_gc(components['city'], components['street'], components['number'])
+
+    build = build_structured_query if structured else build_address
+    address_stage = AddressStage(partial(build, col_indxs=col_indxs, illegal_street_names=illegal_street_names,
+                                         abbrev_dict=abbrev_dict, remove_abbrev=remove_abbrev,
+                                         street_matcher=street_matcher),
+                                 extra=street_fix if street_matcher is not None else None)
+    gazetteer_stage = LookupStage(gazetteer_lookup, 'gazetteer') if gazetteer is not None else None
+    return address_stage, gazetteer_stage
+
+
+def xlsx_source(config, xls_path=None, sheet=None):
+    return XlsxSource(xls_path or config['xls']['path'], sheet, has_header=config['xls']['has_header'],
+                      min_row=config['xls']['min_row'], max_row=config['xls']['max_row'],
+                      max_col=config['xls']['max_column'])
+
+
+def plan_sheet(config, plan_path, xls_path=None, sheet=None, limiter=None, cache=None, gazetteer=None,
+               street_matcher=None):
+    """Builds the queries of the worksheet without sending them, saves them to the plan file
+
+    Args:
+        config    - (dict) - contents of config.yaml
+        plan_path - (string) - plan file location
+        xls_path  - (string, optional) - workbook location, None - xls.path of the config
+        sheet     - (string, optional) - worksheet name, None - the active one
+        limiter, cache, gazetteer, street_matcher - see geocode_sheet
+
+    Returns:
+        dict - tools.plan.Planner report
+    """
+    geocoder_config = config.get('geocoder') or {}
+    limiter = limiter or limiter_from_config(geocoder_config)
+    structured = geocoder_config.get('query_mode') == 'structured'
+
+    address_stage, gazetteer_stage = address_stages(config, gazetteer, street_matcher)
+    planner = Planner(partial(query_ladder, strict_search=config['strict_search'], structured=structured),
+                      cache, limiter.rate)
+    items = iter(xlsx_source(config, xls_path, sheet))
+    for stage in [address_stage, gazetteer_stage, planner]:
+        if stage is not None:
+            items = stage(items)
+    with PlanWriter(plan_path, plan_settings(config, xls_path, sheet)) as plan:
+        for item in items:
+            plan.write(item)
+        report = planner.report()
+        plan.close(report)
+    return report
+
+
+def geocode_sheet(config, output_dir, xls_path=None, sheet=None, limiter=None, cache=None, gazetteer=None,
+                  street_matcher=None, resume=False, plan_path=None, previous_output=None):
+    """Geocodes rows of the worksheet, saves the found rows, NO_RESULTS spreadsheet and journal in output_dir
+
+    Args:
+        config          - (dict) - contents of config.yaml
+        output_dir      - (string) - created if it doesn't exist
+        xls_path        - (string, optional) - workbook location, None - xls.path of the config
+        sheet           - (string, optional) - worksheet name, None - the active one. Outputs are named
+                                               after the workbook and the sheet (see output_name)
+        limiter         - (TokenBucket, optional) - None - configured by the `geocoder` section
+        cache           - (GeocodeCache, optional)
+        gazetteer       - (Gazetteer, optional)
+        street_matcher  - (StreetMatcher, optional)
+        resume          - (bool) - rows logged in the journal of output_dir are not geocoded again
+        plan_path       - (string, optional) - queries are read from the plan made by plan_sheet
+        previous_output - (string, optional) - output directory of a previous run, found rows whose address
+                                               columns didn't change are copied from its shapefile
 
+    Returns:
+        dict - numbers of rows, found rows, queries etc., saved with the run metrics (tools.metrics)
+               to report.json in output_dir
+    """
+    metrics.reset()
+    started = datetime.datetime.now()
+    start = time.perf_counter()
+    xls_path = xls_path or config['xls']['path']
+    geocoder_config = config.get('geocoder') or {}
+    nominatim_url = geocoder_config.get('url')
+    concurrency = geocoder_config.get('concurrency') or 1
+    structured = geocoder_config.get('query_mode') == 'structured'
     strict_search = config['strict_search']
+    limiter = limiter or limiter_from_config(geocoder_config)
+    max_retries = geocoder_config.get('max_retries')
+    backoff = Backoff(delay=geocoder_config.get('retry_delay') or 2.0,
+                      attempts=3 if max_retries is None else max_retries)
+    output_epsg = (config.get('output') or {}).get('epsg') or 4326
+    formats = output_formats(config.get('output'))
+
+    name = output_name(xls_path, sheet)
+    output_shp_path = os.path.join(output_dir, name)  # shapefile package ignores file extensions
+    no_results_xls_path = os.path.join(output_dir, 'NO_RESULTS_' + name + '.xlsx')
+    journal_path = os.path.join(output_dir, 'journal.jsonl')
+    report_path = os.path.join(output_dir, 'report.json')
+    changes_path = os.path.join(output_dir, 'CHANGES_' + name + '.csv')
+
+    extra_fields = []  # fields of Item.extra values
+    if config.get('street_dictionary'):
+        extra_fields.append(['STREET_FIX', 'C', 255])
+
+    source = xlsx_source(config, xls_path, sheet)
+    if config['xls']['has_header']:
+        column_headers = source.header
+    else:
+        column_headers = ['' for i in range(source.width)]
+    no_results_header = column_headers + FAILURE_COLUMNS + [field[0].lower() for field in extra_fields]
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Rows geocoded before the interruption - {spreadsheet row number: (gc, query)},
+    # timeouts and server errors are geocoded again
+    journaled = Journal.load(journal_path, skip_transient=True) if resume else {}
+    if journaled:
+        log.info('Resuming: %d rows restored from %s', len(journaled), journal_path)
+
+    # shp fields are fitted to the values of the rows
+    fields_config = profile_fields(source, config['xls'].get('profile_rows'))
+
+    if previous_output:
+        previous_shp_path = find_previous_shapefile(previous_output, name)
+        previous_failures_path = os.path.join(os.path.dirname(previous_shp_path), 'NO_RESULTS_' +
+                                              os.path.splitext(os.path.basename(previous_shp_path))[0] + '.xlsx')
+        previous = PreviousResults(previous_shp_path, config['address']['col_indxs'],
+                                   previous_failures_path if os.path.exists(previous_failures_path) else None)
+        log.info('Incremental: %d found addresses read from %s', len(previous), previous_shp_path)
+        previous_stage = PreviousRunStage(previous, config['address']['col_indxs'], changes_path)
+    else:
+        previous_stage = None
+
+    log.info('Geocoding %s%s...', xls_path, f' [{sheet}]' if sheet else '')
+
+    cache_hits, cache_misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    with ExitStack() as outputs, Journal(journal_path) as journal, FailureSink(no_results_xls_path, no_results_header) as no_results, \
+            Session() as session:
+
+        sinks = []
+        for output_format in formats:
+            sinks.append(open_sink(output_format, output_shp_path, fields_config, extra_fields, output_epsg))
+            # buffered points are written on close, its time counts as the sink's too
+            outputs.callback(metrics.timed('sink.' + type(sinks[-1]).__name__, sinks[-1].close))
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        ladder_cache = LadderCache(cache)
+
+        def resolve_address(address):
+            return resolve(address, session, cache, strict_search, limiter, nominatim_url, ladder_cache,
+                           structured)
+
+        address_stage, gazetteer_stage = address_stages(config, gazetteer, street_matcher, plan_path)
+        journal_stage = KnownResultsStage(journaled, 'journal')
+        resolve_stage = ResolveStage(resolve_address, concurrency)
+        retry_stage = RetryStage(resolve_address, backoff)
+
+        # rows found in the previous run or the gazetteer are not queried, rows sharing an address
+        # are queried once, timeouts and server errors are retried at the end
+        stages = [address_stage]
+        if previous_stage is not None:
+            stages.append(previous_stage)
+        stages.append(journal_stage)
+        if gazetteer_stage is not None:
+            stages.append(gazetteer_stage)
+        stages.append(resolve_stage)
+        if backoff.attempts:
+            stages.append(retry_stage)
+        stages.append(JournalStage(journal))
+
+        pipeline = Pipeline(source, stages, sinks=sinks, failure_sink=no_results)
+        corrected_streets = 0
+        next_progress = time.perf_counter() + PROGRESS_INTERVAL
+        for item in pipeline:
+            gc = item.gc
+            if extra_fields and item.extra[0]:
+                corrected_streets += 1
+            if gc.ok:
+                metrics.count('confidence', gc.confidence)
+                log.debug('row %d: LAT %s; LNG %s; confidence: %s', item.number, gc.lat, gc.lng, gc.confidence)
+            else:
+                log.debug('row %d: %s (status:%s, timeout:%s)', item.number, gc.status, gc.status_code, gc.timeout)
+            if time.perf_counter() >= next_progress:
+                next_progress = time.perf_counter() + PROGRESS_INTERVAL
+                log.info('%d rows, %d found, %.1f rows/s', pipeline.rows, pipeline.found,
+                         pipeline.rows / (time.perf_counter() - start))
+
+    gazetteer_hits = gazetteer_stage.resolved if gazetteer_stage is not None else getattr(address_stage, 'resolved', 0)
+    summary = {
+        'xls': xls_path,
+        'sheet': sheet,
+        'output': output_shp_path,
+        'rows': pipeline.rows,
+        'found': pipeline.found,
+        'rejected': address_stage.rejected,
+        'restored': journal_stage.resolved,
+        'geocoded': resolve_stage.submitted,
+        'skipped_fallback_queries': ladder_cache.skipped,
+        'deferred': retry_stage.deferred,
+        'retries': retry_stage.retries,
+        'recovered': retry_stage.recovered,
+        'failed_after_retries': retry_stage.failed,
+        'corrected_streets': corrected_streets,
+        'gazetteer_hits': gazetteer_hits,
+        'copied': previous_stage.copied if previous_stage is not None else 0,
+        'not_found_before': previous_stage.not_found if previous_stage is not None else 0,
+        'new_or_changed': previous_stage.changed if previous_stage is not None else 0,
+        'removed': previous_stage.removed if previous_stage is not None else 0,
+        'cache_hits': cache.hits - cache_hits if cache is not None else 0,
+        'cache_misses': cache.misses - cache_misses if cache is not None else 0,
+    }
+
+    seconds = time.perf_counter() - start
+    write_report(report_path, summary, started, seconds)
+
+    log.info('%d rows (%d found), %d without a valid address, %d restored from the journal, '
+             '%d addresses geocoded in %.1f s', summary['rows'], summary['found'], summary['rejected'],
+             summary['restored'], summary['geocoded'], seconds)
+    if previous_stage is not None:
+        log.info('Changes: %d rows unchanged (copied), %d not found before, %d new or changed, '
+                 '%d addresses removed - see %s', summary['copied'], summary['not_found_before'],
+                 summary['new_or_changed'], summary['removed'], changes_path)
+    log.info('Fallback queries skipped thanks to known misses: %d', summary['skipped_fallback_queries'])
+    if summary['deferred']:
+        log.info('Transient errors: %d rows retried (%d queries), %d recovered, %d failed', summary['deferred'],
+                 summary['retries'], summary['recovered'], summary['failed_after_retries'])
+    if limiter.slowdowns:
+        log.warning('Rate limit lowered %d times after HTTP 429, final rate: %g requests/s',
+                    limiter.slowdowns, limiter.rate)
+    if extra_fields:
+        log.info('Street names corrected: %d rows', corrected_streets)
+    if gazetteer is not None or gazetteer_hits:
+        log.info('Gazetteer: %d hits', gazetteer_hits)
+    if cache is not None:
+        log.info('Cache: %d hits, %d misses', summary['cache_hits'], summary['cache_misses'])
+    log.info('Run report saved to %s', report_path)
+    return summary
+
+
+def write_report(path, summary, started, seconds):
+    """Saves the summary of geocode_sheet and the run metrics (see tools.metrics) as JSON"""
+    report = {
+        'version': REPORT_VERSION,
+        'started': started.isoformat(timespec='seconds'),
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(summary['rows'] / seconds, 3) if seconds else None,
+        'summary': summary,
+        'metrics': metrics.report(),
+    }
+    with open(path, 'w', encoding='utf-8') as writer:
+        json.dump(report, writer, ensure_ascii=False, indent=2)
+
+
+def find_previous_shapefile(previous_output, name):
+    """Returns path of the shapefile <name>.shp in the previous output directory, or of the only shapefile there
+
+    Raises FileNotFoundError if there's none.
+    """
+    path = os.path.join(previous_output, name + '.shp')
+    if os.path.exists(path):
+        return path
+    paths = glob.glob(os.path.join(previous_output, '*.shp'))
+    if len(paths) == 1:
+        return paths[0]
+    raise FileNotFoundError(f'{name}.shp not found in {previous_output}')
 
-    now = datetime.datetime.now()
-    timestamp = now.strftime('%Y-%m-%d_%H-%M-%S')
-    output_dir = 'output_' + timestamp
 
-    output_shp_name = xls_name  # shapefile package ignores file extensions
-    output_shp_path = os.path.join(output_dir, output_shp_name)
+def batch_jobs(pattern, sheets=None):
+    """Returns (workbook path, sheet name) of every selected worksheet
 
-    no_results_xls_name = 'NO_RESULTS_' + xls_name + '.xlsx'
-    no_results_xls_path = os.path.join(output_dir, no_results_xls_name)
+    Args:
+        pattern - (string) - directory (all its .xlsx files) or glob pattern, e.g. 'incoming/*/*.xlsx'
+        sheets  - (list, optional) - sheet names or glob patterns (e.g. 'Dane*'), None - the active sheet
+                                     (sheet name None)
+    """
+    paths = glob.glob(os.path.join(pattern, '*.xlsx') if os.path.isdir(pattern) else pattern)
+    jobs = []
+    for path in sorted(paths):
+        if os.path.basename(path).startswith('~$'):  # Excel's lock files
+            continue
+        if not sheets:
+            jobs.append((path, None))
+            continue
+        wb = load_workbook(path, read_only=True)
+        names = wb.sheetnames
+        wb.close()
+        jobs += [(path, name) for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in sheets)]
+    return jobs
+
+
+_worker = {}  # config and resources of a batch worker process
+
+
+def set_log_level(level):
+    """Sets level of the root logger, the geocoder package's line per request is shown at DEBUG only"""
+    root = logging.getLogger()
+    root.setLevel(level)
+    logging.getLogger('geocoder').setLevel(logging.NOTSET if root.level <= logging.DEBUG else logging.WARNING)
+
+
+def _init_worker(config, limiter, log_level=logging.INFO):
+    # handlers inherited from the parent process (fork) would mix the outputs of the jobs
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    set_log_level(log_level)
+    _worker.update(config=config, limiter=limiter, cache=open_cache(config.get('cache')),
+                   gazetteer=open_gazetteer(config.get('gazetteer'), config.get('address')),
+                   street_matcher=open_street_matcher(config.get('street_dictionary')))
+
+
+def _geocode_job(output_dir, xls_path, sheet, resume, previous_output):
+    """Geocodes the worksheet in a worker process, its output goes to <output_dir>/<output_name>/log.txt"""
+    name = output_name(xls_path, sheet)
+    job_dir = os.path.join(output_dir, name)
+    os.makedirs(job_dir, exist_ok=True)
+    # sheets that are new in this batch have no previous output
+    previous_dir = os.path.join(previous_output, name) if previous_output else None
+    if previous_dir and not os.path.isdir(previous_dir):
+        previous_dir = None
+    handler = logging.FileHandler(os.path.join(job_dir, 'log.txt'), encoding='utf-8')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        return geocode_sheet(_worker['config'], job_dir, xls_path, sheet, _worker['limiter'], _worker['cache'],
+                             _worker['gazetteer'], _worker['street_matcher'], resume,
+                             previous_output=previous_dir)
+    except Exception:
+        log.exception('Geocoding of %s failed', name)
+        raise
+    finally:
+        root.removeHandler(handler)
+        handler.close()
 
-    delay = 1.2  # OSM query delay, >1s gets you banned
 
-    additional_shp_fields = [
-        ['QUERY', 'C', 255],
-        ['OSM_ANSW', 'C', 255],
-        ['CONFIDENCE', 'F', 5, 2]
-    ]
+def geocode_batch(config, jobs, output_dir, workers=None, resume=False, previous_output=None,
+                  log_level=logging.INFO):
+    """Geocodes the worksheets in parallel worker processes, yields (job, summary or exception) as they finish
 
-    # Main -------------------------------------------------------------------------------
+    Every worksheet gets its own subdirectory of output_dir. The workers share one rate limiter
+    (tools.ratelimit.SharedTokenBucket), so together they never exceed the configured rate, and
+    the SQLite cache, so an address geocoded by one of them is not queried by the others.
 
-    wb = load_workbook(xls_path, read_only=True)
-    ws = wb.active
-    rows = ws.iter_rows(min_row=xls_min_row, max_row=xls_max_row,
-                        max_col=xls_max_column, values_only=True)
+    Args:
+        config     - (dict) - contents of config.yaml
+        jobs       - (list) - (workbook path, sheet name) tuples, see batch_jobs
+        output_dir - (string)
+        workers    - (int, optional) - number of worker processes, None - number of CPUs
+        resume     - (bool) - continue an interrupted batch in output_dir
+        previous_output - (string, optional) - output directory of a previous batch, see geocode_sheet
+        log_level  - (int or string) - level of the log.txt messages of the worksheets, e.g. 'DEBUG'
+    """
+    limiter = limiter_from_config(config.get('geocoder'), shared=True)
+    workers = min(workers or os.cpu_count() or 1, len(jobs)) or 1
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(config, limiter, log_level)) as executor:
+        futures = {executor.submit(_geocode_job, output_dir, xls_path, sheet, resume, previous_output):
+                   (xls_path, sheet) for xls_path, sheet in jobs}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
 
-    fields_config = get_fields_properties_from_worksheet(ws, xls_has_header)
-    shp_fields_config = fields_config + additional_shp_fields
 
-    no_results_wb = Workbook()
-    no_results_ws = no_results_wb.active
-    no_results_ws.title = 'No result'
-    if xls_has_header:
-        column_headers = [field_property[0] for field_property in fields_config]
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Geocodes addresses from Excel spreadsheets and saves the results as shp files.')
+    parser.add_argument('--resume', metavar='OUTPUT_DIR',
+                        help='continue an interrupted run, rows logged in its journal are not geocoded again')
+    parser.add_argument('--plan', metavar='PLAN_FILE',
+                        help='dry run: build the queries without sending them, save them to PLAN_FILE '
+                             'and estimate the number of queries and the run time')
+    parser.add_argument('--from-plan', metavar='PLAN_FILE',
+                        help='geocode the queries saved by --plan instead of building them again')
+    parser.add_argument('--batch', metavar='DIR_OR_PATTERN',
+                        help='geocode every workbook in the directory or matching the glob pattern (e.g. "in/*.xlsx") '
+                             'instead of xls.path, in parallel processes')
+    parser.add_argument('--sheets', metavar='NAMES',
+                        help='comma separated names or patterns of the sheets to geocode (e.g. "Sheet1,Dane*", '
+                             '"*" - all sheets), default - the active sheet')
+    parser.add_argument('--incremental', metavar='PREVIOUS_OUTPUT_DIR',
+                        help='copy results of the rows whose address didn\'t change since the previous run, '
+                             'geocode only new and changed rows')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='number of --batch processes, default - number of CPUs')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG - also the queries and the result of every row, default - INFO '
+                             '(progress and summaries)')
+    args = parser.parse_args()
+    logging.basicConfig(format=LOG_FORMAT)
+    set_log_level(args.log_level)
+    if args.resume and not os.path.isdir(args.resume):
+        parser.error(f'output directory not found: {args.resume}')
+    if args.plan and (args.resume or args.from_plan):
+        parser.error('--plan can\'t be used with --resume or --from-plan')
+    if args.from_plan and not os.path.isfile(args.from_plan):
+        parser.error(f'plan file not found: {args.from_plan}')
+    if args.incremental and not os.path.isdir(args.incremental):
+        parser.error(f'previous output directory not found: {args.incremental}')
+    if args.incremental and args.plan:
+        parser.error('--incremental can\'t be used with --plan')
+    if args.batch and (args.plan or args.from_plan):
+        parser.error('--batch can\'t be used with --plan or --from-plan')
+    if args.sheets and not args.batch:
+        parser.error('--sheets can only be used with --batch, which also takes a single workbook, '
+                     'e.g. --batch data.xlsx')
+
+    config = load_config('config.yaml')
+
+    output_epsg = (config.get('output') or {}).get('epsg') or 4326
+    get_crs(output_epsg)  # unsupported codes and formats fail before geocoding starts
+    output_formats(config.get('output'))
+
+    if args.resume:
+        output_dir = args.resume
+    else:
+        now = datetime.datetime.now()
+        timestamp = now.strftime('%Y-%m-%d_%H-%M-%S')
+        output_dir = 'output_' + timestamp
+
+    if args.batch:
+        sheets = [name.strip() for name in args.sheets.split(',')] if args.sheets else None
+        jobs = batch_jobs(args.batch, sheets)
+        if not jobs:
+            parser.error(f'no worksheets found: {args.batch}')
+        log.info('Geocoding %d worksheets, output in %s', len(jobs), output_dir)
+        failed = 0
+        for (xls_path, sheet), summary in geocode_batch(config, jobs, output_dir, args.workers, bool(args.resume),
+                                                        args.incremental, args.log_level):
+            label = f'{xls_path} [{sheet}]' if sheet else xls_path
+            if isinstance(summary, Exception):
+                failed += 1
+                log.error('%s: FAILED - %r', label, summary, exc_info=summary)
+            else:
+                log.info('%s: %d of %d rows found, %d addresses geocoded, %d cache hits', label, summary['found'],
+                         summary['rows'], summary['geocoded'], summary['cache_hits'])
+        log.info('%d worksheets geocoded, %d failed', len(jobs) - failed, failed)
+        raise SystemExit(1 if failed else 0)
+
+    if args.from_plan:
+        try:
+            changed = plan_differences(args.from_plan, plan_settings(config))
+        except ValueError as e:
+            parser.error(str(e))
+        if changed:
+            parser.error(f'{", ".join(changed)} changed since the plan was made, make a new one with --plan')
+
+    limiter = limiter_from_config(config.get('geocoder'))
+    cache = open_cache(config.get('cache'))
+
+    # addresses and gazetteer results of a plan are read from it
+    gazetteer = street_matcher = None
+    if config.get('gazetteer') and not args.from_plan:
+        log.info('Loading gazetteer...')
+        gazetteer = open_gazetteer(config['gazetteer'], config['address'])
+    if config.get('street_dictionary') and not args.from_plan:
+        log.info('Loading street dictionary...')
+        street_matcher = open_street_matcher(config['street_dictionary'])
+
+    if args.plan:
+        report = plan_sheet(config, args.plan, limiter=limiter, cache=cache, gazetteer=gazetteer,
+                            street_matcher=street_matcher)
+
+        def duration(seconds):
+            return str(datetime.timedelta(seconds=round(seconds))) if seconds is not None else 'unknown'
+
+        log.info('Plan saved to %s, geocode it with: python xl_geocoder.py --from-plan %s', args.plan, args.plan)
+        log.info('Rows:                      %d', report['rows'])
+        log.info('Invalid addresses:         %d', report['rejected'])
+        if gazetteer is not None:
+            log.info('Found in the gazetteer:    %d', report['resolved_locally'])
+        log.info('Distinct queries:          %d', report['distinct_queries'])
+        log.info('Answered by the cache:     %d', report['cache_hits'])
+        log.info('Network queries:           %d (best case) - %d (worst case, every fallback query sent)',
+                 report['best_case_queries'], report['worst_case_queries'])
+        log.info('Estimated time at %s requests/s: %s - %s', report['rate_limit'],
+                 duration(report['best_case_seconds']), duration(report['worst_case_seconds']))
     else:
-        column_headers = ['' for field_property in fields_config]
-    no_results_ws.append(column_headers + ['query', 'gc_status', 'gc_status_code', 'gc_timeout'])
-
-
-    print('\n' + 'GEOCODING...' + '\n')
-
-    with shapefile.Writer(output_shp_path, 1) as shp:
-
-        add_fields_to_shp(shp, shp_fields_config)
-        create_prj_file(output_shp_path + '.prj', 4326, 'GCS_WGS_1984')
-
-        with Session() as session:
-
-            for i, row in enumerate(rows):
-
-                print(i + xls_min_row)
-
-                idx = address_columns_indxs
-                st_name_num            = sanitize_value(row[idx['st_name_num']])
-                secondary_place_name   = sanitize_value(row[idx['secondary_place_name']])
-                postal_code            = sanitize_value(row[idx['postal_code']])  # currently not in use
-                primary_place_name     = sanitize_value(row[idx['primary_place_name']])
-                county                 = sanitize_value(row[idx['county']])
-                province               = sanitize_value(row[idx['province']])  # currently not in use
-
-
-                if secondary_place_name != '' and st_name_num != '':     # named streets, shared postal code - villages
-                    print(f'      data: {st_name_num}, {secondary_place_name}')
-                    parsed_st_name = parse_street_name(street_name=st_name_num, name_filter=illegal_street_names,
-                                                  expand_abbrev=abbrev_dict, remove_abbrev=remove_abbrev, building_number_first=True)
-                    address = parsed_st_name + ', ' + secondary_place_name + ', ' + county
-
-                elif secondary_place_name != '':         # no street names (just building numbers) - small villages and other settlements
-                    print(f'      data: {secondary_place_name}')
-                    parsed_st_name = parse_street_name(street_name=secondary_place_name, name_filter=illegal_street_names,
-                                                  building_number_first=True)
-                    address = parsed_st_name + ', ' + county
-
-                elif primary_place_name != '' and st_name_num != '':         # named streets and own postal code - large villages, towns, cities
-                    print(f'      data: {st_name_num}, {primary_place_name}')
-                    parsed_st_name = parse_street_name(street_name=st_name_num, name_filter=illegal_street_names,
-                                                  expand_abbrev=abbrev_dict, remove_abbrev=remove_abbrev, building_number_first=True)
-                    if primary_place_name.lower() == county.lower():
-                        address = parsed_st_name + ', ' + primary_place_name
-                    else:
-                        address = parsed_st_name + ', ' + primary_place_name + ', ' + county
-                else:
-                    address = None
-
-
-                if strict_search:
-                    has_leading_number = re.match(r'^\d+\S*', address)  # Correct address must contain a building number
-
-                    if address and has_leading_number:
-                        gc = geocoder.osm(address, session=session)
-                    else:
-                        gc = FakeGC(False, u"ERROR - INCORRECT ADDRESS")
-                else:
-                    if address:
-                        print(f'     query: {address}')
-                        gc = geocoder.osm(address, session=session)
-
-                        while 'No results' in gc.status and address.find(',') > -1:  #  if no result
-                            i = address.find(',')
-                            if i > -1:
-                                address = address[i+1:]  # drop the part before the comma
-                                sleep(delay)
-                                print(f'     query: {address}')
-                                gc = geocoder.osm(address, session=session)
-                    else:
-                        gc = FakeGC(False, u"ERROR - INCORRECT ADDRESS")
-
-
-                if gc.ok:
-                    confidence = gc.current_result.confidence
-                    shp.point(gc.lng, gc.lat)
-                    shp.record(*row, address, gc.osm, confidence)
-                    print(f'    result: LAT {gc.lat}; LNG {gc.lng}; confidence: {confidence}')
-                else:
-                    print(f'       {gc.status} (status:{gc.status_code}, timeout:{gc.timeout})')
-                    no_results_ws.append(row + (address, gc.status, gc.status_code, gc.timeout))
-                    try:
-                        no_results_wb.save(no_results_xls_path)
-                    except Exception:
-                        no_results_wb.save(
-                            no_results_xls_path.replace(xls_name, xls_name + '_alt'))
-
-                sleep(delay)
+        geocode_sheet(config, output_dir, limiter=limiter, cache=cache, gazetteer=gazetteer,
+                      street_matcher=street_matcher, resume=bool(args.resume), plan_path=args.from_plan,
+                      previous_output=args.incremental)
+
+    if cache is not None:
+        cache.close()